@@ -0,0 +1,1284 @@
+#!/usr/bin/env python3
+"""
+Benchmarks for the Python Workers notebook services
+Run from the repository root: python scripts/bench_marimo_service.py <name>
+"""
+
+import argparse
+import asyncio
+import multiprocessing
+import os
+import random
+import re
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+from types import SimpleNamespace
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+
+
+def make_notebook(size_bytes: int, seed: int = 0) -> str:
+    """Build a synthetic Marimo notebook of roughly ``size_bytes``."""
+    header = "import marimo\n\napp = marimo.App()\n\n"
+    cells = []
+    index = 0
+    while len(header) + sum(len(c) for c in cells) < size_bytes:
+        cells.append(
+            f"@app.cell\n"
+            f"def cell_{seed}_{index}(mo):\n"
+            f"    value_{index} = {index} * 2  # synthetic cell {index}\n"
+            f"    mo.md(f\"Value {index}: {{value_{index}}}\")\n"
+            f"    return (value_{index},)\n\n"
+        )
+        index += 1
+    return header + "".join(cells)
+
+
+def bench_dedup(args) -> None:
+    """Store the same 1 MB notebook many times and report memory growth."""
+    from marimo_service import MarimoService
+
+    service = MarimoService()
+    notebook = make_notebook(1024 * 1024)
+
+    tracemalloc.start()
+    service.store_content(notebook, prefix="viewer")
+    baseline, _ = tracemalloc.get_traced_memory()
+
+    start = time.perf_counter()
+    for _ in range(args.iterations):
+        service.store_content(notebook, prefix="viewer")
+    elapsed = time.perf_counter() - start
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    stats = service.get_store_stats()
+    print(f"stored {args.iterations + 1} x {len(notebook)} bytes in {elapsed:.2f}s")
+    print(f"traced memory after first store: {baseline / 1e6:.2f} MB")
+    print(f"traced memory after all stores:  {current / 1e6:.2f} MB (peak {peak / 1e6:.2f} MB)")
+    print(f"unique notebooks: {stats['entries']}, store bytes: {stats['bytes']}, "
+          f"dedup hits: {stats['dedup_hits']}")
+
+
+def make_generated_notebook(cells: int) -> str:
+    """Build a notebook shaped like AIService output (docstrings, prints, comments)."""
+    parts = ["import marimo\n\napp = marimo.App()\n\n"]
+    for index in range(cells):
+        parts.append(
+            f"@app.cell\n"
+            f"def step_{index}(mo, data):\n"
+            f"    \"\"\"\n"
+            f"    Step {index}: transform the data produced by the previous step.\n"
+            f"    Handles missing values and reports progress to the user.\n"
+            f"    \"\"\"\n"
+            f"    try:\n"
+            f"        result_{index} = [value * {index + 1} for value in data if value is not None]\n"
+            f"    except Exception as error:\n"
+            f"        print(f\"Step {index} failed: {{error}}\")\n"
+            f"        result_{index} = []\n"
+            f"    mo.md(f\"**Step {index}** produced {{len(result_{index})}} values\")\n"
+            f"    return (result_{index},)\n\n"
+        )
+    parts.append('if __name__ == "__main__":\n    app.run()\n')
+    return "".join(parts)
+
+
+def bench_compression(args) -> None:
+    """Report stored bytes and wire bytes per notebook, raw vs compressed."""
+    from marimo_service import MarimoService
+
+    service = MarimoService()
+    print(f"{'cells':>6} {'raw bytes':>10} {'stored':>8} {'ratio':>6} "
+          f"{'wire (identity)':>16} {'wire (encoded)':>15} {'encode ms':>10}")
+    for cells in (5, 20, 100, 500):
+        notebook = make_generated_notebook(cells)
+        start = time.perf_counter()
+        server_id = service.store_content(notebook)
+        encode_ms = (time.perf_counter() - start) * 1000
+        stored = service.notebooks.peek(service.resolve_digest(server_id))
+        identity, _ = service.get_notebook_encoded(server_id, None)
+        encoded, encoding = service.get_notebook_encoded(server_id, "gzip, deflate, br")
+        raw = len(notebook.encode("utf-8"))
+        print(f"{cells:>6} {raw:>10} {stored['size']:>8} {raw / stored['size']:>5.1f}x "
+              f"{len(identity):>16} {len(encoded):>10} ({encoding}) {encode_ms:>9.2f}")
+
+
+def _read_from_other_process(db_path: str, server_ids, results) -> None:
+    """Resolve notebooks written by the parent through a fresh service."""
+    from marimo_service import MarimoService
+    from notebook_backends import SQLiteBackend
+
+    service = MarimoService(backend=SQLiteBackend(db_path))
+    results.put(sum(service.get_notebook(server_id) is not None for server_id in server_ids))
+
+
+def bench_backends(args) -> None:
+    """Compare store/get throughput for in-memory, SQLite-only and tiered modes."""
+    from marimo_service import MarimoService
+    from notebook_codec import compress_notebook, content_digest, decompress_notebook
+    from notebook_backends import SQLiteBackend
+
+    count = min(args.iterations, 5000)
+    notebooks = [make_generated_notebook(10).replace("Step", f"Step[{i}]") for i in range(count)]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        def run(label, store, get):
+            start = time.perf_counter()
+            ids = [store(notebook) for notebook in notebooks]
+            write_elapsed = time.perf_counter() - start
+            # Skewed (Zipf-like) reads: a few notebooks are viewed far more often
+            reads = random.Random(0).choices(ids, weights=[1 / (i + 1) for i in range(count)], k=3 * count)
+            start = time.perf_counter()
+            for server_id in reads:
+                assert get(server_id) is not None
+            read_elapsed = time.perf_counter() - start
+            print(f"{label:<10} writes/s {count / write_elapsed:>10.0f}   "
+                  f"reads/s {len(reads) / read_elapsed:>10.0f}")
+            return ids
+
+        memory = MarimoService(max_notebooks=count)
+        run("memory", memory.store_content, memory.get_notebook)
+
+        sqlite_only = SQLiteBackend(os.path.join(tmp, "sqlite.db"))
+
+        def sqlite_store(notebook):
+            digest = content_digest(notebook)
+            body, encoding = compress_notebook(notebook)
+            sqlite_only.put_blob(digest, body, encoding, len(notebook))
+            sqlite_only.put_alias(digest[:24], digest)
+            return digest[:24]
+
+        def sqlite_get(server_id):
+            body, encoding, _ = sqlite_only.get_blob(sqlite_only.get_alias(server_id))
+            return decompress_notebook(body, encoding)
+
+        run("sqlite", sqlite_store, sqlite_get)
+        sqlite_only.close()
+
+        # Tiered: small L1 so reads mix L1 hits with SQLite promotions
+        db_path = os.path.join(tmp, "tiered.db")
+        tiered = MarimoService(max_notebooks=count // 4, backend=SQLiteBackend(db_path))
+        ids = run("tiered", tiered.store_content, tiered.get_notebook)
+        tiered.backend.flush()
+        print(f"tiered L1 stats: {tiered.get_store_stats()}")
+
+        results = multiprocessing.Queue()
+        reader = multiprocessing.Process(target=_read_from_other_process, args=(db_path, ids, results))
+        reader.start()
+        reader.join()
+        print(f"second process resolved {results.get()} of {len(ids)} notebooks")
+
+
+def bench_viewer(args) -> None:
+    """Measure viewer renders/sec and allocations for 10 KB, 100 KB and 1 MB notebooks."""
+    from marimo_service import MarimoService
+
+    service = MarimoService()
+    for size in (10 * 1024, 100 * 1024, 1024 * 1024):
+        notebook = make_notebook(size)
+        rounds = max(20, min(args.iterations, 20 * 1024 * 1024 // size))
+
+        start = time.perf_counter()
+        for _ in range(rounds):
+            service.create_wasm_viewer_html(notebook, "bench")
+        elapsed = time.perf_counter() - start
+
+        tracemalloc.start()
+        html = service.create_wasm_viewer_html(notebook, "bench")
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        print(f"{size // 1024:>5} KB  renders/s {rounds / elapsed:>9.0f}  "
+              f"peak alloc {peak / 1024:>8.0f} KB ({peak / size:.1f}x notebook)  "
+              f"html {len(html) / 1024:>6.0f} KB")
+
+
+def bench_cells(args) -> None:
+    """Measure ast cell-manifest parsing throughput on large notebooks."""
+    from cell_parser import build_cell_manifest
+    from marimo_service import MarimoService
+
+    for cells in (1000, 5000, 20000):
+        notebook = make_generated_notebook(cells)
+        start = time.perf_counter()
+        manifest = build_cell_manifest(notebook)
+        elapsed = time.perf_counter() - start
+        assert len(manifest["cells"]) == cells
+        print(f"{cells:>6} cells  {len(notebook) / 1e6:>5.1f} MB  parse {elapsed * 1000:>8.1f} ms  "
+              f"{cells / elapsed:>8.0f} cells/s  {len(notebook) / elapsed / 1e6:>5.1f} MB/s")
+
+    service = MarimoService()
+    server_id = service.store_content(make_generated_notebook(5000))
+    service.get_cell_manifest(server_id)
+    start = time.perf_counter()
+    for _ in range(1000):
+        service.get_cell_manifest(server_id)
+    print(f"cached manifest lookup: {(time.perf_counter() - start) * 1e3:.3f} us")
+
+
+def bench_imports(args) -> None:
+    """Report the viewer package plan per notebook and the import-analysis cost."""
+    from cell_parser import extract_imports
+    from pyodide_bundle import viewer_runtime
+
+    numpy_cell = (
+        "@app.cell\n"
+        "def stats():\n"
+        "    import numpy as np\n"
+        "    import pandas as pd\n"
+        "    return np, pd\n\n"
+    )
+    for label, notebook in (
+        ("pure python", make_generated_notebook(50)),
+        ("numpy/pandas", make_generated_notebook(50) + numpy_cell),
+    ):
+        runtime = viewer_runtime(extract_imports(notebook))
+        print(f"{label:>12}  loadPackage {runtime['packages']}  micropip {runtime['micropip']}")
+
+    for cells in (100, 1000, 5000):
+        notebook = make_generated_notebook(cells)
+        start = time.perf_counter()
+        extract_imports(notebook)
+        elapsed = time.perf_counter() - start
+        print(f"{cells:>6} cells  import analysis {elapsed * 1000:>7.1f} ms")
+
+
+class FakeCompletions:
+    """Stand-in for ``client.chat.completions`` that echoes the user prompt.
+
+    ``latency`` is the time for the whole completion; streamed completions
+    spread it evenly over their chunks.
+    """
+
+    def __init__(self, latency: float = 0.0, tokens: int = 1800):
+        self.latency = latency
+        self.tokens = tokens
+        self.calls = 0
+
+    async def create(self, **kwargs):
+        from types import SimpleNamespace
+
+        self.calls += 1
+        content = (
+            "import marimo\n\napp = marimo.App()\n\n\n@app.cell\ndef _():\n"
+            f"    _request = {kwargs['messages'][-1]['content'][-200:]!r}\n    return\n"
+        )
+        if kwargs.get("stream"):
+            return self._stream(content)
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return SimpleNamespace(
+            choices=[SimpleNamespace(message=SimpleNamespace(content=content), finish_reason="stop")],
+            usage=SimpleNamespace(total_tokens=self.tokens),
+        )
+
+
+    async def _stream(self, content: str):
+        from types import SimpleNamespace
+
+        pieces = [content[i:i + 16] for i in range(0, len(content), 16)]
+        for index, piece in enumerate(pieces):
+            await asyncio.sleep(self.latency / len(pieces))
+            finish_reason = "stop" if index == len(pieces) - 1 else None
+            yield SimpleNamespace(
+                choices=[SimpleNamespace(delta=SimpleNamespace(content=piece), finish_reason=finish_reason)],
+                usage=None,
+            )
+        yield SimpleNamespace(choices=[], usage=SimpleNamespace(total_tokens=self.tokens))
+
+
+def fake_client(latency: float = 0.0, tokens: int = 1800):
+    """Build an object shaped like ``openai.AsyncOpenAI`` around FakeCompletions."""
+    from types import SimpleNamespace
+
+    return SimpleNamespace(chat=SimpleNamespace(completions=FakeCompletions(latency, tokens)))
+
+
+def make_diagram(index: int, variant: int = 0) -> str:
+    """Build a small Mermaid flowchart; variants differ only in whitespace and order."""
+    edges = [f"N{index}_{step}[Step {step}] --> N{index}_{step + 1}" for step in range(5)]
+    if variant % 2:
+        edges.reverse()
+    separator = "\n    " if variant % 3 else "\n"
+    return "graph TD" + separator + separator.join(edges) + (";" if variant % 4 == 3 else "")
+
+
+def bench_generation(args) -> None:
+    """Replay a skewed stream of generate requests through the generation cache."""
+    from ai_service import AIService
+    from generation_cache import GenerationCache
+    from llm_scheduler import LLMScheduler
+
+    # Measures cache overhead, so the scheduler's token budget must not throttle
+    service = AIService(cache=GenerationCache(), scheduler=LLMScheduler(tokens_per_minute=1e12))
+    service.clients.register("sk-bench", fake_client())
+    rng = random.Random(0)
+    distinct = 200
+    requests = args.iterations // 10
+    indices = rng.choices(range(distinct), weights=[1 / (i + 1) for i in range(distinct)], k=requests)
+
+    async def replay():
+        for index in indices:
+            await service.generate_marimo_notebook(
+                "Build it", make_diagram(index, rng.randrange(8)), "python", "sk-bench"
+            )
+
+    start = time.perf_counter()
+    asyncio.run(replay())
+    elapsed = time.perf_counter() - start
+    stats = service.cache.stats()
+    calls = service.clients.get("sk-bench").chat.completions.calls
+    print(f"{requests} requests over {distinct} diagrams (Zipf, whitespace/order variants)")
+    print(f"  OpenAI calls {calls}  hit ratio {stats['hit_ratio']:.1%}  saved tokens {stats['saved_tokens']}  "
+          f"{elapsed / requests * 1e6:.0f} us/request without network")
+
+
+def bench_coalescing(args) -> None:
+    """Fire 100 identical concurrent generations at a slow fake LLM; expect one call."""
+    from ai_service import AIService
+
+    service = AIService()
+    service.clients.register("sk-bench", fake_client(latency=0.2))
+    diagram = make_diagram(0)
+
+    async def burst():
+        requests = [
+            asyncio.ensure_future(service.generate_marimo_notebook("Build it", diagram, "python", "sk-bench"))
+            for _ in range(100)
+        ]
+        await asyncio.sleep(0.05)
+        # A waiter that gives up must not take the shared call down with it
+        requests[0].cancel()
+        results = await asyncio.gather(*requests[1:])
+        return results
+
+    start = time.perf_counter()
+    results = asyncio.run(burst())
+    elapsed = time.perf_counter() - start
+    calls = service.clients.get("sk-bench").chat.completions.calls
+    assert calls == 1, f"expected 1 upstream call, got {calls}"
+    assert len(set(results)) == 1 and "fallback" not in results[0]
+    print(f"100 concurrent requests (first cancelled): {calls} upstream call, "
+          f"{len(results)} identical results in {elapsed * 1000:.0f} ms, {service.in_flight.stats()}")
+
+
+def bench_streaming(args) -> None:
+    """Compare time to first byte for buffered and streamed generation."""
+    from ai_service import AIService
+
+    service = AIService()
+    service.clients.register("sk-bench", fake_client(latency=2.0))
+
+    async def buffered():
+        start = time.perf_counter()
+        await service.generate_marimo_notebook("Build it", make_diagram(1), "python", "sk-bench")
+        return time.perf_counter() - start, time.perf_counter() - start
+
+    async def streamed():
+        start = time.perf_counter()
+        first = None
+        async for event, data in service.stream_marimo_notebook("Build it", make_diagram(2), "python", "sk-bench"):
+            if first is None:
+                first = time.perf_counter() - start
+            if event == "notebook":
+                assert data.startswith("import marimo")
+        return first, time.perf_counter() - start
+
+    for label, run in (("buffered", buffered), ("streamed", streamed)):
+        first, total = asyncio.run(run())
+        print(f"{label:>9}  first byte {first * 1000:>7.0f} ms  complete {total * 1000:>7.0f} ms")
+
+
+def bench_pool(args) -> None:
+    """Compare connections opened by per-key SDK clients and the shared pool."""
+    import openai
+    from ai_service import AIService
+    from fake_openai_server import FakeOpenAIServer
+    from openai_clients import ClientRegistry
+
+    # Each burst comes from a random mix of 50 tenants, each with its own key
+    tenants = [f"sk-tenant-{i}" for i in range(50)]
+    rounds, concurrency = 5, 40
+    bursts = [random.Random(r).choices(tenants, k=concurrency) for r in range(rounds)]
+
+    async def run(label, get_client):
+        server = await FakeOpenAIServer(latency=0.05).start()
+        start = time.perf_counter()
+        for burst in bursts:
+            await asyncio.gather(*(
+                get_client(api_key, server.base_url).chat.completions.create(
+                    model="gpt-4.1", messages=[{"role": "user", "content": "hi"}]
+                )
+                for api_key in burst
+            ))
+        elapsed = time.perf_counter() - start
+        await server.close()
+        print(f"{label:>22}  {server.requests} requests  {server.connections:>3} TCP connections  "
+              f"{elapsed * 1000:>6.0f} ms")
+
+    separate = {}
+
+    def per_key_client(api_key, base_url):
+        if api_key not in separate:
+            separate[api_key] = openai.AsyncOpenAI(api_key=api_key, base_url=base_url)
+        return separate[api_key]
+
+    async def compare():
+        await run("per-key SDK clients", per_key_client)
+        # The fake server only speaks cleartext HTTP/1.1
+        registry = ClientRegistry(http2=False)
+        await run("shared pool registry", registry.get)
+        print(f"  registry stats: {registry.stats()}")
+        await registry.close()
+
+        # Streaming through the real SDK against the fake server
+        server = await FakeOpenAIServer(latency=0.2).start()
+        os.environ["OPENAI_BASE_URL"] = server.base_url
+        service = AIService()
+        events = [event async for event, _ in service.stream_marimo_notebook("p", "graph TD\nA-->B", "python", "sk-x")]
+        print(f"  streamed via SDK: {events.count('token')} token events, final event {events[-1]!r}")
+        del os.environ["OPENAI_BASE_URL"]
+        await service.clients.close()
+        await server.close()
+
+    asyncio.run(compare())
+
+
+def bench_scheduler(args) -> None:
+    """Push interactive and batch generations through the scheduler with injected 429s."""
+    import httpx
+    import openai
+    from ai_service import AIService
+    from llm_scheduler import BATCH, INTERACTIVE, LLMScheduler
+
+    scheduler = LLMScheduler(max_concurrency=8, max_per_key=8, requests_per_minute=6000, base_delay=0.05)
+    service = AIService(scheduler=scheduler)
+    completions = FakeCompletions(latency=0.1)
+    service.clients.register("sk-bench", SimpleNamespace(chat=SimpleNamespace(completions=completions)))
+    create = completions.create
+    state = {"active": 0, "peak": 0, "calls": 0}
+    failures = random.Random(1)
+
+    async def flaky_create(**kwargs):
+        state["calls"] += 1
+        # One call in five is rate limited
+        if failures.random() < 0.2:
+            response = httpx.Response(429, headers={"retry-after-ms": "200"},
+                                      request=httpx.Request("POST", "https://api.openai.com/v1/chat/completions"))
+            raise openai.RateLimitError("rate limited", response=response, body=None)
+        state["active"] += 1
+        state["peak"] = max(state["peak"], state["active"])
+        try:
+            return await create(**kwargs)
+        finally:
+            state["active"] -= 1
+
+    completions.create = flaky_create
+
+    async def timed(index, priority):
+        start = time.perf_counter()
+        notebook = await service.generate_marimo_notebook(
+            f"Build {index}", make_diagram(index), "python", "sk-bench", priority=priority
+        )
+        assert "fallback" not in notebook
+        return priority, time.perf_counter() - start
+
+    async def burst():
+        # Batch work is queued first; interactive requests arrive just after
+        batch = [asyncio.ensure_future(timed(i, BATCH)) for i in range(60)]
+        await asyncio.sleep(0.01)
+        interactive = [asyncio.ensure_future(timed(1000 + i, INTERACTIVE)) for i in range(20)]
+        return await asyncio.gather(*batch, *interactive)
+
+    results = asyncio.run(burst())
+    for priority, label in ((INTERACTIVE, "interactive"), (BATCH, "batch")):
+        latencies = sorted(elapsed for p, elapsed in results if p == priority)
+        print(f"{label:>12}  n={len(latencies)}  p50 {latencies[len(latencies) // 2] * 1000:>5.0f} ms  "
+              f"max {latencies[-1] * 1000:>5.0f} ms")
+    stats = scheduler.stats()
+    print(f"peak concurrency {state['peak']} (cap 8)  upstream calls {state['calls']}  "
+          f"retries {stats['retries']}  gave up {stats['gave_up']}")
+    print(f"queue wait by priority: { {k: round(v) for k, v in stats['wait_avg_ms_by_priority'].items()} } ms")
+
+
+def bench_batch(args) -> None:
+    """Fan a 50-item batch out with bounded parallelism; compare with one at a time."""
+    from ai_service import AIService
+    from llm_scheduler import LLMScheduler
+
+    completions = FakeCompletions()
+    create = completions.create
+    latencies = random.Random(2)
+    state = {"active": 0, "peak": 0}
+
+    async def jittered_create(**kwargs):
+        # Completions take 100-300 ms so results finish out of order
+        state["active"] += 1
+        state["peak"] = max(state["peak"], state["active"])
+        try:
+            await asyncio.sleep(latencies.uniform(0.1, 0.3))
+            return await create(**kwargs)
+        finally:
+            state["active"] -= 1
+
+    completions.create = jittered_create
+    items = [{"prompt": f"Build {i}", "diagram": make_diagram(i)} for i in range(49)]
+    items.insert(7, {"prompt": "No diagram"})
+
+    async def run(parallelism):
+        # The per-key cap would otherwise bound the batch at 4
+        scheduler = LLMScheduler(max_per_key=8, requests_per_minute=6000, tokens_per_minute=1e12)
+        service = AIService(scheduler=scheduler)
+        service.clients.register("sk-bench", SimpleNamespace(chat=SimpleNamespace(completions=completions)))
+        state["peak"] = 0
+        start = time.perf_counter()
+        order, failed, first = [], [], None
+        async for index, result, _ in service.generate_marimo_notebooks(items, "sk-bench", parallelism=parallelism):
+            first = first or time.perf_counter() - start
+            order.append(index)
+            if isinstance(result, Exception):
+                failed.append((index, str(result)))
+        return time.perf_counter() - start, first, order, failed
+
+    for parallelism in (1, 8):
+        elapsed, first, order, failed = asyncio.run(run(parallelism))
+        assert sorted(order) == list(range(len(items))) and failed == [(7, "Diagram is required")]
+        in_order = order == sorted(order)
+        print(f"parallelism {parallelism}  {len(items)} items in {elapsed * 1000:>6.0f} ms  "
+              f"first result {first * 1000:>4.0f} ms  peak in flight {state['peak']}  "
+              f"failed {len(failed)}  {'submission' if in_order else 'completion'} order")
+
+
+def make_flowchart(nodes: int, seed: int = 0) -> str:
+    """Build a Mermaid flowchart of several connected DAGs totalling ``nodes`` nodes."""
+    rng = random.Random(seed)
+    lines = ["flowchart TD"]
+    start = 0
+    while start < nodes:
+        size = min(rng.randint(5, 40), nodes - start)
+        for offset in range(size):
+            index = start + offset
+            lines.append(f"    N{index}[Step {index}]")
+            if offset:
+                lines.append(f"    N{start + rng.randrange(offset)} --> N{index}")
+            if offset > 2 and rng.random() < 0.3:
+                lines.append(f"    N{start + rng.randrange(offset - 1)} -->|also| N{index}")
+        start += size
+    return "\n".join(lines)
+
+
+class FlowchartCompletions:
+    """Fake LLM that writes one cell per flowchart node at a fixed per-token latency.
+
+    Single-shot requests get cells for every node in the prompt's diagram;
+    part requests get cells for the listed nodes. Output is cut off at
+    ``max_tokens`` (~4 characters per token) with ``finish_reason`` "length",
+    like a real completion; a continuation request picks up after the
+    partial reply it carries. ``padding`` adds comment lines to every cell.
+    """
+
+    def __init__(self, per_token: float, padding: int = 0):
+        self.per_token = per_token
+        self.padding = padding
+        self.calls = 0
+
+    async def create(self, **kwargs):
+        from mermaid_parser import cell_name, output_name, parse_flowchart, predecessors
+
+        self.calls += 1
+        messages = kwargs["messages"]
+        request = max(
+            index for index, message in enumerate(messages)
+            if message["role"] == "user" and ("Cells to write:" in message["content"] or "Flowchart:\n" in message["content"])
+        )
+        user = messages[request]["content"]
+        replies = [message["content"] for message in messages[request + 1:] if message["role"] == "assistant"]
+        partial = replies[-1] if replies else ""
+        if "Cells to write:" in user:
+            listed = re.findall(r"^- (\w+): .* -> (\w+); inputs: (.*)$", user, re.MULTILINE)
+            nodes = [(cell, output, re.findall(r"value_\w+", inputs)) for cell, output, inputs in listed]
+        else:
+            graph = parse_flowchart(user.split("Flowchart:\n", 1)[1].split("\n\nRequest:")[0])
+            incoming = predecessors(graph)
+            nodes = [(cell_name(n), output_name(n), [output_name(p) for p in incoming[n]]) for n in graph["nodes"]]
+        padding = "    # Combines the values of the cells this node depends on into one number\n" * self.padding
+        cells = [
+            f"@app.cell\ndef {cell}({', '.join(inputs)}):\n{padding}    import numpy as np\n"
+            f"    _values = np.array([{', '.join(inputs) or '0'}], dtype=float)\n"
+            f"    {output} = float(_values.sum()) + 1.0\n    return ({output},)\n"
+            for cell, output, inputs in nodes
+        ]
+        remaining = "\n\n".join(cells)[len(partial):]
+        content = remaining[:kwargs["max_tokens"] * 4]
+        tokens = len(content) // 4
+        prompt_tokens = sum(len(message["content"]) for message in messages) // 4
+        await asyncio.sleep(tokens * self.per_token)
+        return SimpleNamespace(
+            choices=[SimpleNamespace(
+                message=SimpleNamespace(content=content),
+                finish_reason="length" if len(content) < len(remaining) else "stop",
+            )],
+            usage=SimpleNamespace(
+                prompt_tokens=prompt_tokens,
+                completion_tokens=tokens,
+                total_tokens=prompt_tokens + tokens,
+            ),
+        )
+
+
+def bench_partition(args) -> None:
+    """Compare single-shot and per-part generation of 20/100/500-node flowcharts."""
+    import ai_service
+    from cell_parser import extract_cells
+
+    per_token = 0.002
+    print(f"fake LLM at {per_token * 1000:.0f} ms/output token")
+    for nodes in (20, 100, 500):
+        diagram = make_flowchart(nodes)
+        for label, threshold in (("single-shot", 10 ** 9), ("partitioned", 0)):
+            ai_service.PARTITION_MIN_NODES = threshold
+            service = ai_service.AIService()
+            completions = FlowchartCompletions(per_token)
+            service.clients.register("sk-bench", SimpleNamespace(chat=SimpleNamespace(completions=completions)))
+            start = time.perf_counter()
+            notebook = asyncio.run(service.generate_marimo_notebook("Build it", diagram, "python", "sk-bench"))
+            elapsed = time.perf_counter() - start
+            try:
+                cells = sum(cell["name"].startswith("node_") for cell in extract_cells(notebook))
+                status = f"{cells:>3}/{nodes} node cells"
+            except SyntaxError:
+                status = "truncated, does not parse"
+            print(f"{nodes:>4} nodes  {label:>11}  {completions.calls:>3} calls  {elapsed * 1000:>6.0f} ms  {status}")
+
+
+def bench_budget(args) -> None:
+    """Compare how many notebooks compile with a fixed 2000-token cap and with budgets plus continuation."""
+    import ast
+
+    import ai_service
+    from ai_service import AIService
+    from cell_parser import extract_cells
+    from prompts import get_prompt
+    from token_budget import compact_diagram, completion_budget, count_tokens
+
+    sizes = range(5, 30, 2)
+    # ~100 output tokens per cell, so diagrams past ~20 nodes overflow 2000 tokens
+    padding = 4
+
+    def compiles(notebook):
+        try:
+            ast.parse(notebook)
+        except SyntaxError:
+            return False
+        return True
+
+    async def fixed_cap(diagram):
+        service = AIService()
+        completions = FlowchartCompletions(0.0, padding)
+        messages = get_prompt("notebook").messages(language="python", diagram=diagram, prompt="Build it")
+        response = await completions.create(model="gpt-4.1", messages=messages, max_tokens=2000)
+        return service._finalize_notebook(response.choices[0].message.content), completions.calls
+
+    async def budgeted(diagram, fixed_budget=False):
+        service = AIService()
+        if fixed_budget:
+            # Continuation alone: every request keeps the old 2000-token cap
+            ai_service.completion_budget = lambda nodes: 2000
+        completions = FlowchartCompletions(0.0, padding)
+        service.clients.register("sk-bench", SimpleNamespace(chat=SimpleNamespace(completions=completions)))
+        notebook = await service.generate_marimo_notebook("Build it", diagram, "python", "sk-bench")
+        ai_service.completion_budget = completion_budget
+        return notebook, completions.calls
+
+    async def compare():
+        runs = (
+            ("fixed 2000 cap", fixed_cap),
+            ("cap+continue", lambda diagram: budgeted(diagram, fixed_budget=True)),
+            ("budget+continue", budgeted),
+        )
+        for label, generate in runs:
+            compiled = calls = cells = total = 0
+            for nodes in sizes:
+                notebook, used = await generate(make_flowchart(nodes, seed=nodes))
+                calls += used
+                total += nodes
+                if compiles(notebook):
+                    compiled += 1
+                    cells += sum(cell["name"].startswith("node_") for cell in extract_cells(notebook))
+            print(f"{label:>15}  compiles {compiled:>2}/{len(sizes)}  node cells {cells:>3}/{total}  calls {calls}")
+
+    asyncio.run(compare())
+
+    diagram = make_flowchart(150).replace("[Step ", "[Load, clean and aggregate the records for reporting step ")
+    compacted = compact_diagram(diagram)
+    print(f"compaction  150-node diagram {count_tokens(diagram)} -> {count_tokens(compacted)} tokens")
+
+
+def bench_incremental(args) -> None:
+    """Compare full and incremental regeneration after single-node edits of a 50-node flowchart."""
+    from ai_service import AIService
+    from cell_parser import extract_cells
+
+    per_token = 0.002
+    diagram = make_flowchart(50)
+    rng = random.Random(3)
+    edits = []
+    for index in rng.sample(range(50), 5):
+        edits.append(("relabel", diagram.replace(f"[Step {index}]", f"[Step {index} revised]")))
+    for index in rng.sample(range(1, 50), 5):
+        edits.append(("new edge", diagram + f"\n    N0 -->|extra| N{index}"))
+
+    service = AIService()
+    service.clients.register(
+        "sk-bench", SimpleNamespace(chat=SimpleNamespace(completions=FlowchartCompletions(per_token, padding=2)))
+    )
+
+    def spent():
+        return sum(p["prompt_tokens"] + p["completion_tokens"] for p in service.usage.stats()["prompts"].values())
+
+    async def timed(generate):
+        before, start = spent(), time.perf_counter()
+        result = await generate()
+        return result, spent() - before, time.perf_counter() - start
+
+    async def run():
+        base = await service.generate_marimo_notebook("Build it", diagram, "python", "sk-bench")
+        base_cells = {cell["name"]: cell["source"] for cell in extract_cells(base)}
+        totals = {"full": [0, 0.0], "incremental": [0, 0.0]}
+        for kind, edited in edits:
+            _, tokens, elapsed = await timed(
+                lambda: service.generate_marimo_notebook("Build it", edited, "python", "sk-bench", use_cache=False)
+            )
+            totals["full"][0] += tokens
+            totals["full"][1] += elapsed
+            (notebook, regenerated, fallback), tokens, elapsed = await timed(
+                lambda: service.regenerate_marimo_notebook("Build it", base, edited, "python", "sk-bench")
+            )
+            totals["incremental"][0] += tokens
+            totals["incremental"][1] += elapsed
+            cells = [cell for cell in extract_cells(notebook) if cell["name"].startswith("node_")]
+            verbatim = sum(
+                base_cells.get(cell["name"]) == cell["source"] for cell in cells if cell["name"][5:] not in regenerated
+            )
+            assert not fallback, f"template cells for {fallback}"
+            print(f"{kind:>9}  regenerated {regenerated}  node cells {len(cells)}/50  verbatim {verbatim}/{50 - len(regenerated)}  "
+                  f"{tokens:>5} tokens  {elapsed * 1000:>5.0f} ms")
+        for label, (tokens, elapsed) in totals.items():
+            print(f"{label:>11}  {tokens / len(edits):>7.0f} tokens/edit  {elapsed / len(edits) * 1000:>6.0f} ms/edit")
+
+    asyncio.run(run())
+
+
+def make_templated_flowchart(nodes: int) -> str:
+    """Build a flowchart whose labels all match flow_to_marimo templates."""
+    labels = ["Enter value", "Validate value", "Add values", "Multiply values", "Process data", "Show result"]
+    lines = ["flowchart TD", "    N0([Start])"]
+    for index in range(1, nodes - 1):
+        lines.append(f"    N{index}[{labels[index % len(labels)]} {index}]")
+        lines.append(f"    N{max(0, index - 1 - index % 3)} --> N{index}")
+    lines.append(f"    N{nodes - 2} --> N{nodes - 1}([End])")
+    return "\n".join(lines)
+
+
+def bench_local(args) -> None:
+    """Measure notebooks/sec for the LLM-free flow_to_marimo engine."""
+    from ai_service import AIService
+    from cell_parser import extract_cells
+    from flow_to_marimo import flow_to_marimo, is_templated
+    from mermaid_parser import parse_flowchart
+
+    # Keywords inside a longer label describe logic the templates cannot express
+    realistic = (
+        "flowchart TD\n    A[Get daily sales from the warehouse API] --> B[Compute a 7-day rolling average]\n"
+        "    B --> C[Show stores below target]"
+    )
+    print(f"realistic 3-node chart built locally: {is_templated(parse_flowchart(realistic))}")
+    service = AIService()
+    for nodes in (8, 20, 50):
+        diagram = make_templated_flowchart(nodes)
+        graph = parse_flowchart(diagram)
+        assert len(extract_cells(flow_to_marimo(graph))) == nodes + 1
+        runs = max(20, args.iterations // nodes)
+        start = time.perf_counter()
+        for _ in range(runs):
+            flow_to_marimo(parse_flowchart(diagram))
+        local = runs / (time.perf_counter() - start)
+
+        async def through_service():
+            for _ in range(runs):
+                await service.generate_marimo_notebook("Build it", diagram, "python", "sk-unused")
+
+        start = time.perf_counter()
+        asyncio.run(through_service())
+        served = runs / (time.perf_counter() - start)
+        print(f"{nodes:>3} nodes  parse+emit {local:>7.0f} notebooks/s  "
+              f"via generate_marimo_notebook {served:>7.0f} notebooks/s")
+    print(f"local generations {service.local_generations}, OpenAI clients created {len(service.clients.clients)}")
+
+
+def bench_prompts(args) -> None:
+    """Compare prompt-cache hits, latency and cost for the registry layout and a variable-first layout."""
+    from ai_service import AIService
+    from fake_openai_server import FakeOpenAIServer
+    from openai_clients import ClientRegistry
+    from prompts import get_prompt
+
+    template = get_prompt("notebook")
+
+    def variable_first(prompt, diagram, language):
+        # The old layout: request details interpolated ahead of the instructions
+        messages = template.messages(language=language, diagram=diagram, prompt=prompt)
+        messages[0] = {"role": "system", "content": messages.pop()["content"] + "\n" + template.system}
+        return messages
+
+    async def run(label, build_messages):
+        # ~10k prompt tokens/s prefill, 50 ms of output
+        server = await FakeOpenAIServer(latency=0.05, prompt_latency=0.0001).start()
+        os.environ["OPENAI_BASE_URL"] = server.base_url
+        service = AIService(clients=ClientRegistry(http2=False))
+        if build_messages is not None:
+            service._build_messages = build_messages
+        for index in range(40):
+            await service.generate_marimo_notebook(f"Build {index}", make_diagram(index), "python", "sk-bench")
+        stats = service.usage.stats()["prompts"][template.id]
+        await service.clients.close()
+        await server.close()
+        del os.environ["OPENAI_BASE_URL"]
+        latency = lambda value: f"{value:>4.0f} ms" if value is not None else "   - ms"
+        print(f"{label:>15}  prefix hits {stats['prefix_hit_rate']:>4.0%}  "
+              f"cached tokens {stats['cached_token_ratio']:>4.0%}  "
+              f"hit {latency(stats['hit_latency_ms'])}  miss {latency(stats['miss_latency_ms'])}  "
+              f"saved {(stats['latency_saved_ms'] or 0) / 1000:>4.1f} s  "
+              f"cost ${stats['cost_usd']:.4f}  saved ${stats['saved_usd']:.4f}")
+
+    async def compare():
+        await run("variable-first", variable_first)
+        await run("static prefix", None)
+
+    asyncio.run(compare())
+
+
+def percentile(values, fraction: float) -> float:
+    """Nearest-rank percentile of ``values``."""
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def unlimited_scheduler():
+    """An LLMScheduler with the OpenAI account limits lifted, so only our own overhead remains."""
+    from llm_scheduler import LLMScheduler
+
+    return LLMScheduler(max_concurrency=1000, max_per_key=1000, requests_per_minute=10 ** 7,
+                        tokens_per_minute=10 ** 10, base_delay=0.05)
+
+
+def bench_load(args) -> None:
+    """Drive /api/marimo/generate at rising concurrency; report p50/p95/p99 latency and throughput.
+
+    With --url the requests go over HTTP to a running worker, for example
+    wrangler dev with OPENAI_BASE_URL pointing at fake_openai_server.py.
+    Otherwise the route's work (generation, storage, the JSON response)
+    runs in-process against a local fake server, or replays --cassette.
+    """
+    import json
+
+    import httpx
+    from ai_service import AIService
+    from fake_openai_server import Cassette, FakeOpenAIServer, latency_sampler
+    from marimo_service import MarimoService
+    from openai_clients import ClientRegistry
+
+    levels = (1, 4, 16, 64)
+
+    def report(label, concurrency, latencies, failed, elapsed):
+        print(f"{label:>24}  concurrency {concurrency:>3}  n={len(latencies):>3}  "
+              f"p50 {percentile(latencies, 0.50) * 1000:>5.0f} ms  p95 {percentile(latencies, 0.95) * 1000:>5.0f} ms  "
+              f"p99 {percentile(latencies, 0.99) * 1000:>5.0f} ms  {len(latencies) / elapsed:>6.1f} req/s  failed {failed}")
+
+    async def drive(label, concurrency, handle):
+        requests = max(32, concurrency * 4)
+        queue = list(range(requests))
+        latencies, failures = [], []
+
+        async def worker():
+            while queue:
+                index = queue.pop()
+                start = time.perf_counter()
+                if not await handle(index):
+                    failures.append(index)
+                latencies.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        report(label, concurrency, latencies, len(failures), time.perf_counter() - start)
+
+    def request_body(index):
+        return {"prompt": f"Build {index}", "diagram": make_diagram(index), "language": "python", "cache": False}
+
+    async def over_http():
+        async with httpx.AsyncClient(base_url=args.url, timeout=600) as client:
+            async def handle(index):
+                response = await client.post("/api/marimo/generate", json=request_body(index))
+                return response.status_code == 200 and response.json().get("success")
+
+            for concurrency in levels:
+                await drive(args.url, concurrency, handle)
+
+    async def in_process(label, scheduler=None, **server_options):
+        server = await FakeOpenAIServer(seed=1, **server_options).start()
+        os.environ["OPENAI_BASE_URL"] = server.base_url
+        service = AIService(clients=ClientRegistry(http2=False), scheduler=scheduler)
+        marimo = MarimoService()
+
+        async def handle(index):
+            body = request_body(index)
+            notebook = await service.generate_marimo_notebook(
+                body["prompt"], body["diagram"], body["language"], "sk-load", use_cache=False
+            )
+            server_id = marimo.store_content(notebook, prefix="marimo")
+            json.dumps({"success": True, "serverId": server_id, "notebookContent": notebook, **body})
+            return "fallback" not in notebook
+
+        for concurrency in levels:
+            await drive(label, concurrency, handle)
+        await service.clients.close()
+        await server.close()
+        del os.environ["OPENAI_BASE_URL"]
+        return server
+
+    async def run():
+        if args.url:
+            await over_http()
+        elif args.cassette:
+            server = await in_process(f"replay {Path(args.cassette).name}", cassette=Cassette(args.cassette))
+            print(f"replayed {server.replayed} of {server.requests} requests")
+        else:
+            await in_process("no latency, no limits", unlimited_scheduler())
+            await in_process(
+                "200 ms, no limits", unlimited_scheduler(), latency=latency_sampler("lognormal:0.2,0.5", seed=1)
+            )
+            server = await in_process(
+                "200 ms + 5% 429s",
+                unlimited_scheduler(),
+                latency=latency_sampler("lognormal:0.2,0.5", seed=1),
+                error_rate=0.05,
+                error_status=429,
+            )
+            print(f"injected errors {server.errors} of {server.requests} upstream requests")
+            await in_process("200 ms, default limits", latency=latency_sampler("lognormal:0.2,0.5", seed=1))
+
+    asyncio.run(run())
+
+
+def bench_hedging(args) -> None:
+    """Compare latency percentiles with and without hedging against a fake server with a slow tail."""
+    from ai_service import AIService
+    from fake_openai_server import FakeOpenAIServer, latency_sampler
+    from hedging import Hedger
+    from openai_clients import ClientRegistry
+
+    requests, concurrency = 400, 8
+
+    async def run(label, hedger, stream):
+        # 4% of responses start after ~2 s instead of ~100 ms
+        server = await FakeOpenAIServer(
+            latency=latency_sampler("bimodal:0.1,2.0,0.04", seed=7), tokens_per_second=4000
+        ).start()
+        os.environ["OPENAI_BASE_URL"] = server.base_url
+        service = AIService(clients=ClientRegistry(http2=False), scheduler=unlimited_scheduler(), hedger=hedger)
+        queue = list(range(requests))
+        latencies = []
+
+        async def measure(index):
+            start = time.perf_counter()
+            if not stream:
+                await service.generate_marimo_notebook(
+                    f"Build {index}", make_diagram(index), "python", "sk-bench", use_cache=False
+                )
+                return time.perf_counter() - start
+            first_token = None
+            async for event, _ in service.stream_marimo_notebook(
+                f"Build {index}", make_diagram(index), "python", "sk-bench", use_cache=False
+            ):
+                if event == "token" and first_token is None:
+                    first_token = time.perf_counter() - start
+            return first_token
+
+        async def worker():
+            while queue:
+                latencies.append(await measure(queue.pop()))
+
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        await service.clients.close()
+        await server.close()
+        del os.environ["OPENAI_BASE_URL"]
+        extra = (server.requests - requests) / requests
+        print(f"{label:>22}  p50 {percentile(latencies, 0.5) * 1000:>5.0f} ms  "
+              f"p95 {percentile(latencies, 0.95) * 1000:>5.0f} ms  p99 {percentile(latencies, 0.99) * 1000:>5.0f} ms  "
+              f"extra requests {extra:>4.1%}")
+        if hedger is not None:
+            stats = hedger.stats()
+            print(f"{'':>22}  hedged {stats['hedged']}  hedge wins {stats['hedge_wins']}  "
+                  f"over budget {stats['over_budget']}  thresholds {stats['threshold_ms']}")
+
+    async def compare():
+        await run("buffered, no hedging", None, stream=False)
+        await run("buffered, hedged", Hedger(), stream=False)
+        await run("first token, no hedge", None, stream=True)
+        await run("first token, hedged", Hedger(), stream=True)
+        await run("hedged, 2% budget", Hedger(budget=0.02), stream=False)
+
+    asyncio.run(compare())
+
+
+def bench_breaker(args) -> None:
+    """Walk a fake server through an outage and a stall, with and without the circuit breaker.
+
+    Each phase sends 80 requests, one every 50 ms: half for diagrams
+    generated (and cached) while the server was healthy, half for new
+    ones, all with the cache bypassed. Reports latency, how many requests got a real,
+    cached or fallback notebook, and the breaker's state and transitions.
+    """
+    from ai_service import AIService
+    from circuit_breaker import CircuitBreaker
+    from fake_openai_server import FakeOpenAIServer, latency_sampler
+    from generation_cache import GenerationCache
+    from openai_clients import ClientRegistry
+
+    requests, interval = 80, 0.05
+    healthy = latency_sampler("lognormal:0.2,0.3", seed=3)
+
+    async def phase(service, server, label, first_index):
+        notebooks = {}
+        latencies = []
+
+        async def request(n):
+            await asyncio.sleep(n * interval)
+            index = first_index + n if n % 2 else n
+            start = time.perf_counter()
+            notebooks[n] = await service.generate_marimo_notebook(
+                f"Build {index}", make_diagram(index), "python", "sk-bench", use_cache=False
+            )
+            latencies.append(time.perf_counter() - start)
+
+        upstream_before = server.requests
+        # With the cache bypassed, a lookup only happens when a stored notebook stands in
+        hits_before = service.cache.stats()["hits"]
+        await asyncio.gather(*(request(n) for n in range(requests)))
+        fallback = sum("fallback" in notebook for notebook in notebooks.values())
+        cached = service.cache.stats()["hits"] - hits_before
+        breaker = service.breaker.stats()
+        print(f"{label:>24}  p50 {percentile(latencies, 0.5) * 1000:>5.0f} ms  "
+              f"p95 {percentile(latencies, 0.95) * 1000:>5.0f} ms  real {requests - fallback - cached:>2}  "
+              f"cached {cached:>2}  fallback {fallback:>2}  upstream calls {server.requests - upstream_before:>3}  "
+              f"{breaker['state']:<9} opened {breaker['opened']}  half-opened {breaker['half_opened']}  "
+              f"closed {breaker['closed']}  rejected {breaker['rejected']}")
+
+    async def run(use_breaker):
+        server = await FakeOpenAIServer(latency=healthy, seed=3).start()
+        os.environ["OPENAI_BASE_URL"] = server.base_url
+        # Windows and slow-call thresholds scaled down to fit the phases (1 s for a 2000-token
+        # completion); without one, a breaker that can never trip
+        breaker = (
+            CircuitBreaker(window=2.0, open_seconds=1.0, slow_call=0.5, slow_call_per_token=0.00025) if use_breaker
+            else CircuitBreaker(min_calls=10 ** 9)
+        )
+        service = AIService(
+            cache=GenerationCache(), clients=ClientRegistry(http2=False), scheduler=unlimited_scheduler(),
+            breaker=breaker,
+        )
+        print("with breaker" if use_breaker else "without breaker")
+        await phase(service, server, "healthy", 100)
+        server.error_rate, server.error_status = 1.0, 503
+        await phase(service, server, "outage: every call 503", 200)
+        server.error_rate = 0.0
+        await asyncio.sleep(1.0)
+        await phase(service, server, "recovered", 300)
+        server.latency = lambda: 2.0
+        await phase(service, server, "stall: 2 s per call", 400)
+        server.latency = healthy
+        await asyncio.sleep(1.0)
+        await phase(service, server, "recovered", 500)
+        await service.clients.close()
+        await server.close()
+        del os.environ["OPENAI_BASE_URL"]
+
+    async def compare():
+        await run(False)
+        await run(True)
+
+    asyncio.run(compare())
+
+
+def bench_validation(args) -> None:
+    """Run defective completions through the old and new finalize steps; time py_compile against ast.
+
+    The old path wrapped the reply in the "# /// script" header and left
+    checking to the container's start.sh (py_compile in a subprocess, then
+    a grep for "app = marimo.App"), which swapped in its own notebook on
+    failure. The new path validates and repairs in-process.
+    """
+    import subprocess
+    import sys
+
+    from notebook_validator import NotebookValidator, validate_notebook
+
+    cell = "@app.cell\ndef node_A():\n    value_A = 21\n    return (value_A,)\n"
+    uses = "@app.cell\ndef node_B(value_A):\n    value_B = np.sqrt(value_A * 2)\n    return (value_B,)\n"
+    replies = {
+        "clean": "@app.cell\ndef imports():\n    import numpy as np\n    return (np,)\n\n" + cell + "\n" + uses.replace("(value_A)", "(np, value_A)"),
+        "code fence": "```python\n" + cell + "```",
+        "prose + fence": "Here is the notebook:\n\n```python\n" + cell + "```\n\nIt defines one cell.",
+        "cut off mid-cell": cell + "\n" + uses[:60],
+        "missing import": cell + "\n" + uses,
+        "top-level import": "import numpy as np\n\n" + cell + "\n" + uses,
+        "wrong signature": cell + "\n" + uses.replace("node_B(value_A)", "node_B(value_Z)").replace("np.sqrt", "abs"),
+        "own header": "import marimo as mo\napp = mo.App()\n\n" + cell,
+        "prose only": "I cannot draw this flowchart.",
+    }
+
+    def legacy_finalize(content):
+        # The pre-validation AIService._finalize_notebook
+        content = content.strip()
+        if not content.startswith("# /// script"):
+            content = f"# /// script\nimport marimo as mo\n\napp = mo.App()\n\n{content}\n\n# ///"
+        return content
+
+    def container_accepts(notebook):
+        # start.sh before this change: compiles, imports marimo and defines app = marimo.App
+        try:
+            compile(notebook, "notebook.py", "exec")
+        except SyntaxError:
+            return False
+        return "import marimo" in notebook and "app = marimo.App" in notebook
+
+    # Both columns count what compile() accepts, not the validator's own flag
+    print(f"{'reply':>18}  {'old: container runs it':>22}  {'new: compiles':>13}  repairs / errors")
+    accepted = {"old": 0, "new": 0}
+    for label, reply in replies.items():
+        result = validate_notebook(reply)
+        notes = ", ".join(result["repairs"] + result["errors"] + result["warnings"]) or "-"
+        new = result["notebook"] is not None and container_accepts(result["notebook"])
+        old = container_accepts(legacy_finalize(reply))
+        accepted["new"] += new
+        accepted["old"] += old
+        print(f"{label:>18}  {'yes' if old else 'no (swapped)':>22}  {'yes' if new else 'no (fallback)':>13}  {notes}")
+    print(f"{'compiled':>18}  {accepted['old']:>22}  {accepted['new']:>13}  of {len(replies)} replies")
+
+    notebook = validate_notebook(make_generated_notebook(40))["notebook"]
+    with tempfile.NamedTemporaryFile("w", suffix=".py", delete=False) as handle:
+        handle.write(notebook)
+    try:
+        runs = 20
+        start = time.perf_counter()
+        for _ in range(runs):
+            subprocess.run([sys.executable, "-m", "py_compile", handle.name], check=True)
+        subprocess_ms = (time.perf_counter() - start) / runs * 1000
+    finally:
+        os.unlink(handle.name)
+    runs = 200
+    start = time.perf_counter()
+    for _ in range(runs):
+        validate_notebook(notebook)
+    validate_ms = (time.perf_counter() - start) / runs * 1000
+    validator = NotebookValidator()
+    validator.validate(notebook)
+    start = time.perf_counter()
+    for _ in range(runs):
+        validator.validate(notebook)
+    cached_ms = (time.perf_counter() - start) / runs * 1000
+    print(f"{len(notebook) // 1024} KB, 40-cell notebook: py_compile subprocess {subprocess_ms:.1f} ms  "
+          f"validate in-process {validate_ms:.2f} ms  cached by digest {cached_ms * 1000:.0f} us")
+
+
+def bench_cassette(args) -> None:
+    """Record completions through the cassette proxy, then replay them with the upstream gone."""
+    from ai_service import AIService
+    from fake_openai_server import Cassette, FakeOpenAIServer, latency_sampler
+    from openai_clients import ClientRegistry
+
+    class RandomUpstream(FakeOpenAIServer):
+        # A different answer on every call, so replay must come from the recording
+        def completion_text(self, body):
+            return f"@app.cell\ndef node_A():\n    value_A = {random.random()!r}\n    return (value_A,)\n"
+
+    async def generate(base_url, count):
+        os.environ["OPENAI_BASE_URL"] = base_url
+        service = AIService(clients=ClientRegistry(http2=False))
+        start = time.perf_counter()
+        notebooks = [
+            await service.generate_marimo_notebook(f"Build {i}", make_diagram(i), "python", "sk-bench", use_cache=False)
+            for i in range(count)
+        ]
+        events = [event async for event in service.stream_marimo_notebook(
+            "Build 0", make_diagram(0), "python", "sk-bench", use_cache=False
+        )]
+        elapsed = time.perf_counter() - start
+        await service.clients.close()
+        del os.environ["OPENAI_BASE_URL"]
+        return notebooks, events[-1][1], elapsed
+
+    async def run():
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "calls.jsonl")
+            upstream = await RandomUpstream(latency=latency_sampler("lognormal:0.2,0.5", seed=1)).start()
+            recorder = await FakeOpenAIServer(cassette=Cassette(path), upstream=upstream.base_url).start()
+            recorded, recorded_stream, record_time = await generate(recorder.base_url, 10)
+            await recorder.close()
+            await upstream.close()
+            print(f"record  {recorder.recorded} completions from upstream in {record_time * 1000:>5.0f} ms")
+
+            replayer = await FakeOpenAIServer(cassette=Cassette(path)).start()
+            replayed, replayed_stream, replay_time = await generate(replayer.base_url, 10)
+            replay_count = replayer.replayed
+            missing, _, _ = await generate(replayer.base_url, 11)
+            await replayer.close()
+            identical = replayed == recorded and replayed_stream == recorded_stream == recorded[0]
+            print(f"replay  {replay_count} completions, upstream offline, in {replay_time * 1000:>5.0f} ms  "
+                  f"identical to recording: {identical}")
+            print(f"unrecorded request falls back: {'fallback' in missing[-1]}")
+
+    asyncio.run(run())
+
+
+BENCHMARKS = {
+    "backends": bench_backends,
+    "batch": bench_batch,
+    "breaker": bench_breaker,
+    "budget": bench_budget,
+    "cassette": bench_cassette,
+    "cells": bench_cells,
+    "coalescing": bench_coalescing,
+    "compression": bench_compression,
+    "dedup": bench_dedup,
+    "generation": bench_generation,
+    "hedging": bench_hedging,
+    "imports": bench_imports,
+    "incremental": bench_incremental,
+    "load": bench_load,
+    "local": bench_local,
+    "partition": bench_partition,
+    "pool": bench_pool,
+    "prompts": bench_prompts,
+    "scheduler": bench_scheduler,
+    "streaming": bench_streaming,
+    "validation": bench_validation,
+    "viewer": bench_viewer,
+}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("benchmark", choices=sorted(BENCHMARKS))
+    parser.add_argument("--iterations", type=int, default=10000)
+    parser.add_argument("--url", help="load: base URL of a running worker to drive over HTTP")
+    parser.add_argument("--cassette", help="load: replay completions from this fake_openai_server cassette")
+    args = parser.parse_args()
+    BENCHMARKS[args.benchmark](args)
+
+
+if __name__ == "__main__":
+    main()
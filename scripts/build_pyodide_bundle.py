@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""
+Pyodide bundle builder for the Python Workers notebook viewer
+Run from the repository root:
+    python scripts/build_pyodide_bundle.py <pyodide-dist> <wheels-dir> <output-dir>
+
+<pyodide-dist> is an unpacked Pyodide (>= 0.25) full distribution and
+<wheels-dir> holds pure-Python wheels for marimo and every dependency the
+distribution does not already ship (e.g. from ``pip download marimo
+--only-binary=:all: --platform any --no-deps`` per package). The output is
+served by the worker when MARIMO_PYODIDE_BUNDLE points at it.
+"""
+
+import argparse
+import email.parser
+import hashlib
+import json
+import re
+import shutil
+import sys
+import zipfile
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+
+from pyodide_bundle import DEFAULT_PACKAGES, LOCKFILE_NAME, normalize_package_name  # noqa: E402
+
+_REQUIREMENT_NAME = re.compile(r"^\s*([A-Za-z0-9][A-Za-z0-9._-]*)")
+
+
+def wheel_metadata(wheel: Path):
+    """Read (name, version, requirements, top-level imports) from a wheel."""
+    with zipfile.ZipFile(wheel) as archive:
+        dist_info = next(
+            name.split("/")[0] for name in archive.namelist() if name.split("/")[0].endswith(".dist-info")
+        )
+        metadata = email.parser.Parser().parsestr(archive.read(f"{dist_info}/METADATA").decode("utf-8"))
+        try:
+            top_level = archive.read(f"{dist_info}/top_level.txt").decode("utf-8").split()
+        except KeyError:
+            top_level = sorted({
+                name.split("/")[0].removesuffix(".py")
+                for name in archive.namelist()
+                if not name.split("/")[0].endswith((".dist-info", ".data"))
+            })
+
+    requirements = []
+    for requirement in metadata.get_all("Requires-Dist") or []:
+        # Optional extras are not installed in the viewer
+        if ";" in requirement and "extra" in requirement.split(";", 1)[1]:
+            continue
+        match = _REQUIREMENT_NAME.match(requirement)
+        if match:
+            requirements.append(normalize_package_name(match.group(1)))
+    return metadata["Name"], metadata["Version"], requirements, top_level
+
+
+def build_bundle(dist: Path, wheels: Path, output: Path) -> dict:
+    """Copy the distribution and wheels to ``output`` and write the merged lockfile."""
+    lock_path = dist / "pyodide-lock.json"
+    if not lock_path.is_file():
+        raise SystemExit(f"{dist} has no pyodide-lock.json; Pyodide 0.25 or newer is required")
+
+    if output.exists():
+        shutil.rmtree(output)
+    shutil.copytree(dist, output)
+
+    lock = json.loads(lock_path.read_text(encoding="utf-8"))
+    packages = lock["packages"]
+    for wheel in sorted(wheels.glob("*.whl")):
+        name, version, requirements, top_level = wheel_metadata(wheel)
+        key = normalize_package_name(name)
+        shutil.copy2(wheel, output / wheel.name)
+        packages[key] = {
+            "name": key,
+            "version": version,
+            "file_name": wheel.name,
+            "install_dir": "site",
+            "sha256": hashlib.sha256(wheel.read_bytes()).hexdigest(),
+            "package_type": "package",
+            "imports": top_level,
+            "depends": requirements,
+            "unvendored_tests": False,
+            "shared_library": False,
+        }
+
+    # Fail here rather than in the browser on a dependency nobody provides
+    missing = sorted({
+        f"{name} -> {dependency}"
+        for name, package in packages.items()
+        for dependency in package.get("depends", [])
+        if normalize_package_name(dependency) not in packages
+    })
+    missing += [name for name in DEFAULT_PACKAGES if normalize_package_name(name) not in packages]
+    if missing:
+        raise SystemExit("Unresolved packages:\n  " + "\n  ".join(missing))
+
+    (output / LOCKFILE_NAME).write_text(json.dumps(lock, indent=1, sort_keys=True), encoding="utf-8")
+    return lock
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("dist", type=Path, help="unpacked Pyodide full distribution")
+    parser.add_argument("wheels", type=Path, help="directory of extra pure-Python wheels")
+    parser.add_argument("output", type=Path, help="bundle directory to create")
+    args = parser.parse_args()
+
+    lock = build_bundle(args.dist, args.wheels, args.output)
+    print(f"Pyodide {lock['info']['version']}: {len(lock['packages'])} packages in {args.output / LOCKFILE_NAME}")
+
+
+if __name__ == "__main__":
+    main()
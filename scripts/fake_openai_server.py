@@ -0,0 +1,395 @@
+#!/usr/bin/env python3
+"""
+Fake OpenAI server for the Python Workers notebook services
+Serves /v1/chat/completions (buffered and streamed) over keep-alive HTTP/1.1.
+Run from the repository root: python scripts/fake_openai_server.py --port 8787
+then point the worker at it with OPENAI_BASE_URL=http://127.0.0.1:8787/v1
+
+Record real completions once, then replay them without network access:
+  python scripts/fake_openai_server.py --cassette calls.jsonl --record https://api.openai.com/v1
+  python scripts/fake_openai_server.py --cassette calls.jsonl
+"""
+
+import argparse
+import asyncio
+import copy
+import hashlib
+import json
+import random
+import time
+from http import HTTPStatus
+from pathlib import Path
+from typing import Callable, Dict, Optional, Set, Tuple, Union
+
+FAKE_NOTEBOOK = (
+    "import marimo\n\n"
+    "app = marimo.App()\n\n\n"
+    "@app.cell\n"
+    "def _():\n"
+    "    import marimo as mo\n"
+    "    return (mo,)\n\n\n"
+    "@app.cell\n"
+    "def _(mo):\n"
+    "    mo.md(\"Generated by the fake OpenAI server\")\n"
+    "    return\n\n\n"
+    "if __name__ == \"__main__\":\n"
+    "    app.run()\n"
+)
+
+
+def latency_sampler(spec: str, seed: Optional[int] = None) -> Callable[[], float]:
+    """Parse a latency distribution in seconds.
+
+    ``"0.5"`` is fixed, ``"uniform:LOW,HIGH"``, ``"lognormal:MEDIAN,SIGMA"``,
+    ``"exponential:MEAN"`` and ``"bimodal:FAST,SLOW,SLOW_FRACTION"`` (each
+    mode within 20%) are sampled per request.
+    """
+    rng = random.Random(seed)
+    kind, _, params = spec.partition(":")
+    if not params:
+        value = float(kind)
+        return lambda: value
+    values = [float(value) for value in params.split(",")]
+    if kind == "uniform":
+        low, high = values
+        return lambda: rng.uniform(low, high)
+    if kind == "lognormal":
+        median, sigma = values
+        return lambda: median * rng.lognormvariate(0.0, sigma)
+    if kind == "exponential":
+        mean, = values
+        return lambda: rng.expovariate(1.0 / mean)
+    if kind == "bimodal":
+        fast, slow, slow_fraction = values
+        return lambda: (slow if rng.random() < slow_fraction else fast) * rng.uniform(0.8, 1.2)
+    raise ValueError(f"Unknown latency distribution: {spec!r}")
+
+
+class Cassette:
+    """Chat completions recorded per request body, stored as JSON lines.
+
+    Requests are keyed by their body without the streaming options, so a
+    recording answers both buffered and streamed calls.
+    """
+
+    def __init__(self, path: str):
+        self.path = Path(path)
+        self.entries: Dict[str, Dict] = {}
+        if self.path.exists():
+            with self.path.open(encoding="utf-8") as lines:
+                for line in lines:
+                    if line.strip():
+                        entry = json.loads(line)
+                        self.entries[entry["key"]] = entry["response"]
+
+    @staticmethod
+    def key(body: Dict) -> str:
+        request = {name: value for name, value in body.items() if name not in ("stream", "stream_options")}
+        return hashlib.sha256(json.dumps(request, sort_keys=True).encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[Dict]:
+        response = self.entries.get(key)
+        return copy.deepcopy(response) if response is not None else None
+
+    def add(self, key: str, body: Dict, response: Dict) -> None:
+        """Keep a response and append it to the cassette file."""
+        self.entries[key] = response
+        with self.path.open("a", encoding="utf-8") as lines:
+            lines.write(json.dumps({"key": key, "request": body, "response": response}) + "\n")
+
+
+class FakeOpenAIServer:
+    """Minimal chat-completions endpoint with configurable latency and errors.
+
+    ``latency`` (seconds, or a callable sampled per request) is the time
+    for a whole completion; streamed responses spread it over their
+    chunks. With ``tokens_per_second`` it is the time to the first token
+    instead and output arrives at that rate. ``error_rate`` of requests
+    fail with ``error_status``. Requests and connections are counted so
+    benchmarks can check connection reuse.
+
+    With a ``cassette``, completions come from its recordings; a request
+    it has not seen is forwarded to ``upstream`` and recorded, or fails
+    with 404 when there is no upstream.
+
+    Prompt caching is simulated like OpenAI's: a prompt whose first 1024+
+    tokens repeat an earlier prompt reports the repeated prefix, in
+    128-token steps, as ``cached_tokens``. Each uncached prompt token adds
+    ``prompt_latency`` seconds before the first output.
+    """
+
+    def __init__(
+        self,
+        host: str = "127.0.0.1",
+        port: int = 0,
+        latency: Union[float, Callable[[], float]] = 0.0,
+        chunk_size: int = 16,
+        prompt_latency: float = 0.0,
+        tokens_per_second: Optional[float] = None,
+        error_rate: float = 0.0,
+        error_status: int = 500,
+        cassette: Optional[Cassette] = None,
+        upstream: Optional[str] = None,
+        seed: Optional[int] = None,
+    ):
+        self.host = host
+        self.port = port
+        self.latency = latency if callable(latency) else (lambda: latency)
+        self.chunk_size = chunk_size
+        self.prompt_latency = prompt_latency
+        self.tokens_per_second = tokens_per_second
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.cassette = cassette
+        self.upstream = upstream.rstrip("/") if upstream else None
+        self._random = random.Random(seed)
+        self._prefixes: Set[int] = set()
+        self._upstream_client = None
+        self.requests = 0
+        self.connections = 0
+        self.errors = 0
+        self.replayed = 0
+        self.recorded = 0
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._writers: Set[asyncio.StreamWriter] = set()
+
+    @property
+    def base_url(self) -> str:
+        return f"http://{self.host}:{self.port}/v1"
+
+    async def start(self) -> "FakeOpenAIServer":
+        self._server = await asyncio.start_server(self._handle_connection, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        return self
+
+    async def close(self) -> None:
+        if self._server is not None:
+            self._server.close()
+            # Kept-alive client connections would otherwise hold wait_closed() open
+            for writer in list(self._writers):
+                writer.close()
+            await self._server.wait_closed()
+        if self._upstream_client is not None:
+            await self._upstream_client.aclose()
+
+    def completion_text(self, body: Dict) -> str:
+        """Text the fake model answers with."""
+        return FAKE_NOTEBOOK
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        self.connections += 1
+        self._writers.add(writer)
+        try:
+            while True:
+                request = await self._read_request(reader)
+                if request is None:
+                    break
+                method, path, headers, body = request
+                self.requests += 1
+                if method != "POST" or not path.endswith("/chat/completions"):
+                    self._write_error(writer, 404, "not found")
+                else:
+                    await self._handle_completion(writer, headers, body)
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.CancelledError):
+            pass
+        finally:
+            self._writers.discard(writer)
+            writer.close()
+
+    async def _handle_completion(self, writer: asyncio.StreamWriter, headers: Dict[str, str], body: Dict) -> None:
+        if self.error_rate and self._random.random() < self.error_rate:
+            self.errors += 1
+            await asyncio.sleep(self.latency() / 10)
+            self._write_error(writer, self.error_status, "injected error")
+            return
+        if self.cassette is None:
+            completion = self._completion(body)
+        else:
+            status, completion = await self._recorded_completion(headers, body)
+            if status != 200:
+                self._write_response(writer, status, json.dumps(completion).encode("utf-8"))
+                return
+        first_token, generation = self._timing(completion)
+        if body.get("stream"):
+            await self._stream_completion(writer, body, completion, first_token, generation)
+        else:
+            await asyncio.sleep(first_token + generation)
+            self._write_response(writer, 200, json.dumps(completion).encode("utf-8"))
+
+    async def _recorded_completion(self, headers: Dict[str, str], body: Dict) -> Tuple[int, Dict]:
+        """A completion from the cassette, recording it from upstream on a miss."""
+        key = Cassette.key(body)
+        completion = self.cassette.get(key)
+        if completion is not None:
+            self.replayed += 1
+            return 200, completion
+        if self.upstream is None:
+            return 404, {"error": {
+                "message": f"No recording for request {key[:12]} in {self.cassette.path}",
+                "type": "invalid_request_error",
+            }}
+        import httpx
+
+        if self._upstream_client is None:
+            self._upstream_client = httpx.AsyncClient(timeout=600)
+        request = {name: value for name, value in body.items() if name not in ("stream", "stream_options")}
+        response = await self._upstream_client.post(
+            f"{self.upstream}/chat/completions",
+            json=request,
+            headers={"Authorization": headers.get("authorization", "")},
+        )
+        if response.status_code != 200:
+            # Upstream errors are passed through, not recorded
+            return response.status_code, response.json()
+        completion = response.json()
+        self.cassette.add(key, request, completion)
+        self.recorded += 1
+        return 200, copy.deepcopy(completion)
+
+    async def _read_request(self, reader: asyncio.StreamReader) -> Optional[Tuple[str, str, Dict[str, str], Dict]]:
+        """Read one request as (method, path, headers, JSON body); None at end of connection."""
+        request_line = await reader.readline()
+        if not request_line:
+            return None
+        method, path, _ = request_line.decode("latin-1").split(" ", 2)
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+        length = int(headers.get("content-length", 0))
+        raw = await reader.readexactly(length) if length else b""
+        return method, path, headers, json.loads(raw) if raw else {}
+
+    def _write_response(self, writer: asyncio.StreamWriter, status: int, payload: bytes) -> None:
+        # Injected 429s ask for an immediate retry so benchmarks stay fast
+        retry_after = "Retry-After: 0\r\n" if status == 429 else ""
+        writer.write(
+            f"HTTP/1.1 {status} {HTTPStatus(status).phrase}\r\n"
+            f"Content-Type: application/json\r\n"
+            f"Content-Length: {len(payload)}\r\n"
+            f"{retry_after}"
+            f"Connection: keep-alive\r\n\r\n".encode("latin-1") + payload
+        )
+
+    def _write_error(self, writer: asyncio.StreamWriter, status: int, message: str) -> None:
+        error = {"error": {"message": message, "type": "server_error" if status >= 500 else "invalid_request_error"}}
+        self._write_response(writer, status, json.dumps(error).encode("utf-8"))
+
+    def _cached_tokens(self, prompt: str) -> int:
+        """Tokens of ``prompt`` covered by an earlier prompt's prefix (~4 characters per token)."""
+        step = 128 * 4
+        cached = 0
+        for end in range(step, len(prompt) + 1, step):
+            digest = hash(prompt[:end])
+            if digest in self._prefixes:
+                cached = end // 4
+            self._prefixes.add(digest)
+        return cached if cached >= 1024 else 0
+
+    def _timing(self, completion: Dict) -> Tuple[float, float]:
+        """Seconds to the first token and for generating the rest."""
+        usage = completion.get("usage") or {}
+        cached = (usage.get("prompt_tokens_details") or {}).get("cached_tokens") or 0
+        prefill = (usage.get("prompt_tokens", 0) - cached) * self.prompt_latency
+        if self.tokens_per_second:
+            return prefill + self.latency(), usage.get("completion_tokens", 0) / self.tokens_per_second
+        return prefill, self.latency()
+
+    def _completion(self, body: Dict) -> Dict:
+        text = self.completion_text(body)
+        prompt = "".join(m.get("role", "") + (m.get("content") or "") for m in body.get("messages", []))
+        prompt_tokens = len(prompt) // 4
+        return {
+            "id": "chatcmpl-fake",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", "fake"),
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": text},
+                "finish_reason": "stop",
+            }],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": len(text) // 4,
+                "total_tokens": prompt_tokens + len(text) // 4,
+                "prompt_tokens_details": {"cached_tokens": self._cached_tokens(prompt)},
+            },
+        }
+
+    async def _stream_completion(
+        self, writer: asyncio.StreamWriter, body: Dict, completion: Dict, first_token: float, generation: float
+    ) -> None:
+        """Send the completion as chunked Server-Sent Events."""
+        writer.write(
+            b"HTTP/1.1 200 OK\r\n"
+            b"Content-Type: text/event-stream\r\n"
+            b"Transfer-Encoding: chunked\r\n"
+            b"Connection: keep-alive\r\n\r\n"
+        )
+        await asyncio.sleep(first_token)
+        choice = completion["choices"][0]
+        text = choice["message"]["content"] or ""
+        pieces = [text[i:i + self.chunk_size] for i in range(0, len(text), self.chunk_size)]
+        base = {"id": completion["id"], "object": "chat.completion.chunk",
+                "created": completion["created"], "model": completion["model"]}
+        for piece in pieces:
+            await asyncio.sleep(generation / len(pieces))
+            chunk = {**base, "choices": [{"index": 0, "delta": {"content": piece}, "finish_reason": None}]}
+            self._write_chunk(writer, f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+            await writer.drain()
+        final = {**base, "choices": [{"index": 0, "delta": {}, "finish_reason": choice.get("finish_reason", "stop")}]}
+        self._write_chunk(writer, f"data: {json.dumps(final)}\n\n".encode("utf-8"))
+        if (body.get("stream_options") or {}).get("include_usage"):
+            usage = {**base, "choices": [], "usage": completion["usage"]}
+            self._write_chunk(writer, f"data: {json.dumps(usage)}\n\n".encode("utf-8"))
+        self._write_chunk(writer, b"data: [DONE]\n\n")
+        writer.write(b"0\r\n\r\n")
+
+    @staticmethod
+    def _write_chunk(writer: asyncio.StreamWriter, data: bytes) -> None:
+        writer.write(f"{len(data):x}\r\n".encode("latin-1") + data + b"\r\n")
+
+
+async def serve(args) -> None:
+    server = await FakeOpenAIServer(
+        args.host,
+        args.port,
+        latency=latency_sampler(args.latency, args.seed),
+        tokens_per_second=args.tokens_per_second,
+        error_rate=args.error_rate,
+        error_status=args.error_status,
+        cassette=Cassette(args.cassette) if args.cassette else None,
+        upstream=args.record,
+        seed=args.seed,
+    ).start()
+    mode = f", cassette {args.cassette} ({'recording' if args.record else 'replay'})" if args.cassette else ""
+    print(f"Fake OpenAI server on {server.base_url} (latency {args.latency}{mode})")
+    await asyncio.Event().wait()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8787)
+    parser.add_argument("--latency", default="1.0",
+                        help="seconds per completion: 1.0, uniform:LOW,HIGH, lognormal:MEDIAN,SIGMA, "
+                             "exponential:MEAN or bimodal:FAST,SLOW,SLOW_FRACTION")
+    parser.add_argument("--tokens-per-second", type=float, help="output rate; --latency becomes time to first token")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of requests that fail")
+    parser.add_argument("--error-status", type=int, default=500, help="HTTP status of injected failures")
+    parser.add_argument("--cassette", help="JSON lines file of recorded completions to replay")
+    parser.add_argument("--record", metavar="UPSTREAM", help="record cassette misses from this base URL")
+    parser.add_argument("--seed", type=int, help="seed for latency sampling and error injection")
+    args = parser.parse_args()
+    if args.record and not args.cassette:
+        parser.error("--record needs --cassette")
+    asyncio.run(serve(args))
+
+
+if __name__ == "__main__":
+    main()
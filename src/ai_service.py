@@ -3,98 +3,711 @@ AI Service for Python Workers
 Handles OpenAI API calls to generate Marimo notebooks
 """
 
-import openai
+import ast
 import asyncio
-from typing import Optional
+import os
+import time
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple
 
-class AIService:
-    def __init__(self):
-        """Initialize the AI service."""
-        self.client = None
-    
-    async def generate_marimo_notebook(self, prompt: str, diagram: str, language: str, api_key: str) -> str:
-        """Generate a Marimo notebook using OpenAI."""
-        try:
-            # Initialize OpenAI client
-            if not self.client:
-                self.client = openai.AsyncOpenAI(api_key=api_key)
-            
-            # Create the system prompt for Marimo notebook generation
-            system_prompt = f"""
-You are an expert Python developer specializing in Marimo notebooks. 
-Create a complete, executable Marimo notebook based on the user's request.
-
-Requirements:
-1. Use proper Marimo syntax with @app.cell decorators
-2. Import marimo as mo and create app = mo.App()
-3. Break down the logic into logical cells
-4. Include proper error handling and documentation
-5. Make sure the code is executable and follows Python best practices
-6. Use the flowchart/diagram provided to understand the logic flow
-
-Language: {language}
-Flowchart/Diagram: {diagram}
-
-Generate a complete Marimo notebook that implements the requested functionality.
-"""
-            
-            # Create the user prompt
-            user_prompt = f"""
-Please create a Marimo notebook for the following request:
+from cell_parser import assemble_cells, extract_cells
+from circuit_breaker import CircuitBreaker
+from flow_to_marimo import flow_cells, flow_to_marimo, is_templated
+from flowchart_diff import diff_flowcharts, embed_diagram, embedded_diagram
+from generation_cache import GenerationCache, generation_key
+from hedging import Hedger
+from llm_scheduler import BATCH, INTERACTIVE, LLMScheduler, is_retryable
+from llm_usage import UsageLedger
+from mermaid_parser import (
+    cell_name,
+    output_name,
+    parse_flowchart,
+    partition_flowchart,
+    predecessors,
+    render_flowchart,
+    topological_layers,
+)
+from notebook_validator import NotebookValidator, strip_code_fences
+from openai_clients import ClientRegistry
+from prompts import continuation_messages, get_prompt, prompt_versions
+from single_flight import SingleFlight
+from token_budget import (
+    compact_diagram,
+    completion_budget,
+    continuation_overlap,
+    count_message_tokens,
+    diagram_nodes,
+    fit_completion_budget,
+    trim_to_complete_cells,
+)
 
-{prompt}
+# Generation settings; part of the generation cache key
+MODEL = "gpt-4.1"
+TEMPERATURE = 0.7
 
-The notebook should:
-- Be fully executable
-- Follow Marimo best practices
-- Include proper cell structure
-- Handle errors gracefully
-- Be well-documented
+# Follow-up calls for a reply cut off at max_tokens
+MAX_CONTINUATIONS = 3
 
-Please provide the complete notebook code.
-"""
-            
-            # Call OpenAI API
-            response = await self.client.chat.completions.create(
-                model="gpt-4.1",
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": user_prompt}
-                ],
-                temperature=0.7,
-                max_tokens=2000
-            )
-            
-            # Extract the generated notebook
-            notebook_content = response.choices[0].message.content.strip()
-            
-            # Ensure it starts with proper Marimo imports
-            if not notebook_content.startswith("# /// script"):
-                notebook_content = f"""# /// script
-import marimo as mo
+# Generations a batch runs at once; the scheduler still applies its own caps
+BATCH_PARALLELISM = 8
+
+# Flowcharts with at least this many nodes are generated in parts, concurrently
+PARTITION_MIN_NODES = 30
+# Nodes per part, so a part usually fits one completion
+MAX_PART_NODES = 15
+
+# Incremental regeneration falls back to a full one when more of the nodes than this need new cells
+INCREMENTAL_MAX_CHANGED = 0.5
+
+# Generation engines: "auto" builds templated Python flowcharts locally, "llm" always calls OpenAI
+ENGINE_AUTO = "auto"
+ENGINE_LLM = "llm"
+ENGINES = (ENGINE_AUTO, ENGINE_LLM)
+
+async def _chain(first: List[Any], rest: AsyncIterator[Any]) -> AsyncIterator[Any]:
+    """Yield the chunks already read, then the rest of the stream."""
+    for chunk in first:
+        yield chunk
+    async for chunk in rest:
+        yield chunk
 
-app = mo.App()
 
-{notebook_content}
+def _fragment_imports(fragment: str) -> str:
+    """The import statements of a generated fragment, at top level or inside its cells."""
+    statements = []
+    for node in ast.parse(fragment).body:
+        body = node.body if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)) else [node]
+        statements.extend(ast.unparse(statement) for statement in body if isinstance(statement, (ast.Import, ast.ImportFrom)))
+    return "\n".join(statements)
 
-# ///"""
+
+def _upstream_failure(error: Exception) -> bool:
+    """Errors that count against the OpenAI circuit breaker.
+    
+    Rate limits are left out: they mean our own quota is used up, which
+    the scheduler already paces, not that OpenAI is failing.
+    """
+    return is_retryable(error) and getattr(error, "status_code", None) != 429
+
+
+class AIService:
+    def __init__(
+        self,
+        cache: Optional[GenerationCache] = None,
+        clients: Optional[ClientRegistry] = None,
+        scheduler: Optional[LLMScheduler] = None,
+        hedger: Optional[Hedger] = None,
+        breaker: Optional[CircuitBreaker] = None,
+        validator: Optional[NotebookValidator] = None,
+    ):
+        """Initialize the AI service.
+        
+        With a ``cache``, repeated requests for the same prompt, diagram and
+        settings reuse the earlier notebook instead of calling OpenAI.
+        Identical requests that arrive while a generation is running share
+        that generation. OpenAI clients come from ``clients``, one per API
+        key over a shared connection pool, and every call goes through the
+        ``scheduler`` for concurrency caps, rate limits and retries. With a
+        ``hedger``, a call slower than recent ones is raced against a
+        backup request sent within the same scheduler slot. Calls go
+        through the circuit ``breaker``: while OpenAI keeps failing or
+        timing out, requests get the cached notebook or the fallback at
+        once instead of waiting out retries. Every generated notebook is
+        checked and repaired by the ``validator`` before it is returned or
+        cached.
+        """
+        self.clients = clients or ClientRegistry()
+        self.scheduler = scheduler or LLMScheduler()
+        self.hedger = hedger
+        self.breaker = breaker or CircuitBreaker()
+        self.validator = validator or NotebookValidator()
+        self.cache = cache
+        self.in_flight = SingleFlight()
+        self.local_generations = 0
+        self.incremental_generations = 0
+        self.reused_cells = 0
+        self.usage = UsageLedger()
+    
+    async def generate_marimo_notebook(
+        self,
+        prompt: str,
+        diagram: str,
+        language: str,
+        api_key: str,
+        use_cache: bool = True,
+        priority: int = INTERACTIVE,
+        engine: str = ENGINE_AUTO,
+    ) -> str:
+        """Generate a Marimo notebook using OpenAI.
+        
+        Python flowcharts whose every node is a flow_to_marimo template
+        step are built locally without OpenAI, unless ``engine`` is
+        ENGINE_LLM. ``use_cache=False`` skips the cache lookup and forces
+        a fresh generation; the new result still replaces the cached one.
+        ``priority`` is an LLMScheduler priority class. The notebook
+        records ``diagram`` so a later edit can be applied with
+        regenerate_marimo_notebook.
+        """
+        notebook, _ = await self._generate_notebook(prompt, diagram, language, api_key, use_cache, priority, engine)
+        return notebook
+    
+    async def _generate_notebook(
+        self, prompt: str, diagram: str, language: str, api_key: str, use_cache: bool, priority: int, engine: str
+    ) -> Tuple[str, bool]:
+        """generate_marimo_notebook, also telling whether the notebook is a degraded one.
+        
+        That is the stored or fallback notebook served when OpenAI failed
+        or the circuit breaker turned the request away.
+        """
+        local = self._local_notebook(diagram, language, engine)
+        if local is not None:
+            return embed_diagram(local, diagram), False
+        
+        key = generation_key(prompt, diagram, language, MODEL, TEMPERATURE, prompt_versions())
+        if self.cache is not None:
+            if not use_cache:
+                self.cache.bypassed += 1
+            else:
+                cached = self.cache.get(key)
+                if cached is not None:
+                    return embed_diagram(cached, diagram), False
+        
+        if not self.breaker.allows():
+            self.breaker.reject()
+            return embed_diagram(self._degraded_notebook(key, prompt, diagram, language), diagram), True
+        
+        notebook, degraded = await self.in_flight.run(
+            key, lambda: self._generate(key, prompt, diagram, language, api_key, priority)
+        )
+        return embed_diagram(notebook, diagram), degraded
+    
+    async def regenerate_marimo_notebook(
+        self,
+        prompt: str,
+        previous: str,
+        diagram: str,
+        language: str,
+        api_key: str,
+        priority: int = INTERACTIVE,
+        engine: str = ENGINE_AUTO,
+    ) -> Tuple[str, Optional[List[str]], List[str]]:
+        """Update a notebook for an edited diagram, regenerating only the cells that changed.
+        
+        ``previous`` is a notebook from this service, which records the
+        diagram it was built from. Nodes that were added, relabelled or
+        rewired get new cells, generated in parts like a large flowchart;
+        every other node keeps its cell body verbatim, and the cells of
+        removed nodes are dropped. A node whose part failed gets a
+        flow_to_marimo template cell instead.
+        
+        Returns the notebook, the node ids given generated cells and the
+        node ids given template cells. The regenerated ids are None after
+        a full generation, which happens for an unknown previous diagram,
+        too large an edit or an open circuit breaker. A failed regeneration
+        serves the same stored or fallback notebook as a failed full
+        generation. ``engine`` is as for generate_marimo_notebook.
+        """
+        plan = self._incremental_plan(previous, diagram, language, engine)
+        if plan is None or not self.breaker.allows():
+            # generate_marimo_notebook turns the request away itself while the circuit is open
+            notebook = await self.generate_marimo_notebook(
+                prompt, diagram, language, api_key, priority=priority, engine=engine
+            )
+            return notebook, None, []
+        graph, prelude, kept, dirty = plan
+        self.incremental_generations += 1
+        self.reused_cells += len(kept)
+        
+        try:
+            ordered = [node_id for layer in topological_layers(graph, dirty) for node_id in layer]
+            parts = [ordered[i:i + MAX_PART_NODES] for i in range(0, len(ordered), MAX_PART_NODES)]
+            fragments, _, fallback = await self._generate_fragments(prompt, graph, parts, language, api_key, priority)
+            
+            # Only the target nodes' cells are taken from a fragment, plus the imports they may use
+            generated = {}
+            wanted = {cell_name(node_id) for node_id in dirty}
+            for fragment in fragments:
+                for cell in extract_cells(fragment):
+                    if cell["name"] in wanted and cell["name"] not in generated:
+                        generated[cell["name"]] = cell["source"]
+                imports = _fragment_imports(fragment)
+                if imports:
+                    prelude.append(imports)
+            fallback = set(fallback) | {node_id for node_id in dirty if cell_name(node_id) not in generated}
+            regenerated = [node_id for node_id in dirty if node_id not in fallback]
+            cells = [
+                kept.get(node_id) or generated.get(cell_name(node_id)) or flow_cells(graph, [node_id])
+                for node_id in graph["nodes"]
+            ]
+            notebook_content = self._finalize_notebook(assemble_cells(prelude + cells))
+        except Exception as e:
+            print(f"Incremental regeneration failed: {type(e).__name__}: {e}")
+            key = generation_key(prompt, diagram, language, MODEL, TEMPERATURE, prompt_versions())
+            return embed_diagram(self._degraded_notebook(key, prompt, diagram, language), diagram), None, []
+        
+        return embed_diagram(notebook_content, diagram), regenerated, [node_id for node_id in dirty if node_id in fallback]
+    
+    def _incremental_plan(
+        self, previous: str, diagram: str, language: str, engine: str
+    ) -> Optional[Tuple[Dict, List[str], Dict[str, str], List[str]]]:
+        """Work out which cells of ``previous`` survive an edit.
+        
+        Returns (new graph, cells that belong to no node, kept node cell
+        sources by node id, node ids needing new cells), or None when the
+        notebook should be generated from scratch.
+        """
+        old_diagram = embedded_diagram(previous)
+        if old_diagram is None:
+            return None
+        try:
+            old_graph = parse_flowchart(old_diagram)
+            graph = parse_flowchart(diagram)
+            cells = extract_cells(previous)
+        except (ValueError, SyntaxError):
+            return None
+        if engine == ENGINE_AUTO and language.strip().lower() == "python" and is_templated(graph):
+            # Building it locally is free
+            return None
+        
+        sources = {cell["name"]: cell["source"] for cell in cells}
+        unchanged = diff_flowcharts(old_graph, graph)["unchanged"]
+        kept = {node_id: sources[cell_name(node_id)] for node_id in unchanged if cell_name(node_id) in sources}
+        dirty = [node_id for node_id in graph["nodes"] if node_id not in kept]
+        if len(dirty) > INCREMENTAL_MAX_CHANGED * len(graph["nodes"]):
+            return None
+        node_cells = {cell_name(node_id) for node_id in list(old_graph["nodes"]) + list(graph["nodes"])}
+        prelude = [cell["source"] for cell in cells if cell["name"] not in node_cells]
+        return graph, prelude, kept, dirty
+    
+    async def _generate(
+        self, key: str, prompt: str, diagram: str, language: str, api_key: str, priority: int
+    ) -> Tuple[str, bool]:
+        """Call OpenAI for one generation and cache the result.
+        
+        Large flowcharts are split into parts generated concurrently (see
+        _generate_parts); everything else is a single completion. Returns
+        the notebook and whether it is the degraded one served on failure.
+        """
+        try:
+            try:
+                graph = parse_flowchart(diagram)
+            except ValueError:
+                graph = None
+            if graph is not None and len(graph["nodes"]) >= PARTITION_MIN_NODES:
+                notebook_content, tokens = await self._generate_parts(prompt, graph, language, api_key, priority)
+            else:
+                nodes = len(graph["nodes"]) if graph is not None else diagram_nodes(diagram)
+                messages = self._build_messages(prompt, compact_diagram(diagram), language)
+                content, tokens, truncated = await self._complete(
+                    get_prompt("notebook").id, messages, api_key, priority, completion_budget(nodes)
+                )
+                content = strip_code_fences(content)
+                if truncated:
+                    # Keep the complete cells; the result is not cached
+                    content = trim_to_complete_cells(content)
+                    if content is None:
+                        raise ValueError("Generated notebook was cut off before its first complete cell")
+                    tokens = None
+                notebook_content = self._finalize_notebook(content)
             
-            # Ensure it ends with proper Marimo footer
-            if not notebook_content.endswith("# ///"):
-                notebook_content += "\n\n# ///"
+            # Only complete generations are cached, never fallbacks
+            if self.cache is not None and tokens is not None:
+                self.cache.put(key, notebook_content, tokens)
             
-            return notebook_content
+            return notebook_content, False
             
         except Exception as e:
             # Fallback to a basic Marimo notebook if AI generation fails
-            return self._create_fallback_notebook(prompt, diagram, language)
+            print(f"Notebook generation failed after retries: {type(e).__name__}: {e}")
+            return self._degraded_notebook(key, prompt, diagram, language), True
+    
+    def _degraded_notebook(self, key: str, prompt: str, diagram: str, language: str) -> str:
+        """The notebook served when OpenAI cannot be used.
+        
+        That is the cached one, even when a fresh generation was asked for,
+        or else the fallback notebook.
+        """
+        cached = self.cache.get(key) if self.cache is not None else None
+        return cached if cached is not None else self._create_fallback_notebook(prompt, diagram, language)
+    
+    async def generate_marimo_notebooks(
+        self,
+        items: List[Dict],
+        api_key: str,
+        parallelism: int = BATCH_PARALLELISM,
+        use_cache: bool = True,
+        engine: str = ENGINE_AUTO,
+    ) -> AsyncIterator[Tuple[int, Any, bool]]:
+        """Generate many notebooks, yielding ``(index, notebook, degraded)`` in completion order.
+        
+        At most ``parallelism`` items run at once, at BATCH priority so
+        interactive requests go first. An item's own ``engine`` overrides
+        the batch's. ``degraded`` is True for the stored or fallback
+        notebook served when OpenAI failed (see _generate_notebook). An
+        item that fails outright yields ``(index, exception, False)``
+        instead; the rest of the batch carries on.
+        """
+        semaphore = asyncio.Semaphore(parallelism)
+        
+        async def generate(index: int, item: Dict) -> Tuple[int, Any, bool]:
+            async with semaphore:
+                try:
+                    if not isinstance(item, dict) or not item.get("diagram"):
+                        raise ValueError("Diagram is required")
+                    item_engine = item.get("engine", engine)
+                    if item_engine not in ENGINES:
+                        raise ValueError(f"engine must be one of: {', '.join(ENGINES)}")
+                    notebook, degraded = await self._generate_notebook(
+                        item.get("prompt", "Generated from flowchart"),
+                        item["diagram"],
+                        item.get("language", "python"),
+                        api_key,
+                        use_cache,
+                        BATCH,
+                        item_engine,
+                    )
+                    return index, notebook, degraded
+                except Exception as e:
+                    return index, e, False
+        
+        tasks = [asyncio.ensure_future(generate(index, item)) for index, item in enumerate(items)]
+        try:
+            for finished in asyncio.as_completed(tasks):
+                yield await finished
+        finally:
+            # The client went away; stop the generations nobody will read
+            for task in tasks:
+                task.cancel()
+    
+    async def stream_marimo_notebook(
+        self,
+        prompt: str,
+        diagram: str,
+        language: str,
+        api_key: str,
+        use_cache: bool = True,
+        priority: int = INTERACTIVE,
+        engine: str = ENGINE_AUTO,
+    ) -> AsyncIterator[Tuple[str, str]]:
+        """Generate a Marimo notebook, yielding ``(event, data)`` pairs as it arrives.
+        
+        Yields ``("token", text)`` for each streamed delta and always ends
+        with ``("notebook", content)`` carrying the finalized notebook. A
+        failed generation yields ``("error", message)`` before the fallback
+        notebook. A cache hit is sent as a single token. The scheduler slot
+        is held for the whole stream; streams are not retried. While the
+        circuit breaker is open the error comes at once, followed by the
+        cached notebook if there is one. ``engine`` is as for
+        generate_marimo_notebook.
+        """
+        local = self._local_notebook(diagram, language, engine)
+        if local is not None:
+            yield "token", local
+            yield "notebook", embed_diagram(local, diagram)
+            return
+        
+        key = generation_key(prompt, diagram, language, MODEL, TEMPERATURE, prompt_versions())
+        if self.cache is not None:
+            if not use_cache:
+                self.cache.bypassed += 1
+            else:
+                cached = self.cache.get(key)
+                if cached is not None:
+                    yield "token", cached
+                    yield "notebook", embed_diagram(cached, diagram)
+                    return
+        
+        if not self.breaker.allows():
+            self.breaker.reject()
+            yield "error", "OpenAI is unavailable; serving a stored or fallback notebook"
+            yield "notebook", embed_diagram(self._degraded_notebook(key, prompt, diagram, language), diagram)
+            return
+        
+        parts = []
+        tokens = 0
+        truncated = False
+        try:
+            prompt_id = get_prompt("notebook").id
+            messages = self._build_messages(prompt, compact_diagram(diagram), language)
+            prompt_tokens = count_message_tokens(messages)
+            max_tokens = fit_completion_budget(prompt_tokens, completion_budget(diagram_nodes(diagram)))
+            async with self.scheduler.slot(api_key, priority, prompt_tokens + max_tokens) as slot:
+                for attempt in range(MAX_CONTINUATIONS + 1):
+                    # Continuations stream straight on; tokens already sent cannot be de-duplicated
+                    request = messages + continuation_messages("".join(parts)) if attempt else messages
+                    started = time.perf_counter()
+                    # A hedge races the time to the first token, and the breaker only times that wait
+                    first, chunks, _ = await self.breaker.run(
+                        lambda: self._hedged(
+                            f"{prompt_id} first token",
+                            lambda: self._open_stream(api_key, request, max_tokens),
+                            lambda opened: self._close_stream(opened[2]),
+                        ),
+                        _upstream_failure,
+                    )
+                    finish_reason = None
+                    async for chunk in _chain(first, chunks):
+                        # The final chunk only carries usage
+                        if getattr(chunk, "usage", None):
+                            tokens += chunk.usage.total_tokens
+                            slot.used_tokens = tokens
+                            self.usage.record(prompt_id, chunk.usage, time.perf_counter() - started)
+                        if chunk.choices:
+                            finish_reason = chunk.choices[0].finish_reason or finish_reason
+                            if chunk.choices[0].delta.content:
+                                parts.append(chunk.choices[0].delta.content)
+                                yield "token", chunk.choices[0].delta.content
+                    truncated = finish_reason == "length"
+                    if not truncated:
+                        break
+                    if attempt < MAX_CONTINUATIONS:
+                        self.usage.continuations += 1
+            
+            content = strip_code_fences("".join(parts))
+            if truncated:
+                self.usage.truncated += 1
+                content = trim_to_complete_cells(content)
+                if content is None:
+                    raise ValueError("Generated notebook was cut off before its first complete cell")
+            notebook_content = self._finalize_notebook(content)
+        except Exception as e:
+            yield "error", str(e)
+            yield "notebook", embed_diagram(self._degraded_notebook(key, prompt, diagram, language), diagram)
+            return
+        
+        if self.cache is not None and not truncated:
+            self.cache.put(key, notebook_content, tokens)
+        yield "notebook", embed_diagram(notebook_content, diagram)
+    
+    async def _complete(
+        self, prompt_id: str, messages: List[Dict[str, str]], api_key: str, priority: int, max_tokens: int
+    ) -> Tuple[str, int, bool]:
+        """Call OpenAI once admitted by the scheduler, continuing replies cut off at ``max_tokens``.
+        
+        A reply that stops with ``finish_reason == "length"`` is sent back
+        as an assistant message with a request to continue, up to
+        MAX_CONTINUATIONS times, and the pieces are stitched together.
+        Every call's usage is recorded. Returns (content, total tokens,
+        still cut off).
+        """
+        client = self._get_client(api_key)
+        max_tokens = fit_completion_budget(count_message_tokens(messages), max_tokens)
+        content = ""
+        tokens = 0
+        for attempt in range(MAX_CONTINUATIONS + 1):
+            request = messages + continuation_messages(content) if attempt else messages
+            
+            async def call():
+                started = time.perf_counter()
+                response = await self.breaker.run(
+                    lambda: self._hedged(prompt_id, lambda: client.chat.completions.create(
+                        model=MODEL,
+                        messages=request,
+                        temperature=TEMPERATURE,
+                        max_tokens=max_tokens
+                    )),
+                    _upstream_failure,
+                    max_tokens,
+                )
+                self.usage.record(prompt_id, getattr(response, "usage", None), time.perf_counter() - started)
+                return response
+            
+            response = await self.scheduler.run(
+                call,
+                key=api_key,
+                priority=priority,
+                tokens=count_message_tokens(request) + max_tokens,
+            )
+            choice = response.choices[0]
+            text = choice.message.content or ""
+            content += text[continuation_overlap(content, text):]
+            usage = getattr(response, "usage", None)
+            tokens += usage.total_tokens if usage else 0
+            if choice.finish_reason != "length":
+                return content, tokens, False
+            if attempt < MAX_CONTINUATIONS:
+                self.usage.continuations += 1
+        self.usage.truncated += 1
+        return content, tokens, True
+    
+    async def _hedged(
+        self, kind: str, call: Callable[[], Awaitable], discard: Optional[Callable[[Any], Awaitable]] = None
+    ):
+        """Await an OpenAI call, hedged when the service has a hedger."""
+        if self.hedger is None:
+            return await call()
+        return await self.hedger.run(kind, call, discard)
+    
+    async def _open_stream(self, api_key: str, messages: List[Dict[str, str]], max_tokens: int):
+        """Start a streamed completion and read up to its first token.
+        
+        Returns (chunks read so far, iterator over the rest, the stream).
+        """
+        stream = await self._get_client(api_key).chat.completions.create(
+            model=MODEL,
+            messages=messages,
+            temperature=TEMPERATURE,
+            max_tokens=max_tokens,
+            stream=True,
+            stream_options={"include_usage": True}
+        )
+        chunks = stream.__aiter__()
+        first = []
+        try:
+            while True:
+                chunk = await chunks.__anext__()
+                first.append(chunk)
+                if chunk.choices and (chunk.choices[0].delta.content or chunk.choices[0].finish_reason):
+                    break
+        except StopAsyncIteration:
+            pass
+        except BaseException:
+            # Includes losing a hedge race
+            await self._close_stream(stream)
+            raise
+        return first, chunks, stream
+    
+    async def _close_stream(self, stream) -> None:
+        """Close a streamed completion without reading the rest."""
+        if hasattr(stream, "close"):
+            # openai.AsyncStream
+            await stream.close()
+        else:
+            await stream.aclose()
+    
+    def _local_notebook(self, diagram: str, language: str, engine: str) -> Optional[str]:
+        """Build the notebook locally if the diagram is a templated Python flowchart."""
+        if engine != ENGINE_AUTO or language.strip().lower() != "python":
+            return None
+        try:
+            graph = parse_flowchart(diagram)
+        except ValueError:
+            return None
+        if not is_templated(graph):
+            return None
+        self.local_generations += 1
+        return self._finalize_notebook(flow_to_marimo(graph))
+    
+    async def _generate_parts(
+        self, prompt: str, graph: Dict, language: str, api_key: str, priority: int
+    ) -> Tuple[str, Optional[int]]:
+        """Generate a flowchart's cells part by part and assemble one notebook.
+        
+        The parts from partition_flowchart are requested concurrently (see
+        _generate_fragments). Returns the notebook and the tokens used, or
+        None for the tokens if any part fell short so the result is not
+        cached.
+        """
+        fragments, tokens, _ = await self._generate_fragments(
+            prompt, graph, partition_flowchart(graph, MAX_PART_NODES), language, api_key, priority
+        )
+        return self._finalize_notebook(assemble_cells(fragments)), tokens
+    
+    async def _generate_fragments(
+        self, prompt: str, graph: Dict, parts: List[List[str]], language: str, api_key: str, priority: int
+    ) -> Tuple[List[str], Optional[int], List[str]]:
+        """Generate the cells for each part of a flowchart concurrently.
+        
+        Each part asks for one ``node_<id>`` cell per node that defines
+        ``value_<id>``, so the cells wire up across parts. A part that fails
+        or does not parse is replaced by flow_to_marimo template cells, and
+        so are the nodes a part left out or lost to truncation. Returns one
+        fragment per part, the tokens used (None if any part fell short)
+        and the node ids given template cells.
+        """
+        incoming = predecessors(graph)
+        results = await asyncio.gather(
+            *(
+                self._complete(
+                    get_prompt("notebook_part").id,
+                    self._build_part_messages(prompt, graph, part, incoming, language),
+                    api_key,
+                    priority,
+                    completion_budget(len(part)),
+                )
+                for part in parts
+            ),
+            return_exceptions=True,
+        )
+        
+        fragments = []
+        tokens: Optional[int] = 0
+        fallback: List[str] = []
+        for part, result in zip(parts, results):
+            if isinstance(result, Exception):
+                print(f"Part generation failed after retries: {type(result).__name__}: {result}")
+            else:
+                content, part_tokens, truncated = result
+                fragment = strip_code_fences(content)
+                if truncated:
+                    fragment = trim_to_complete_cells(fragment) or ""
+                try:
+                    assemble_cells([fragment])
+                except SyntaxError as e:
+                    print(f"Generated part does not parse: {e}")
+                else:
+                    # Template cells stand in for nodes the part is missing
+                    missing = [node_id for node_id in part if f"def {cell_name(node_id)}(" not in fragment]
+                    fragments.append(fragment + "\n\n" + flow_cells(graph, missing) if missing else fragment)
+                    fallback.extend(missing)
+                    if tokens is not None:
+                        tokens = None if missing else tokens + part_tokens
+                    continue
+            # Template cells keep the failed part's nodes wired up
+            fragments.append(flow_cells(graph, part))
+            fallback.extend(part)
+            tokens = None
+        
+        return fragments, tokens, fallback
+    
+    def _build_part_messages(
+        self, prompt: str, graph: Dict, part: List[str], incoming: Dict[str, List[str]], language: str
+    ) -> List[Dict[str, str]]:
+        """Build the chat messages for one part of a partitioned flowchart."""
+        cells = []
+        for node_id in part:
+            node = graph["nodes"][node_id]
+            inputs = ", ".join(
+                f'{output_name(source)} ("{graph["nodes"][source]["label"]}")' for source in incoming[node_id]
+            )
+            cells.append(
+                f'- {cell_name(node_id)}: "{node["label"]}" -> {output_name(node_id)}; inputs: {inputs or "none"}'
+            )
+        return get_prompt("notebook_part").messages(
+            language=language, diagram=render_flowchart(graph, part), cells="\n".join(cells), prompt=prompt
+        )
+    
+    def _get_client(self, api_key: str):
+        """Get the OpenAI client for an API key.
+        
+        OPENAI_BASE_URL points the client at another endpoint, such as a
+        local fake server for testing.
+        """
+        return self.clients.get(api_key, os.environ.get("OPENAI_BASE_URL"))
+    
+    def _build_messages(self, prompt: str, diagram: str, language: str) -> List[Dict[str, str]]:
+        """Build the chat messages for a generation request.
+        
+        The instructions and examples are a static prefix shared by every
+        request (so the provider can cache it); the request itself comes last.
+        """
+        return get_prompt("notebook").messages(language=language, diagram=diagram, prompt=prompt)
+    
+    def _finalize_notebook(self, content: str) -> str:
+        """Validate generated code and wrap it in the Marimo header and footer.
+        
+        Cheap repairs are applied on the way (see validate_notebook).
+        Raises ValueError when the code cannot be made a valid notebook.
+        """
+        result = self.validator.validate(content)
+        if not result["valid"]:
+            raise ValueError(f"Generated notebook is invalid: {'; '.join(result['errors'])}")
+        return result["notebook"]
     
     def _create_fallback_notebook(self, prompt: str, diagram: str, language: str) -> str:
         """Create a fallback Marimo notebook if AI generation fails."""
-        return f"""# /// script
-import marimo as mo
+        return f"""import marimo
 
-app = mo.App()
+app = marimo.App()
 
 @app.cell
 def setup():
@@ -128,4 +741,7 @@ def main_logic():
     print("But you still get a real Marimo notebook!")
     return "Main logic executed"
 
-# ///"""
+
+if __name__ == "__main__":
+    app.run()
+"""
@@ -0,0 +1,174 @@
+"""
+Bounded Cache for Python Workers
+LRU cache with TTL expiry, entry and byte budgets
+"""
+
+import heapq
+import math
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+
+class BoundedCache:
+    """LRU cache with an ordered expiry index and entry/byte budgets.
+
+    Entries are kept in an ``OrderedDict`` (least recently used first) so
+    get/put are O(1). Expiry deadlines live in a min-heap; stale heap items
+    are skipped lazily, so expiry work is amortized across operations instead
+    of scanning every entry.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = 1000,
+        max_bytes: int = 64 * 1024 * 1024,
+        ttl: float = 24 * 3600,
+        max_ttl: Optional[float] = None,
+        adaptive_ttl: bool = True,
+        clock: Callable[[], float] = time.time,
+    ):
+        """Initialize the cache.
+
+        ``ttl`` is the base lifetime of an entry. With ``adaptive_ttl`` the
+        lifetime grows with the entry's ``access_count`` (up to ``max_ttl``)
+        and is measured from ``last_accessed``, so hot entries stay resident.
+        """
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.max_ttl = max_ttl if max_ttl is not None else ttl * 7
+        self.adaptive_ttl = adaptive_ttl
+        self._clock = clock
+        self._entries: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._expiry_heap: List[Tuple[float, int, str]] = []
+        self._sequence = 0
+        self.total_bytes = 0
+        self.counters = {
+            "hits": 0,
+            "misses": 0,
+            "evicted_expired": 0,
+            "evicted_entries": 0,
+            "evicted_bytes": 0,
+        }
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, key: str) -> bool:
+        return self.peek(key) is not None
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(list(self._entries))
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """Get an entry record, marking it as recently used."""
+        now = self._clock()
+        self._expire(now)
+        entry = self._entries.get(key)
+        if entry is None:
+            self.counters["misses"] += 1
+            return None
+
+        entry["last_accessed"] = now
+        entry["access_count"] += 1
+        self._entries.move_to_end(key)
+        if self.adaptive_ttl:
+            self._schedule(key, entry, now + self._entry_ttl(entry))
+        self.counters["hits"] += 1
+        return entry
+
+    def peek(self, key: str) -> Optional[Dict[str, Any]]:
+        """Get an entry record without touching its LRU position or TTL."""
+        entry = self._entries.get(key)
+        if entry is None or entry["expires_at"] <= self._clock():
+            return None
+        return entry
+
+    def put(self, key: str, value: Any, size: int, **metadata: Any) -> Dict[str, Any]:
+        """Store a value with its byte size and return the entry record."""
+        now = self._clock()
+        self._expire(now)
+
+        previous = self._entries.pop(key, None)
+        if previous is not None:
+            self.total_bytes -= previous["size"]
+
+        entry = {
+            "value": value,
+            "size": size,
+            "created_at": now,
+            "last_accessed": now,
+            "access_count": 0,
+            "expires_at": now + self.ttl,
+        }
+        entry.update(metadata)
+        self._entries[key] = entry
+        self.total_bytes += size
+        self._schedule(key, entry, entry["expires_at"])
+        self._enforce_budgets(keep=key)
+        return entry
+
+    def pop(self, key: str) -> Optional[Dict[str, Any]]:
+        """Remove an entry and return its record."""
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.total_bytes -= entry["size"]
+        return entry
+
+    def stats(self) -> Dict[str, Any]:
+        """Return occupancy and eviction counters."""
+        lookups = self.counters["hits"] + self.counters["misses"]
+        return {
+            "entries": len(self._entries),
+            "bytes": self.total_bytes,
+            "max_entries": self.max_entries,
+            "max_bytes": self.max_bytes,
+            "hit_ratio": self.counters["hits"] / lookups if lookups else 0.0,
+            **self.counters,
+        }
+
+    def _entry_ttl(self, entry: Dict[str, Any]) -> float:
+        """Lifetime for an entry, doubling per power-of-two of its accesses."""
+        ttl = self.ttl * (1 + math.log2(1 + entry["access_count"]))
+        return min(ttl, self.max_ttl)
+
+    def _schedule(self, key: str, entry: Dict[str, Any], expires_at: float) -> None:
+        """Record a new deadline; older heap items for the key go stale."""
+        entry["expires_at"] = expires_at
+        self._sequence += 1
+        heapq.heappush(self._expiry_heap, (expires_at, self._sequence, key))
+
+        # Hot keys push many deadlines; rebuild once stale items dominate
+        if len(self._expiry_heap) > 2 * len(self._entries) + 64:
+            self._expiry_heap = [
+                (item["expires_at"], 0, entry_key)
+                for entry_key, item in self._entries.items()
+            ]
+            heapq.heapify(self._expiry_heap)
+
+    def _expire(self, now: float) -> None:
+        """Drop entries whose deadline has passed, oldest deadline first."""
+        heap = self._expiry_heap
+        while heap and heap[0][0] <= now:
+            expires_at, _, key = heapq.heappop(heap)
+            entry = self._entries.get(key)
+            if entry is not None and entry["expires_at"] == expires_at:
+                self.pop(key)
+                self.counters["evicted_expired"] += 1
+
+    def _enforce_budgets(self, keep: str) -> None:
+        """Evict least recently used entries until both budgets are met."""
+        while len(self._entries) > self.max_entries:
+            oldest = next(iter(self._entries))
+            if oldest == keep:
+                break
+            self.pop(oldest)
+            self.counters["evicted_entries"] += 1
+
+        while self.total_bytes > self.max_bytes and len(self._entries) > 1:
+            oldest = next(iter(self._entries))
+            if oldest == keep:
+                break
+            self.pop(oldest)
+            self.counters["evicted_bytes"] += 1
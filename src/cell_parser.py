@@ -0,0 +1,446 @@
+"""
+Cell Parser for Python Workers
+Extracts Marimo cells and their dataflow from notebook source with ast
+"""
+
+import ast
+import builtins
+import gc
+import re
+import tokenize
+from typing import Dict, List, Set, Tuple
+
+BUILTIN_NAMES = frozenset(dir(builtins))
+
+_SCOPE_NODES = (ast.FunctionDef, ast.AsyncFunctionDef, ast.Lambda, ast.ClassDef)
+_COMPREHENSION_NODES = (ast.ListComp, ast.SetComp, ast.DictComp, ast.GeneratorExp)
+
+# Column-0 cell decorators; candidate split points for chunked parsing
+_CELL_START = re.compile(r"^@app\.cell\b", re.MULTILINE)
+
+
+def is_cell_decorator(decorator: ast.expr) -> bool:
+    """Match ``@app.cell`` and ``@app.cell(...)``."""
+    if isinstance(decorator, ast.Call):
+        decorator = decorator.func
+    return (
+        isinstance(decorator, ast.Attribute)
+        and decorator.attr == "cell"
+        and isinstance(decorator.value, ast.Name)
+        and decorator.value.id == "app"
+    )
+
+
+def _argument_names(args: ast.arguments) -> Set[str]:
+    """Names bound by a function's parameter list."""
+    names = {arg.arg for arg in args.posonlyargs + args.args + args.kwonlyargs}
+    if args.vararg:
+        names.add(args.vararg.arg)
+    if args.kwarg:
+        names.add(args.kwarg.arg)
+    return names
+
+
+def _scope_names(body: List[ast.AST]) -> Tuple[Set[str], Set[str], List[ast.AST]]:
+    """Collect (bound, loaded, nested scopes) for one scope without descending into nested scopes."""
+    bound: Set[str] = set()
+    loaded: Set[str] = set()
+    nested: List[ast.AST] = []
+    stack = list(body)
+
+    while stack:
+        node = stack.pop()
+        if isinstance(node, _SCOPE_NODES):
+            if not isinstance(node, ast.Lambda):
+                bound.add(node.name)
+                stack.extend(node.decorator_list)
+            if isinstance(node, ast.ClassDef):
+                stack.extend(node.bases)
+            else:
+                stack.extend(node.args.defaults)
+                stack.extend(d for d in node.args.kw_defaults if d is not None)
+            nested.append(node)
+            continue
+        if isinstance(node, _COMPREHENSION_NODES):
+            # The first iterable is evaluated in the enclosing scope
+            stack.append(node.generators[0].iter)
+            nested.append(node)
+            continue
+        if isinstance(node, ast.Name):
+            if isinstance(node.ctx, ast.Load):
+                loaded.add(node.id)
+            else:
+                bound.add(node.id)
+        elif isinstance(node, (ast.Import, ast.ImportFrom)):
+            for alias in node.names:
+                if alias.name != "*":
+                    bound.add((alias.asname or alias.name).split(".")[0])
+        elif isinstance(node, (ast.Global, ast.Nonlocal)):
+            bound.update(node.names)
+        elif isinstance(node, ast.ExceptHandler) and node.name:
+            bound.add(node.name)
+        elif isinstance(node, ast.MatchAs) and node.name:
+            bound.add(node.name)
+        elif isinstance(node, ast.MatchStar) and node.name:
+            bound.add(node.name)
+        elif isinstance(node, ast.MatchMapping) and node.rest:
+            bound.add(node.rest)
+        stack.extend(ast.iter_child_nodes(node))
+
+    return bound, loaded, nested
+
+
+def _free_names(scope: ast.AST) -> Set[str]:
+    """Names a nested scope reads from its enclosing scopes."""
+    if isinstance(scope, _COMPREHENSION_NODES):
+        generators = scope.generators
+        body: List[ast.AST] = [g.target for g in generators]
+        body.extend(g.iter for g in generators[1:])
+        body.extend(cond for g in generators for cond in g.ifs)
+        if isinstance(scope, ast.DictComp):
+            body.extend((scope.key, scope.value))
+        else:
+            body.append(scope.elt)
+        bound, loaded, nested = _scope_names(body)
+    elif isinstance(scope, ast.Lambda):
+        bound, loaded, nested = _scope_names([scope.body])
+        bound |= _argument_names(scope.args)
+    else:
+        bound, loaded, nested = _scope_names(scope.body)
+        if not isinstance(scope, ast.ClassDef):
+            bound |= _argument_names(scope.args)
+
+    for child in nested:
+        loaded |= _free_names(child)
+    return loaded - bound
+
+
+def _returned_names(function: ast.AST) -> List[str]:
+    """Names returned by the cell's final ``return`` statement."""
+    if not function.body or not isinstance(function.body[-1], ast.Return):
+        return []
+    value = function.body[-1].value
+    if isinstance(value, ast.Name):
+        return [value.id]
+    if isinstance(value, ast.Tuple):
+        return [elt.id for elt in value.elts if isinstance(elt, ast.Name)]
+    return []
+
+
+def _is_output_return(statement: ast.AST) -> bool:
+    """A ``return <expr>`` whose value is the cell's output rather than the names it defines."""
+    if not isinstance(statement, ast.Return) or statement.value is None:
+        return False
+    value = statement.value
+    if isinstance(value, ast.Tuple):
+        return not all(isinstance(elt, ast.Name) for elt in value.elts)
+    return not isinstance(value, ast.Name)
+
+
+def return_statement(names: List[str]) -> str:
+    """The ``return`` a cell ends with to publish ``names``."""
+    if len(names) == 1:
+        return f"return ({names[0]},)"
+    if names:
+        return f"return ({', '.join(names)})"
+    return "return"
+
+
+def analyze_cell(function: ast.AST, lines: List[str], index: int, line_offset: int = 0) -> Dict:
+    """Describe one ``@app.cell`` function parsed ``line_offset`` lines into the file."""
+    parameters = [arg.arg for arg in function.args.args]
+    bound, loaded, nested = _scope_names(function.body)
+    for child in nested:
+        loaded |= _free_names(child)
+
+    start_line = min([function.lineno] + [d.lineno for d in function.decorator_list]) + line_offset
+    end_line = function.end_lineno + line_offset
+    defines = sorted(bound - set(parameters))
+    references = sorted((loaded - bound - BUILTIN_NAMES) | set(parameters))
+
+    return {
+        "index": index,
+        "name": function.name,
+        "start_line": start_line,
+        "end_line": end_line,
+        "body_start_line": function.body[0].lineno + line_offset,
+        "source": "".join(lines[start_line - 1:end_line]),
+        "parameters": parameters,
+        "defines": defines,
+        "references": references,
+        "returns": _returned_names(function),
+    }
+
+
+def split_cell_chunks(source: str) -> List[Tuple[int, str]]:
+    """Split source before each column-0 ``@app.cell`` line as (line offset, chunk)."""
+    bounds = [0] + [match.start() for match in _CELL_START.finditer(source)] + [len(source)]
+    chunks = []
+    line_offset = 0
+    for start, end in zip(bounds, bounds[1:]):
+        if start == end:
+            continue
+        chunk = source[start:end]
+        chunks.append((line_offset, chunk))
+        line_offset += chunk.count("\n")
+    return chunks
+
+
+def _collect_cells(tree: ast.Module, lines: List[str], cells: List[Dict], line_offset: int) -> None:
+    """Append the cells defined at the top level of ``tree``."""
+    for node in tree.body:
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)) and any(
+            is_cell_decorator(d) for d in node.decorator_list
+        ):
+            cells.append(analyze_cell(node, lines, len(cells), line_offset))
+
+
+def extract_cells(source: str) -> List[Dict]:
+    """Extract every Marimo cell from notebook source, in file order.
+
+    Each cell is parsed on its own, which keeps ASTs small and parsing
+    linear in notebook size. A split that lands inside a multi-line string
+    (or leaves a decorator stranded) makes a chunk fail to parse, in which
+    case the whole file is parsed at once instead.
+
+    Raises SyntaxError if the notebook does not parse.
+    """
+    lines = source.splitlines(keepends=True)
+    # The ASTs are acyclic and short-lived; cyclic GC passes over their
+    # nodes only add parse time
+    gc_was_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        cells: List[Dict] = []
+        try:
+            for line_offset, chunk in split_cell_chunks(source):
+                _collect_cells(ast.parse(chunk), lines, cells, line_offset)
+        except SyntaxError:
+            cells = []
+            _collect_cells(ast.parse(source), lines, cells, 0)
+        return cells
+    finally:
+        if gc_was_enabled:
+            gc.enable()
+
+
+def _collect_imports(tree: ast.Module, modules: Set[str]) -> None:
+    """Add the top-level package of every absolute import in ``tree``."""
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            modules.update(alias.name.split(".")[0] for alias in node.names)
+        elif isinstance(node, ast.ImportFrom) and node.module and not node.level:
+            modules.add(node.module.split(".")[0])
+
+
+def extract_imports(source: str) -> Set[str]:
+    """Top-level packages the notebook imports anywhere, including inside cells.
+
+    Parses cell by cell like extract_cells, skipping cells that cannot
+    contain an import. Raises SyntaxError if a parsed cell does not parse.
+    """
+    gc_was_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        modules: Set[str] = set()
+        try:
+            for _, chunk in split_cell_chunks(source):
+                # Most cells import nothing; only parse the ones that might
+                if "import" in chunk:
+                    _collect_imports(ast.parse(chunk), modules)
+        except SyntaxError:
+            modules = set()
+            _collect_imports(ast.parse(source), modules)
+        return modules
+    finally:
+        if gc_was_enabled:
+            gc.enable()
+
+
+def import_statements(node: ast.AST) -> List[Tuple[str, str]]:
+    """Split an import into one (bound name, statement) pair per alias."""
+    if isinstance(node, ast.Import):
+        return [
+            ((alias.asname or alias.name).split(".")[0], ast.unparse(ast.Import(names=[alias])))
+            for alias in node.names
+        ]
+    return [
+        (alias.asname or alias.name, ast.unparse(ast.ImportFrom(module=node.module, names=[alias], level=node.level)))
+        for alias in node.names
+    ]
+
+
+def _strip_return(line: str, column: int) -> str:
+    """Turn the ``return <expr>`` starting at ``column`` of ``line`` into ``<expr>``."""
+    return line[:column] + line[column + len("return"):].lstrip(" \t")
+
+
+def _is_hoistable(node: ast.AST) -> bool:
+    """Imports that bind names (not ``*``) can move to the shared imports cell."""
+    return isinstance(node, (ast.Import, ast.ImportFrom)) and all(alias.name != "*" for alias in node.names)
+
+
+def assemble_cells(fragments: List[str]) -> str:
+    """Merge the cells of separately generated notebook fragments into one body.
+
+    Every top-level import, in a cell or at fragment level, is hoisted into
+    a single ``imports`` cell with duplicates removed (the first import of
+    a name wins). Each cell's parameters and ``return`` are then rewritten
+    from its dataflow: it takes the names it reads that another cell
+    defines and returns the public names it defines. A trailing
+    ``return <expr>`` that is not a list of names is the cell's output, so
+    it stays as the last expression. Code outside cells is dropped.
+
+    Raises SyntaxError if a fragment does not parse.
+    """
+    imports: Dict[str, str] = {}
+    cells = []
+    for fragment in fragments:
+        lines = fragment.splitlines()
+        for node in ast.parse(fragment).body:
+            if _is_hoistable(node):
+                for name, statement in import_statements(node):
+                    imports.setdefault(name, statement)
+                continue
+            if not isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)) or not any(
+                is_cell_decorator(d) for d in node.decorator_list
+            ):
+                continue
+            body = list(node.body)
+            output = body[-1] if _is_output_return(body[-1]) else None
+            if isinstance(body[-1], ast.Return) and output is None:
+                body.pop()
+            kept = []
+            hoisted: Set[int] = set()
+            for statement in body:
+                if _is_hoistable(statement):
+                    for name, text in import_statements(statement):
+                        imports.setdefault(name, text)
+                    hoisted.update(range(statement.lineno, statement.end_lineno + 1))
+                else:
+                    kept.append(statement)
+            bound, loaded, nested = _scope_names(kept)
+            for child in nested:
+                loaded |= _free_names(child)
+            decorator_start = min(d.lineno for d in node.decorator_list)
+            # Comment lines leading the body stay with it
+            body_start = node.body[0].lineno
+            while body_start - 1 > node.lineno and lines[body_start - 2].strip().startswith("#"):
+                body_start -= 1
+            # Comments between the kept statements stay with them
+            cell_body = []
+            for number in range(body_start, kept[-1].end_lineno + 1 if kept else 0):
+                if number in hoisted:
+                    continue
+                line = lines[number - 1]
+                if output is not None and number == output.lineno:
+                    line = _strip_return(line, output.col_offset)
+                cell_body.append(line)
+            while cell_body and not cell_body[0].strip():
+                cell_body.pop(0)
+            cells.append({
+                "name": node.name,
+                "decorators": lines[decorator_start - 1:node.lineno - 1],
+                "indent": " " * node.body[0].col_offset,
+                "body": cell_body,
+                "defines": sorted(name for name in bound if not name.startswith("_")),
+                "reads": loaded - bound - BUILTIN_NAMES,
+            })
+
+    cells = [cell for cell in cells if cell["body"] or cell["defines"]]
+    imported = sorted(set(imports))
+    header = {"name": "imports", "decorators": ["@app.cell"], "body": [], "defines": imported, "reads": set()}
+    definers: Dict[str, int] = {name: -1 for name in imported}
+    for index, cell in enumerate(cells):
+        for name in cell["defines"]:
+            definers.setdefault(name, index)
+
+    rendered = []
+    for index, cell in enumerate([header] + cells, start=-1):
+        parameters = sorted(name for name in cell["reads"] if definers.get(name, index) != index)
+        body = cell["body"] or ([f"    {statement}" for statement in imports.values()] if index < 0 else [])
+        indent = cell.get("indent", "    ")
+        rendered.append("\n".join(
+            cell["decorators"]
+            + [f"def {cell['name']}({', '.join(parameters)}):"]
+            + body
+            + [indent + return_statement(cell["defines"])]
+        ))
+    return "\n\n\n".join(rendered if imports else rendered[1:]) + "\n"
+
+
+def _signature_end(lines: List[str], function: ast.AST) -> Tuple[int, int]:
+    """(line, column) just past the colon closing a function's ``def`` line(s)."""
+    readline = iter(lines[function.lineno - 1:]).__next__
+    depth = 0
+    for token in tokenize.generate_tokens(readline):
+        if token.type != tokenize.OP:
+            continue
+        if token.string in ("(", "[", "{"):
+            depth += 1
+        elif token.string in (")", "]", "}"):
+            depth -= 1
+        elif token.string == ":" and depth == 0:
+            return function.lineno + token.end[0] - 1, token.end[1]
+    raise SyntaxError(f"Unterminated def line for {function.name}")
+
+
+def rewrite_signatures(source: str, signatures: Dict[int, Tuple[List[str], List[str]]]) -> str:
+    """Rewrite the parameters and final ``return`` of some cells, leaving every other line alone.
+
+    ``signatures`` maps a cell's index, as extract_cells numbers them, to
+    its (parameters, returned names). A trailing ``return <expr>`` that is
+    not a list of names is the cell's output, so it becomes the last
+    expression ahead of the new return.
+
+    Raises SyntaxError if the source does not parse.
+    """
+    lines = (source if source.endswith("\n") else source + "\n").splitlines(keepends=True)
+    functions = [
+        node for node in ast.parse(source).body
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)) and any(map(is_cell_decorator, node.decorator_list))
+    ]
+    # (first line, last line, replacement lines); applied bottom up so line numbers stay valid
+    edits: List[Tuple[int, int, List[str]]] = []
+    for index, function in enumerate(functions):
+        if index not in signatures:
+            continue
+        parameters, returns = signatures[index]
+        end_line, end_column = _signature_end(lines, function)
+        if function.body[0].lineno <= end_line:
+            # A body on the def line itself (def f(): ...) has no indent to follow; left as is
+            continue
+        last = function.body[-1]
+        if isinstance(last, ast.Return) and not _is_output_return(last):
+            head = lines[last.lineno - 1][:last.col_offset]
+            tail = lines[last.end_lineno - 1][last.end_col_offset:]
+            edits.append((last.lineno, last.end_lineno, [head + return_statement(returns) + tail]))
+        else:
+            if isinstance(last, ast.Return):
+                edits.append((last.lineno, last.lineno, [_strip_return(lines[last.lineno - 1], last.col_offset)]))
+            indent = " " * function.body[0].col_offset
+            edits.append((last.end_lineno + 1, last.end_lineno, [indent + return_statement(returns) + "\n"]))
+        keyword = "async def" if isinstance(function, ast.AsyncFunctionDef) else "def"
+        signature = f"{keyword} {function.name}({', '.join(parameters)}):"
+        edits.append((
+            function.lineno,
+            end_line,
+            [lines[function.lineno - 1][:function.col_offset] + signature + lines[end_line - 1][end_column:]],
+        ))
+
+    for first, last_line, replacement in sorted(edits, key=lambda edit: edit[0], reverse=True):
+        lines[first - 1:last_line] = replacement
+    return "".join(lines)
+
+
+def build_cell_manifest(source: str) -> Dict:
+    """Build the JSON-ready cell manifest served to the viewers."""
+    try:
+        cells = extract_cells(source)
+    except SyntaxError as error:
+        return {
+            "cells": [],
+            "error": {"message": error.msg, "line": error.lineno, "offset": error.offset},
+        }
+    return {"cells": cells, "error": None}
+
@@ -0,0 +1,187 @@
+"""
+Circuit Breaker for Python Workers
+Stops calling a degraded upstream and lets a few probes test its recovery
+"""
+
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, Optional, Tuple, TypeVar
+
+T = TypeVar("T")
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+# Rolling window the error and slow-call rates are measured over
+WINDOW_SECONDS = 60.0
+MAX_WINDOW_CALLS = 1000
+# Calls the window needs before it can trip the breaker
+MIN_CALLS = 10
+# Trip when at least this share of the window failed, or was slow
+FAILURE_RATE = 0.5
+SLOW_CALL_RATE = 0.5
+# A call is slow past SLOW_CALL_SECONDS plus SLOW_CALL_SECONDS_PER_TOKEN for each token
+# it may return, so a long buffered completion is not held to a short one's time
+SLOW_CALL_SECONDS = 15.0
+SLOW_CALL_SECONDS_PER_TOKEN = 0.02  # 50 tokens/s
+
+# Seconds the circuit stays open before probing, and the probes that must succeed to close it
+OPEN_SECONDS = 30.0
+HALF_OPEN_PROBES = 3
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling an upstream whose circuit is open."""
+
+
+class CircuitBreaker:
+    """Closed / open / half-open circuit breaker over rolling windows.
+
+    While closed, every call runs and its outcome joins a window of the
+    last ``window`` seconds. Once the window holds ``min_calls`` and
+    either the failure rate or the share of slow calls reaches its
+    threshold, the circuit opens: calls are refused
+    with CircuitOpenError for ``open_seconds``. It then half-opens and lets
+    at most ``probes`` calls through; once that many have succeeded
+    quickly it closes with an empty window, and any failed or slow probe
+    opens it again. Errors for which ``is_failure`` is false (bad requests,
+    cancellation) are not counted either way.
+
+    A call is slow after ``slow_call`` seconds plus ``slow_call_per_token``
+    for each of the ``tokens`` given to run(); a call that only waits for
+    the first streamed token passes none.
+    """
+
+    def __init__(
+        self,
+        window: float = WINDOW_SECONDS,
+        min_calls: int = MIN_CALLS,
+        failure_rate: float = FAILURE_RATE,
+        slow_call_rate: float = SLOW_CALL_RATE,
+        slow_call: float = SLOW_CALL_SECONDS,
+        slow_call_per_token: float = SLOW_CALL_SECONDS_PER_TOKEN,
+        open_seconds: float = OPEN_SECONDS,
+        probes: int = HALF_OPEN_PROBES,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.window = window
+        self.min_calls = min_calls
+        self.failure_rate = failure_rate
+        self.slow_call_rate = slow_call_rate
+        self.slow_call = slow_call
+        self.slow_call_per_token = slow_call_per_token
+        self.open_seconds = open_seconds
+        self.probes = probes
+        self._clock = clock
+        self.state = CLOSED
+        self._opened_at = 0.0
+        self._probes_in_flight = 0
+        self._probes_passed = 0
+        # (finished at, failed, slow) per counted call
+        self._calls: Deque[Tuple[float, bool, bool]] = deque(maxlen=MAX_WINDOW_CALLS)
+        self.counters = {"opened": 0, "half_opened": 0, "closed": 0, "rejected": 0}
+
+    def allows(self) -> bool:
+        """Whether a call started now would be let through."""
+        if self.state == OPEN and self._clock() - self._opened_at >= self.open_seconds:
+            self._transition(HALF_OPEN)
+        if self.state == OPEN:
+            return False
+        if self.state == HALF_OPEN:
+            return self._probes_in_flight + self._probes_passed < self.probes
+        return True
+
+    def reject(self) -> None:
+        """Count a call turned away because allows() was false."""
+        self.counters["rejected"] += 1
+
+    async def run(
+        self, call: Callable[[], Awaitable[T]], is_failure: Callable[[Exception], bool], tokens: int = 0
+    ) -> T:
+        """Await ``call()`` through the breaker; raises CircuitOpenError when it is open.
+
+        ``tokens`` is the most the call may return, which extends the time
+        it may take before it counts as slow.
+        """
+        if not self.allows():
+            self.reject()
+            raise CircuitOpenError(f"Upstream circuit is {self.state.replace('_', '-')}; not calling it")
+        probe = self.state == HALF_OPEN
+        if probe:
+            self._probes_in_flight += 1
+        started = self._clock()
+        failed: Optional[bool] = None
+        try:
+            result = await call()
+            failed = False
+            return result
+        except Exception as error:
+            if is_failure(error):
+                failed = True
+            raise
+        finally:
+            if probe:
+                self._probes_in_flight -= 1
+            if failed is not None:
+                slow_after = self.slow_call + self.slow_call_per_token * tokens
+                self._record(failed, self._clock() - started >= slow_after, probe)
+
+    def _record(self, failed: bool, slow: bool, probe: bool) -> None:
+        now = self._clock()
+        if probe and self.state == HALF_OPEN:
+            if failed or slow:
+                self._transition(OPEN)
+            else:
+                self._probes_passed += 1
+                if self._probes_passed >= self.probes:
+                    self._transition(CLOSED)
+            return
+        if self.state != CLOSED:
+            # A call that started before the circuit opened
+            return
+        self._calls.append((now, failed, slow))
+        calls, failures, slow_calls = self._window(now)
+        if calls >= self.min_calls and (
+            failures / calls >= self.failure_rate or slow_calls / calls >= self.slow_call_rate
+        ):
+            self._transition(OPEN)
+
+    def _window(self, now: float) -> Tuple[int, int, int]:
+        """(calls, failures, slow calls) in the rolling window."""
+        while self._calls and now - self._calls[0][0] > self.window:
+            self._calls.popleft()
+        return (
+            len(self._calls),
+            sum(1 for _, failed, _ in self._calls if failed),
+            sum(1 for _, _, slow in self._calls if slow),
+        )
+
+    def _transition(self, state: str) -> None:
+        self.state = state
+        self._probes_passed = 0
+        if state == OPEN:
+            self._opened_at = self._clock()
+            self.counters["opened"] += 1
+        elif state == HALF_OPEN:
+            self.counters["half_opened"] += 1
+        else:
+            self._calls.clear()
+            self.counters["closed"] += 1
+        print(f"Upstream circuit {state.replace('_', '-')}")
+
+    def stats(self) -> Dict[str, Any]:
+        """State, rolling-window rates and transition counters."""
+        self.allows()
+        calls, failures, slow_calls = self._window(self._clock())
+        return {
+            "state": self.state,
+            "window_calls": calls,
+            "failure_rate": failures / calls if calls else 0.0,
+            "slow_call_rate": slow_calls / calls if calls else 0.0,
+            "retry_in_s": (
+                round(max(0.0, self.open_seconds - (self._clock() - self._opened_at)), 1)
+                if self.state == OPEN else None
+            ),
+            **self.counters,
+        }
@@ -1,18 +1,132 @@
 from workers import WorkerEntrypoint, Response
 import json
 import asyncio
-from typing import Dict, Any
+import atexit
+from typing import Dict, Any, Optional, Set
 import os
 
 # Import our custom modules
-from marimo_service import MarimoService
-from ai_service import AIService
+from marimo_service import MarimoService, accepts_encoding, make_etag
+from viewer_assets import ASSET_ROUTE, get_asset
+from ai_service import ENGINE_AUTO, ENGINES, AIService
+from generation_cache import GenerationCache
+from hedging import Hedger
+from notebook_backends import create_backend
+from pyodide_bundle import PYODIDE_ROUTE, load_bundle
+
+
+def encoded_response(body: bytes, content_encoding, headers: Dict[str, str]):
+    """Build a response for a body that may already be content-encoded.
+    
+    Pre-compressed bodies are sent with ``encodeBody: "manual"`` so the
+    Workers runtime passes the bytes through instead of compressing again.
+    """
+    if not content_encoding:
+        return Response(body, headers=headers)
+    
+    from js import Object, Response as JsResponse
+    from pyodide.ffi import to_js
+    
+    init = to_js(
+        {
+            "headers": {**headers, "Content-Encoding": content_encoding},
+            "encodeBody": "manual",
+        },
+        dict_converter=Object.fromEntries,
+    )
+    return JsResponse.new(to_js(body), init)
+
+
+def sse_event(event: str, data: Any) -> str:
+    """Format one Server-Sent Event with a JSON payload."""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+def streaming_response(headers: Dict[str, str]):
+    """Create a streamed response; returns (response, writer for its body)."""
+    from js import Object, TransformStream, Response as JsResponse
+    from pyodide.ffi import to_js
+    
+    stream = TransformStream.new()
+    init = to_js({"headers": headers}, dict_converter=Object.fromEntries)
+    return JsResponse.new(stream.readable, init), stream.writable.getWriter()
+
+
+async def end_stream(writer, error: Optional[Exception] = None) -> None:
+    """Close a streamed body, or abort it when ``error`` kept it from being finished."""
+    try:
+        if error is None:
+            await writer.close()
+        else:
+            await writer.abort(str(error))
+    except Exception as e:
+        print(f"Could not end the response stream: {str(e)}")
+
+
+# Largest batch /api/marimo/generate-batch accepts
+MAX_BATCH_ITEMS = 100
+
+# Notebook URLs are content-derived, so their bodies never change
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+# Viewer pages change when the template is redeployed; revalidate with the ETag
+VIEWER_CACHE_CONTROL = "public, max-age=3600"
+
+
+def etag_matches(if_none_match, etags) -> bool:
+    """Check an If-None-Match header against candidate ETags (weak comparison)."""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    candidates = {etag.strip().removeprefix("W/") for etag in if_none_match.split(",")}
+    return any(etag in candidates for etag in etags)
+
+
+def not_modified_response(etag: str, cache_control: str):
+    """Build a 304 response for a matching conditional request."""
+    return Response(
+        "",
+        status=304,
+        headers={
+            "ETag": etag,
+            "Cache-Control": cache_control,
+            "Access-Control-Allow-Origin": "*"
+        }
+    )
 
 class Default(WorkerEntrypoint):
     def __init__(self):
         super().__init__()
-        self.marimo_service = MarimoService()
-        self.ai_service = AIService()
+        # MARIMO_NOTEBOOK_DB points at a shared SQLite file (unset keeps notebooks in memory)
+        # MARIMO_PYODIDE_BUNDLE points at a scripts/build_pyodide_bundle.py output (unset uses the CDN)
+        # MARIMO_LLM_HEDGING=1 races OpenAI calls slower than recent ones against a backup request
+        self.pyodide_bundle = load_bundle(os.environ.get("MARIMO_PYODIDE_BUNDLE"))
+        self.backend = create_backend(os.environ.get("MARIMO_NOTEBOOK_DB"))
+        self.marimo_service = MarimoService(backend=self.backend, pyodide_bundle=self.pyodide_bundle)
+        self.generation_cache = GenerationCache(backend=self.backend)
+        hedger = Hedger() if os.environ.get("MARIMO_LLM_HEDGING") == "1" else None
+        self.ai_service = AIService(cache=self.generation_cache, hedger=hedger)
+        self.not_modified_count = 0
+        # Streamed responses being written in the background; the event loop only holds weak references
+        self.background_tasks: Set[asyncio.Task] = set()
+        # Workers get no shutdown event, so resources are released when the interpreter exits
+        atexit.register(self._close_at_exit)
+    
+    async def close(self) -> None:
+        """Close the OpenAI connection pool, then commit and close the notebook store."""
+        await self.ai_service.clients.close()
+        if self.backend is not None:
+            self.backend.close()
+    
+    def _close_at_exit(self) -> None:
+        """atexit hook running close() on a fresh event loop."""
+        asyncio.run(self.close())
+    
+    def _run_in_background(self, coroutine) -> None:
+        """Run a coroutine that outlives the handler, keeping its task referenced until it finishes."""
+        task = asyncio.ensure_future(coroutine)
+        self.background_tasks.add(task)
+        task.add_done_callback(self.background_tasks.discard)
     
     async def fetch(self, request, env):
         """Main request handler for the Python Worker."""
@@ -29,10 +143,18 @@ class Default(WorkerEntrypoint):
             # Route the request
             if path == "/api/marimo/generate":
                 return await self._handle_marimo_generate(request, env)
+            elif path.startswith("/api/marimo/notebook/") and path.endswith("/cells"):
+                return await self._handle_marimo_cells(request, env)
             elif path.startswith("/api/marimo/notebook/"):
                 return await self._handle_marimo_notebook(request, env)
             elif path.startswith("/api/marimo/viewer/"):
                 return await self._handle_marimo_viewer(request, env)
+            elif path.startswith(ASSET_ROUTE):
+                return self._handle_viewer_asset(request)
+            elif path.startswith(PYODIDE_ROUTE):
+                return self._handle_pyodide_asset(request)
+            elif path == "/api/marimo/generate-batch":
+                return await self._handle_marimo_generate_batch(request, env)
             elif path == "/api/marimo/create-viewer":
                 return await self._handle_marimo_create_viewer(request, env)
             elif path == "/health":
@@ -67,6 +189,12 @@ class Default(WorkerEntrypoint):
             diagram = body.get("diagram")
             language = body.get("language", "python")
             prompt = body.get("prompt", "Generated from flowchart")
+            # "cache": false forces a fresh generation
+            use_cache = body.get("cache", True) is not False
+            # "engine": "llm" sends templated flowcharts to OpenAI too
+            engine = body.get("engine", ENGINE_AUTO)
+            # "previousId" names the notebook this diagram is an edit of
+            previous_id = body.get("previousId")
             
             if not diagram:
                 return Response(
@@ -74,6 +202,12 @@ class Default(WorkerEntrypoint):
                     status=400,
                     headers={"Content-Type": "application/json"}
                 )
+            if engine not in ENGINES:
+                return Response(
+                    json.dumps({"error": f"engine must be one of: {', '.join(ENGINES)}", "success": False}),
+                    status=400,
+                    headers={"Content-Type": "application/json"}
+                )
             
             # Get OpenAI API key from environment
             openai_api_key = env.get("OPENAI_API_KEY")
@@ -84,18 +218,33 @@ class Default(WorkerEntrypoint):
                     headers={"Content-Type": "application/json"}
                 )
             
-            # Generate Marimo notebook using AI
-            marimo_notebook = await self.ai_service.generate_marimo_notebook(
-                prompt, diagram, language, openai_api_key
-            )
+            regenerated_nodes = None
+            fallback_nodes = []
+            if previous_id:
+                # Only the cells of changed nodes are regenerated; the edit is a new notebook version
+                previous = self.marimo_service.get_notebook(previous_id)
+                if previous is None:
+                    return Response(
+                        json.dumps({"error": f"Notebook {previous_id} not found", "success": False}),
+                        status=404,
+                        headers={"Content-Type": "application/json"}
+                    )
+                marimo_notebook, regenerated_nodes, fallback_nodes = await self.ai_service.regenerate_marimo_notebook(
+                    prompt, previous, diagram, language, openai_api_key, engine=engine
+                )
+            elif "stream=1" in (request.url.query or "").split("&"):
+                # ?stream=1 sends tokens as Server-Sent Events while they arrive
+                return self._stream_marimo_generate(prompt, diagram, language, openai_api_key, use_cache, engine)
+            else:
+                # Generate Marimo notebook using AI
+                marimo_notebook = await self.ai_service.generate_marimo_notebook(
+                    prompt, diagram, language, openai_api_key, use_cache=use_cache, engine=engine
+                )
             
-            # Generate a unique ID for this notebook
-            server_id = f"marimo_{int(asyncio.get_event_loop().time() * 1000)}_{hash(diagram) % 10000}"
-            print('Generating notebook with ID:', server_id)
+            # Store the notebook under its content-derived ID
             print('Storing notebook in service...')
-            
-            # Store the notebook
-            self.marimo_service.store_notebook(server_id, marimo_notebook)
+            server_id = self.marimo_service.store_content(marimo_notebook, prefix="marimo")
+            print('Generated notebook with ID:', server_id)
             print(f'Notebook stored successfully. Active notebooks: {self.marimo_service.get_active_server_count()}')
             
             return Response(
@@ -106,7 +255,12 @@ class Default(WorkerEntrypoint):
                     "notebookContent": marimo_notebook,
                     "diagram": diagram,
                     "language": language,
-                    "prompt": prompt
+                    "prompt": prompt,
+                    "previousId": previous_id,
+                    # Node ids whose cells were regenerated; null after a full generation
+                    "regeneratedNodes": regenerated_nodes,
+                    # Node ids that got template cells because their generation failed
+                    "fallbackNodes": fallback_nodes
                 }),
                 headers={
                     "Content-Type": "application/json",
@@ -121,25 +275,226 @@ class Default(WorkerEntrypoint):
                 headers={"Content-Type": "application/json"}
             )
     
+    def _stream_marimo_generate(self, prompt, diagram, language, api_key, use_cache, engine):
+        """Stream a generation as SSE: token events, then the stored notebook."""
+        from js import TextEncoder
+        
+        response, writer = streaming_response({
+            "Content-Type": "text/event-stream",
+            "Cache-Control": "no-cache",
+            "Access-Control-Allow-Origin": "*"
+        })
+        encoder = TextEncoder.new()
+        
+        async def pump():
+            failed = None
+            try:
+                async for event, data in self.ai_service.stream_marimo_notebook(
+                    prompt, diagram, language, api_key, use_cache=use_cache, engine=engine
+                ):
+                    if event == "notebook":
+                        server_id = self.marimo_service.store_content(data, prefix="marimo")
+                        print('Generated notebook with ID:', server_id)
+                        data = {
+                            "success": True,
+                            "serverId": server_id,
+                            "notebookContent": data,
+                            "viewerUrl": f"/api/marimo/viewer/{server_id}"
+                        }
+                    await writer.write(encoder.encode(sse_event(event, data)))
+            except Exception as e:
+                print(f"Streaming generation error: {str(e)}")
+                try:
+                    await writer.write(encoder.encode(sse_event("error", str(e))))
+                except Exception as write_error:
+                    # The client has gone; nobody is left to tell
+                    failed = write_error
+            finally:
+                await end_stream(writer, failed)
+        
+        # The client reading the stream keeps the request alive until pump() closes it
+        self._run_in_background(pump())
+        return response
+    
+    async def _handle_marimo_generate_batch(self, request, env):
+        """Generate notebooks for many diagrams, streaming NDJSON results as they finish."""
+        try:
+            # Parse request body: {"items": [{prompt, diagram, language, engine}, ...]} or a bare array
+            body = await request.json()
+            items = body.get("items") if isinstance(body, dict) else body
+            use_cache = not isinstance(body, dict) or body.get("cache", True) is not False
+            engine = body.get("engine", ENGINE_AUTO) if isinstance(body, dict) else ENGINE_AUTO
+            
+            if not isinstance(items, list) or not items:
+                return Response(
+                    json.dumps({"error": "A non-empty items array is required", "success": False}),
+                    status=400,
+                    headers={"Content-Type": "application/json"}
+                )
+            if engine not in ENGINES:
+                return Response(
+                    json.dumps({"error": f"engine must be one of: {', '.join(ENGINES)}", "success": False}),
+                    status=400,
+                    headers={"Content-Type": "application/json"}
+                )
+            if len(items) > MAX_BATCH_ITEMS:
+                return Response(
+                    json.dumps({"error": f"At most {MAX_BATCH_ITEMS} items per batch", "success": False}),
+                    status=400,
+                    headers={"Content-Type": "application/json"}
+                )
+            
+            openai_api_key = env.get("OPENAI_API_KEY")
+            if not openai_api_key:
+                return Response(
+                    json.dumps({"error": "OpenAI API key not configured", "success": False}),
+                    status=500,
+                    headers={"Content-Type": "application/json"}
+                )
+            
+        except Exception as e:
+            return Response(
+                json.dumps({"error": str(e), "success": False}),
+                status=500,
+                headers={"Content-Type": "application/json"}
+            )
+        
+        from js import TextEncoder
+        
+        response, writer = streaming_response({
+            "Content-Type": "application/x-ndjson",
+            "Cache-Control": "no-cache",
+            "Access-Control-Allow-Origin": "*"
+        })
+        encoder = TextEncoder.new()
+        
+        async def pump():
+            succeeded = 0
+            degraded_count = 0
+            failed = None
+            try:
+                async for index, result, degraded in self.ai_service.generate_marimo_notebooks(
+                    items, openai_api_key, use_cache=use_cache, engine=engine
+                ):
+                    if isinstance(result, Exception):
+                        line = {"index": index, "success": False, "error": str(result)}
+                    else:
+                        server_id = self.marimo_service.store_content(result, prefix="marimo")
+                        line = {
+                            "index": index,
+                            "success": not degraded,
+                            "serverId": server_id,
+                            "viewerUrl": f"/api/marimo/viewer/{server_id}",
+                            "notebookContent": result
+                        }
+                        if degraded:
+                            # Generation failed; the item still gets the stored or fallback notebook
+                            degraded_count += 1
+                            line["fallback"] = True
+                            line["error"] = "OpenAI generation failed; serving a stored or fallback notebook"
+                        else:
+                            succeeded += 1
+                    await writer.write(encoder.encode(json.dumps(line) + "\n"))
+                summary = {
+                    "done": True,
+                    "succeeded": succeeded,
+                    # Includes the items served a fallback notebook
+                    "failed": len(items) - succeeded,
+                    "fallback": degraded_count
+                }
+                await writer.write(encoder.encode(json.dumps(summary) + "\n"))
+            except Exception as e:
+                print(f"Batch generation error: {str(e)}")
+                try:
+                    await writer.write(encoder.encode(json.dumps({"error": str(e), "success": False}) + "\n"))
+                except Exception as write_error:
+                    failed = write_error
+            finally:
+                await end_stream(writer, failed)
+        
+        self._run_in_background(pump())
+        return response
+    
     async def _handle_marimo_notebook(self, request, env):
         """Get a specific Marimo notebook by ID."""
         try:
             # Extract server ID from path
             url = request.url
             path_parts = url.path.split("/")
-            if len(path_parts) < 4:
+            if len(path_parts) < 5:
                 return Response("Invalid path", status=400)
             
-            server_id = path_parts[3]
-            notebook = self.marimo_service.get_notebook(server_id)
+            server_id = path_parts[4]
+            digest = self.marimo_service.resolve_digest(server_id)
+            if not digest:
+                return Response("Notebook not found", status=404)
+            
+            # Every representation of a digest has the same content
+            if etag_matches(
+                request.headers.get("If-None-Match"),
+                [make_etag(digest), make_etag(digest, "gzip"), make_etag(digest, "br")],
+            ):
+                self.not_modified_count += 1
+                return not_modified_response(make_etag(digest), IMMUTABLE_CACHE_CONTROL)
+            
+            encoded = self.marimo_service.get_notebook_encoded(
+                server_id, request.headers.get("Accept-Encoding")
+            )
             
-            if not notebook:
+            if not encoded:
                 return Response("Notebook not found", status=404)
             
+            body, content_encoding = encoded
+            return encoded_response(
+                body,
+                content_encoding,
+                {
+                    "Content-Type": "text/plain; charset=utf-8",
+                    "ETag": make_etag(digest, content_encoding),
+                    "Cache-Control": IMMUTABLE_CACHE_CONTROL,
+                    "Vary": "Accept-Encoding",
+                    "Access-Control-Allow-Origin": "*"
+                }
+            )
+            
+        except Exception as e:
             return Response(
-                notebook,
+                json.dumps({"error": str(e), "success": False}),
+                status=500,
+                headers={"Content-Type": "application/json"}
+            )
+    
+    async def _handle_marimo_cells(self, request, env):
+        """Get the parsed cell manifest for a specific notebook."""
+        try:
+            # Path: /api/marimo/notebook/{serverId}/cells
+            url = request.url
+            path_parts = url.path.split("/")
+            if len(path_parts) < 6:
+                return Response("Invalid path", status=400)
+            
+            server_id = path_parts[4]
+            digest = self.marimo_service.resolve_digest(server_id)
+            if not digest:
+                return Response("Notebook not found", status=404)
+            
+            etag = make_etag(digest, "cells")
+            if etag_matches(request.headers.get("If-None-Match"), [etag]):
+                self.not_modified_count += 1
+                return not_modified_response(etag, IMMUTABLE_CACHE_CONTROL)
+            
+            manifest = self.marimo_service.get_cell_manifest(server_id)
+            
+            if not manifest:
+                return Response("Notebook not found", status=404)
+            
+            body, digest = manifest
+            return Response(
+                body,
                 headers={
-                    "Content-Type": "text/plain",
+                    "Content-Type": "application/json",
+                    "ETag": etag,
+                    "Cache-Control": IMMUTABLE_CACHE_CONTROL,
                     "Access-Control-Allow-Origin": "*"
                 }
             )
@@ -162,24 +517,34 @@ class Default(WorkerEntrypoint):
             print(f"Viewer path: {url.path}")
             print(f"Path parts: {path_parts}")
             
-            if len(path_parts) < 4:
+            if len(path_parts) < 5:
                 return Response("Invalid path", status=400)
             
-            server_id = path_parts[3]
+            server_id = path_parts[4]
             print(f"Extracted server ID: {server_id}")
             
-            notebook = self.marimo_service.get_notebook(server_id)
-            
-            if not notebook:
+            digest = self.marimo_service.resolve_digest(server_id)
+            if not digest:
                 return Response("Notebook not found", status=404)
             
-            # Create the Marimo WASM viewer HTML
-            viewer_html = self.marimo_service.create_wasm_viewer_html(notebook, server_id)
+            etag = self.marimo_service.wasm_viewer_etag(digest)
+            if etag_matches(request.headers.get("If-None-Match"), [etag]):
+                self.not_modified_count += 1
+                return not_modified_response(etag, VIEWER_CACHE_CONTROL)
             
+            # Create (or reuse) the Marimo WASM viewer HTML
+            viewer = await self.marimo_service.get_wasm_viewer(server_id)
+            
+            if not viewer:
+                return Response("Notebook not found", status=404)
+            
+            viewer_html, etag = viewer
             return Response(
                 viewer_html,
                 headers={
-                    "Content-Type": "text/html",
+                    "Content-Type": "text/html; charset=utf-8",
+                    "ETag": etag,
+                    "Cache-Control": VIEWER_CACHE_CONTROL,
                     "Access-Control-Allow-Origin": "*"
                 }
             )
@@ -192,6 +557,50 @@ class Default(WorkerEntrypoint):
                 headers={"Content-Type": "application/json"}
             )
     
+    def _handle_viewer_asset(self, request):
+        """Serve a content-hashed viewer CSS/JS asset."""
+        asset = get_asset(request.url.path[len(ASSET_ROUTE):])
+        if not asset:
+            return Response("Asset not found", status=404)
+        
+        if etag_matches(request.headers.get("If-None-Match"), [asset["etag"]]):
+            self.not_modified_count += 1
+            return not_modified_response(asset["etag"], IMMUTABLE_CACHE_CONTROL)
+        
+        headers = {
+            "Content-Type": asset["content_type"],
+            "ETag": asset["etag"],
+            "Cache-Control": IMMUTABLE_CACHE_CONTROL,
+            "Vary": "Accept-Encoding",
+            "Access-Control-Allow-Origin": "*"
+        }
+        if accepts_encoding(request.headers.get("Accept-Encoding"), "gzip"):
+            return encoded_response(asset["gzip"], "gzip", headers)
+        return encoded_response(asset["body"], None, headers)
+    
+    def _handle_pyodide_asset(self, request):
+        """Serve a file from the locally hosted Pyodide bundle."""
+        path = request.url.path
+        if not self.pyodide_bundle or self.pyodide_bundle.resolve(path) is None:
+            return Response("Pyodide bundle file not found", status=404)
+        
+        # The ETag comes from the lockfile digest, so a revalidation never reads the file
+        etag = self.pyodide_bundle.etag(path)
+        if etag_matches(request.headers.get("If-None-Match"), [etag]):
+            self.not_modified_count += 1
+            return not_modified_response(etag, IMMUTABLE_CACHE_CONTROL)
+        
+        file = self.pyodide_bundle.read(path)
+        if not file:
+            return Response("Pyodide bundle file not found", status=404)
+        body, content_type = file
+        return encoded_response(body, None, {
+            "Content-Type": content_type,
+            "ETag": etag,
+            "Cache-Control": IMMUTABLE_CACHE_CONTROL,
+            "Access-Control-Allow-Origin": "*"
+        })
+    
     async def _handle_marimo_create_viewer(self, request, env):
         """Create a Marimo viewer for existing notebook content."""
         try:
@@ -206,12 +615,9 @@ class Default(WorkerEntrypoint):
                     headers={"Content-Type": "application/json"}
                 )
             
-            # Generate a unique ID for this notebook
-            server_id = f"viewer_{int(asyncio.get_event_loop().time() * 1000)}_{hash(notebook_content) % 10000}"
+            # Store the notebook under its content-derived ID
+            server_id = self.marimo_service.store_content(notebook_content, prefix="viewer")
             print('Creating viewer for notebook with ID:', server_id)
-            
-            # Store the notebook
-            self.marimo_service.store_notebook(server_id, notebook_content)
             print(f'Viewer notebook stored successfully. Active notebooks: {self.marimo_service.get_active_server_count()}')
             
             return Response(
@@ -242,11 +648,31 @@ class Default(WorkerEntrypoint):
                 "service": "Marimo Python Worker",
                 "endpoints": [
                     "/api/marimo/generate",
+                    "/api/marimo/generate?stream=1",
+                    "/api/marimo/generate-batch",
                     "/api/marimo/create-viewer",
                     "/api/marimo/notebook/{serverId}",
+                    "/api/marimo/notebook/{serverId}/cells",
                     "/api/marimo/viewer/{serverId}",
+                    "/api/marimo/assets/{asset}",
+                    "/api/marimo/pyodide/{version}-{build}/{file}",
                     "/health"
-                ]
+                ],
+                "notebookStore": self.marimo_service.get_store_stats(),
+                "viewerCache": self.marimo_service.get_viewer_cache_stats(),
+                "generationCache": self.generation_cache.stats(),
+                "generationsInFlight": self.ai_service.in_flight.stats(),
+                "localGenerations": self.ai_service.local_generations,
+                "incrementalGenerations": self.ai_service.incremental_generations,
+                "reusedCells": self.ai_service.reused_cells,
+                "openaiPool": self.ai_service.clients.stats(),
+                "llmScheduler": self.ai_service.scheduler.stats(),
+                "llmHedging": self.ai_service.hedger.stats() if self.ai_service.hedger else None,
+                "circuitBreaker": self.ai_service.breaker.stats(),
+                "notebookValidation": self.ai_service.validator.stats(),
+                "llmUsage": self.ai_service.usage.stats(),
+                "pyodideBundle": self.marimo_service.pyodide_runtime,
+                "notModifiedResponses": self.not_modified_count
             }),
             headers={
                 "Content-Type": "application/json",
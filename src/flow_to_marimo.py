@@ -0,0 +1,178 @@
+"""
+Flow to Marimo for Python Workers
+Builds Marimo notebooks from flowchart nodes and edges without an LLM
+"""
+
+import json
+import re
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from mermaid_parser import back_edges, cell_name, output_name, predecessors
+
+# Largest flowchart the local engine takes on; bigger ones go to the LLM
+LOCAL_MAX_NODES = 50
+# Longest label, in words, still read as a bare template step such as "Get user input"
+TEMPLATE_MAX_WORDS = 3
+
+# Node kinds by label keyword, checked in order (as in apps/backend/src/lib/flowToMarimo.ts)
+NODE_KINDS = [
+    ("input", ("input", "get", "enter")),
+    ("validate", ("validate", "check")),
+    ("add", ("add", "sum")),
+    ("multiply", ("multiply", "product")),
+    ("process", ("process", "calculate", "compute", "transform")),
+    ("display", ("display", "show", "output", "print")),
+    ("start", ("start", "begin")),
+    ("end", ("end", "finish", "stop", "done")),
+]
+# Modules the templates use, by the name they are imported as
+_IMPORTS = {"math": "import math", "mo": "import marimo as mo"}
+# Whole keywords, allowing the usual verb endings ("Calculates", "Checking"), but not "address" for "add"
+_KIND_PATTERNS = [
+    (kind, re.compile(r"\b(?:" + "|".join(keywords) + r")(?:s|es|ed|ing)?\b", re.IGNORECASE))
+    for kind, keywords in NODE_KINDS
+]
+
+
+def _leading_kind(label: str) -> Optional[str]:
+    """Kind of the keyword a label starts with."""
+    for kind, pattern in _KIND_PATTERNS:
+        if pattern.match(label.strip()):
+            return kind
+    return None
+
+
+def node_kind(label: str) -> Optional[str]:
+    """Template kind for a node label, or None when no keyword matches.
+
+    The keyword the label starts with wins; otherwise the first kind with
+    a keyword anywhere in the label.
+    """
+    kind = _leading_kind(label)
+    if kind is not None:
+        return kind
+    for kind, pattern in _KIND_PATTERNS:
+        if pattern.search(label):
+            return kind
+    return None
+
+
+def is_templated(graph: Dict) -> bool:
+    """Whether every node is a template step, so no LLM is needed.
+
+    A template step is a short label that starts with a keyword, such as
+    "Get input" or "Show result"; a longer label describes logic the
+    templates cannot express, even when a keyword appears in it. So does
+    a loop, such as asking for input again when a check fails.
+    """
+    nodes = graph["nodes"]
+    return 0 < len(nodes) <= LOCAL_MAX_NODES and all(
+        len(node["label"].split()) <= TEMPLATE_MAX_WORDS and _leading_kind(node["label"])
+        for node in nodes.values()
+    ) and not back_edges(graph)
+
+
+def _node_body(kind: Optional[str], label: str, output: str, inputs: List[str]) -> List[str]:
+    """Statements computing ``output`` for one node kind; imports are given as keys of _IMPORTS."""
+    text = json.dumps(label)
+    values = [f"_values = [getattr(_v, 'value', _v) for _v in ({', '.join(inputs)},)]"] if inputs else ["_values = []"]
+    if kind == "input":
+        if not inputs:
+            return ["mo", f"{output} = mo.ui.number(value=0, label={text})", output]
+        # Upstream values become the default
+        return ["mo"] + values + [
+            "_default = next((_v for _v in _values if isinstance(_v, (int, float))), 0)",
+            f"{output} = mo.ui.number(value=_default, label={text})",
+            output,
+        ]
+    if kind == "validate":
+        return values + [f"{output} = all(_v is not None for _v in _values)"]
+    if kind == "add":
+        return values + [f"{output} = sum(_v for _v in _values if isinstance(_v, (int, float)))"]
+    if kind == "multiply":
+        return ["math"] + values + [
+            f"{output} = math.prod(_v for _v in _values if isinstance(_v, (int, float)))"
+        ]
+    if kind == "process":
+        return values + [f"{output} = _values[0] if len(_values) == 1 else _values"]
+    if kind == "display":
+        return ["mo"] + values + [
+            f'{output} = mo.md({json.dumps("**" + label + ":** ")} + ", ".join(str(_v) for _v in _values))'
+            '.callout(kind="success")',
+            output,
+        ]
+    if kind == "start":
+        return [
+            "mo",
+            f'{output} = mo.md("# " + {text} + "\\n\\nThis notebook implements the flowchart logic.")',
+            output,
+        ]
+    if kind == "end":
+        return [
+            "mo",
+            f'{output} = mo.md("## Process Complete\\n\\nThe flowchart execution has finished.")',
+            output,
+        ]
+    # No template: pass the inputs through so downstream cells still run
+    return values + [
+        "# Add specific logic based on the node purpose",
+        f"{output} = _values[0] if len(_values) == 1 else (_values or None)",
+    ]
+
+
+def _render_cells(graph: Dict, node_ids: Iterable[str], inline_imports: bool) -> Tuple[List[str], Set[str]]:
+    """Render node cells; returns (cells, modules they use)."""
+    incoming = predecessors(graph)
+    cells = []
+    used: Set[str] = set()
+    for node_id in graph["nodes"] if node_ids is None else node_ids:
+        label = graph["nodes"][node_id]["label"]
+        inputs = [output_name(source) for source in incoming[node_id]]
+        body = _node_body(node_kind(label), label, output_name(node_id), inputs)
+        modules = [line for line in body if line in _IMPORTS]
+        used.update(modules)
+        body = [f"# {label}"] + [_IMPORTS[line] for line in modules if inline_imports] + [
+            line for line in body if line not in _IMPORTS
+        ]
+        parameters = inputs if inline_imports else sorted(modules + inputs)
+        cells.append(
+            f"@app.cell\ndef {cell_name(node_id)}({', '.join(parameters)}):\n"
+            + "".join(f"    {line}\n" for line in body)
+            + f"    return ({output_name(node_id)},)\n"
+        )
+    return cells, used
+
+
+def flow_cells(graph: Dict, node_ids: Optional[Iterable[str]] = None) -> str:
+    """One ``node_<id>`` cell per node defining ``value_<id>`` from its predecessors' values.
+
+    Each cell imports what it uses, so the result can be merged with
+    other fragments by assemble_cells.
+    """
+    cells, _ = _render_cells(graph, graph["nodes"] if node_ids is None else node_ids, inline_imports=True)
+    return "\n\n".join(cells)
+
+
+def flow_to_marimo(graph: Dict) -> str:
+    """Build a complete Marimo notebook from a parsed flowchart.
+
+    Modules are imported once in an ``imports`` cell and passed to the
+    node cells as parameters.
+    """
+    cells, used = _render_cells(graph, graph["nodes"], inline_imports=False)
+    modules = sorted(used)
+    if modules:
+        imports = "".join(f"    {_IMPORTS[module]}\n" for module in modules)
+        cells.insert(0, f"@app.cell\ndef imports():\n{imports}    return ({', '.join(modules)},)\n")
+    cells = "\n\n".join(cells)
+    return f"""import marimo
+
+app = marimo.App()
+
+
+{cells}
+
+
+if __name__ == "__main__":
+    app.run()
+"""
@@ -0,0 +1,78 @@
+"""
+Flowchart Diff for Python Workers
+Compares flowchart versions and records the diagram a notebook was built from
+"""
+
+import re
+from typing import Dict, List, Optional, Tuple
+
+# Comment lines carrying the source diagram in a notebook header
+_DIAGRAM_TITLE = "# Source flowchart:"
+_DIAGRAM_PREFIX = "#| "
+_CELL_START = re.compile(r"^@app\.cell\b", re.MULTILINE)
+
+
+def _incoming(graph: Dict) -> Dict[str, List[Tuple[str, str]]]:
+    """Map each node to its sorted incoming (source, edge label) pairs."""
+    incoming: Dict[str, List[Tuple[str, str]]] = {node_id: [] for node_id in graph["nodes"]}
+    for edge in graph["edges"]:
+        incoming[edge["to"]].append((edge["from"], edge["label"]))
+    return {node_id: sorted(edges) for node_id, edges in incoming.items()}
+
+
+def diff_flowcharts(old: Dict, new: Dict) -> Dict[str, List[str]]:
+    """Classify the nodes of ``new`` against ``old`` (both from parse_flowchart).
+
+    Returns node id lists: ``added``, ``changed`` (label or shape
+    differs), ``rewired`` (the edges into the node differ), ``unchanged``
+    and ``removed``. Lists follow declaration order, ``removed`` that of
+    ``old``. A node whose successors change is not itself affected: its
+    cell only defines ``value_<id>``, whoever reads it.
+    """
+    old_incoming = _incoming(old)
+    new_incoming = _incoming(new)
+    diff: Dict[str, List[str]] = {"added": [], "changed": [], "rewired": [], "unchanged": []}
+    for node_id, node in new["nodes"].items():
+        previous = old["nodes"].get(node_id)
+        if previous is None:
+            diff["added"].append(node_id)
+        elif (previous["label"], previous["shape"]) != (node["label"], node["shape"]):
+            diff["changed"].append(node_id)
+        elif old_incoming[node_id] != new_incoming[node_id]:
+            diff["rewired"].append(node_id)
+        else:
+            diff["unchanged"].append(node_id)
+    diff["removed"] = [node_id for node_id in old["nodes"] if node_id not in new["nodes"]]
+    return diff
+
+
+def _header_end(notebook: str) -> int:
+    """Offset of the first cell, or the end of the notebook."""
+    cell = _CELL_START.search(notebook)
+    return cell.start() if cell else len(notebook)
+
+
+def embedded_diagram(notebook: str) -> Optional[str]:
+    """The diagram recorded in a notebook's header by embed_diagram, if any."""
+    lines = [
+        line[len(_DIAGRAM_PREFIX):]
+        for line in notebook[:_header_end(notebook)].splitlines()
+        if line.startswith(_DIAGRAM_PREFIX)
+    ]
+    return "\n".join(lines) if lines else None
+
+
+def embed_diagram(notebook: str, diagram: str) -> str:
+    """Record ``diagram`` as comments ahead of the first cell, replacing any earlier record.
+
+    A notebook without cells is returned unchanged.
+    """
+    end = _header_end(notebook)
+    if end == len(notebook):
+        return notebook
+    header = "\n".join(
+        line for line in notebook[:end].splitlines() if line != _DIAGRAM_TITLE and not line.startswith(_DIAGRAM_PREFIX)
+    ).rstrip()
+    header = header + "\n\n" if header else ""
+    record = _DIAGRAM_TITLE + "\n" + "".join(f"{_DIAGRAM_PREFIX}{line}\n" for line in diagram.strip().splitlines())
+    return header + record + "\n" + notebook[end:]
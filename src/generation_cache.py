@@ -0,0 +1,147 @@
+"""
+Generation Cache for Python Workers
+Reuses AI-generated notebooks for repeated (prompt, diagram, settings) requests
+"""
+
+import hashlib
+import json
+import re
+import time
+from typing import Dict, Optional
+
+from bounded_cache import BoundedCache
+from notebook_backends import NotebookBackend
+from notebook_codec import compress_notebook, content_digest, decompress_notebook
+
+# Generation cache budgets
+MAX_GENERATIONS = 1000
+MAX_GENERATION_BYTES = 16 * 1024 * 1024  # 16 MB of compressed notebooks
+GENERATION_TTL = 24 * 3600  # 24 hours, grows for frequently repeated requests
+MAX_GENERATION_TTL = 7 * 24 * 3600  # 7 days
+
+# Lines that open or close a block; statements are only reordered between them
+_DIAGRAM_STRUCTURE = re.compile(r"^(graph|flowchart|subgraph|end|direction)\b", re.IGNORECASE)
+# Mermaid link operators such as -->, ---, -.->, ==>
+_DIAGRAM_LINK = re.compile(r"\s*([-.=]{2,}[>ox]?)\s*")
+
+
+def canonicalize_text(text: str) -> str:
+    """Collapse all whitespace runs to single spaces."""
+    return " ".join(text.split())
+
+
+def canonicalize_diagram(diagram: str) -> str:
+    """Normalize a Mermaid diagram so equivalent spellings share a cache key.
+
+    Whitespace and trailing semicolons are dropped, ``%%`` comments removed
+    and the statements within each block sorted, so reordering node or edge
+    declarations does not change the key.
+    """
+    statements = []
+    for line in diagram.splitlines():
+        statement = _DIAGRAM_LINK.sub(r"\1", canonicalize_text(line)).rstrip(";").strip()
+        if statement and not statement.startswith("%%"):
+            statements.append(statement)
+
+    canonical = []
+    block = []
+    for statement in statements:
+        if _DIAGRAM_STRUCTURE.match(statement):
+            canonical.extend(sorted(block))
+            block = []
+            canonical.append(statement)
+        else:
+            block.append(statement)
+    canonical.extend(sorted(block))
+    return "\n".join(canonical)
+
+
+def generation_key(
+    prompt: str, diagram: str, language: str, model: str, temperature: float, prompt_version: str = ""
+) -> str:
+    """Cache key for a generation request; ``prompt_version`` identifies the prompt wording."""
+    canonical = json.dumps(
+        [
+            canonicalize_text(prompt),
+            canonicalize_diagram(diagram),
+            language.strip().lower(),
+            model,
+            round(temperature, 3),
+            prompt_version,
+        ],
+        ensure_ascii=False,
+    )
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class GenerationCache:
+    """Two-tier cache of generated notebooks keyed by generation_key.
+
+    The in-memory tier is a BoundedCache (LRU with adaptive TTL) of
+    compressed notebooks. When a ``backend`` is given it acts as the
+    persistent tier: notebooks are written as content-addressed blobs and
+    generation records point keys at them, so repeats are served across
+    restarts and instances. Records older than ``max_ttl`` are ignored.
+    """
+
+    def __init__(
+        self,
+        backend: Optional[NotebookBackend] = None,
+        max_entries: int = MAX_GENERATIONS,
+        max_bytes: int = MAX_GENERATION_BYTES,
+        ttl: float = GENERATION_TTL,
+        max_ttl: float = MAX_GENERATION_TTL,
+    ):
+        """Initialize the cache tiers."""
+        self.backend = backend
+        self.max_ttl = max_ttl
+        self.entries = BoundedCache(max_entries=max_entries, max_bytes=max_bytes, ttl=ttl, max_ttl=max_ttl)
+        self.backend_hits = 0
+        self.bypassed = 0
+        self.saved_tokens = 0
+
+    def get(self, key: str) -> Optional[str]:
+        """Get a cached notebook, counting the tokens its reuse saved."""
+        entry = self.entries.get(key)
+        if entry is None and self.backend is not None:
+            entry = self._promote(key)
+        if entry is None:
+            return None
+        self.saved_tokens += entry["tokens"]
+        return decompress_notebook(entry["value"], entry["encoding"])
+
+    def put(self, key: str, notebook_content: str, tokens: int) -> None:
+        """Cache a generated notebook and the tokens it cost."""
+        body, encoding = compress_notebook(notebook_content)
+        self.entries.put(key, body, len(body), encoding=encoding, tokens=tokens)
+        if self.backend is not None:
+            digest = content_digest(notebook_content)
+            self.backend.put_blob(digest, body, encoding, len(notebook_content.encode("utf-8")))
+            self.backend.put_generation(key, digest, tokens)
+
+    def _promote(self, key: str) -> Optional[Dict]:
+        """Load a generation from the persistent tier into memory."""
+        record = self.backend.get_generation(key)
+        if record is None:
+            return None
+        digest, tokens, created_at = record
+        if time.time() - created_at > self.max_ttl:
+            return None
+        blob = self.backend.get_blob(digest)
+        if blob is None:
+            return None
+        self.backend_hits += 1
+        body, encoding, _ = blob
+        return self.entries.put(key, body, len(body), encoding=encoding, tokens=tokens)
+
+    def stats(self) -> Dict:
+        """Hit ratio (across both tiers) and token savings."""
+        stats = self.entries.stats()
+        lookups = stats["hits"] + stats["misses"]
+        return {
+            **stats,
+            "hit_ratio": (stats["hits"] + self.backend_hits) / lookups if lookups else 0.0,
+            "backend_hits": self.backend_hits,
+            "bypassed": self.bypassed,
+            "saved_tokens": self.saved_tokens,
+        }
@@ -0,0 +1,149 @@
+"""
+Request Hedging for Python Workers
+Issues a backup LLM request when the first one is slower than recent ones
+"""
+
+import asyncio
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, Optional, TypeVar
+
+T = TypeVar("T")
+
+# Hedge once a request outlasts this percentile of recent latencies
+HEDGE_PERCENTILE = 0.95
+# Latencies kept per request kind, and how many are needed before hedging starts
+LATENCY_WINDOW = 200
+MIN_SAMPLES = 20
+# Never hedge sooner than this, in seconds
+MIN_HEDGE_DELAY = 0.05
+
+# Hedges allowed per request (10% extra requests at most), and the burst the budget can save up
+HEDGE_BUDGET = 0.1
+MAX_HEDGE_CREDIT = 5.0
+
+
+class LatencyWindow:
+    """The most recent latencies of one kind of request."""
+
+    def __init__(self, size: int = LATENCY_WINDOW):
+        self.samples: Deque[float] = deque(maxlen=size)
+
+    def add(self, latency: float) -> None:
+        self.samples.append(latency)
+
+    def percentile(self, fraction: float) -> Optional[float]:
+        """Nearest-rank percentile, or None while the window is empty."""
+        if not self.samples:
+            return None
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+class Hedger:
+    """Run a call, and race an identical backup call if the first is slow.
+
+    The delay before the backup is the ``percentile`` of the last
+    ``window`` latencies of the same ``kind`` of call, so it adapts as the
+    provider speeds up or slows down; no call is hedged until
+    ``min_samples`` latencies are known. The first call to succeed wins
+    and the other is cancelled (a result that lost the race is passed to
+    ``discard`` so it can be closed). Each call earns ``budget`` hedge
+    credits, up to ``max_credit``, and a hedge spends one, so at most that
+    fraction of calls is ever sent twice.
+    """
+
+    def __init__(
+        self,
+        percentile: float = HEDGE_PERCENTILE,
+        window: int = LATENCY_WINDOW,
+        min_samples: int = MIN_SAMPLES,
+        min_delay: float = MIN_HEDGE_DELAY,
+        budget: float = HEDGE_BUDGET,
+        max_credit: float = MAX_HEDGE_CREDIT,
+    ):
+        self.percentile = percentile
+        self.window = window
+        self.min_samples = min_samples
+        self.min_delay = min_delay
+        self.budget = budget
+        self.max_credit = max_credit
+        self.credit = 0.0
+        self.latencies: Dict[str, LatencyWindow] = {}
+        self.counters = {"calls": 0, "hedged": 0, "hedge_wins": 0, "over_budget": 0}
+
+    def threshold(self, kind: str) -> Optional[float]:
+        """Seconds to wait before hedging a call of ``kind``; None while too few latencies are known."""
+        latencies = self.latencies.get(kind)
+        if latencies is None or len(latencies.samples) < self.min_samples:
+            return None
+        return max(self.min_delay, latencies.percentile(self.percentile))
+
+    async def run(
+        self,
+        kind: str,
+        call: Callable[[], Awaitable[T]],
+        discard: Optional[Callable[[T], Awaitable[Any]]] = None,
+    ) -> T:
+        """Await ``call()``, hedging it with a second ``call()`` when it is slow."""
+        self.counters["calls"] += 1
+        self.credit = min(self.max_credit, self.credit + self.budget)
+        threshold = self.threshold(kind)
+        started = time.perf_counter()
+        primary = asyncio.ensure_future(call())
+        tasks = {primary: started}
+        try:
+            if threshold is not None:
+                await asyncio.wait([primary], timeout=threshold)
+                if not primary.done():
+                    if self.credit >= 1.0:
+                        self.credit -= 1.0
+                        self.counters["hedged"] += 1
+                        tasks[asyncio.ensure_future(call())] = time.perf_counter()
+                    else:
+                        self.counters["over_budget"] += 1
+
+            pending = set(tasks)
+            while True:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                # Prefer a success; an error only counts once every call has failed
+                winner = next((task for task in done if task.exception() is None), None)
+                if winner is not None or not pending:
+                    break
+            if winner is None:
+                raise next(iter(done)).exception()
+
+            finished = time.perf_counter()
+            self._record(kind, finished - tasks[winner])
+            if winner is not primary:
+                self.counters["hedge_wins"] += 1
+                # The primary's time so far is a lower bound on its latency; leaving it
+                # out would keep only the fast samples and pull the threshold down
+                self._record(kind, finished - started)
+            for task in done:
+                if task is not winner and task.exception() is None and discard is not None:
+                    await discard(task.result())
+            return winner.result()
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+
+    def _record(self, kind: str, latency: float) -> None:
+        window = self.latencies.get(kind)
+        if window is None:
+            window = self.latencies[kind] = LatencyWindow(self.window)
+        window.add(latency)
+
+    def stats(self) -> Dict:
+        """Hedge counts, budget and the current threshold per kind of call."""
+        counters = self.counters
+        return {
+            **counters,
+            "hedge_rate": counters["hedged"] / counters["calls"] if counters["calls"] else 0.0,
+            "credit": round(self.credit, 2),
+            "threshold_ms": {
+                kind: round(threshold * 1000) if threshold is not None else None
+                for kind, threshold in ((kind, self.threshold(kind)) for kind in self.latencies)
+            },
+        }
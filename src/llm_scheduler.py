@@ -0,0 +1,288 @@
+"""
+LLM Scheduler for Python Workers
+Admission control, rate limiting and retries for OpenAI calls
+"""
+
+import asyncio
+import bisect
+import email.utils
+import random
+import time
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional
+
+import openai
+
+# Priority classes; lower values are dispatched first
+INTERACTIVE = 0
+BATCH = 1
+PRIORITY_NAMES = {INTERACTIVE: "interactive", BATCH: "batch"}
+
+# Concurrency caps
+MAX_CONCURRENCY = 16
+MAX_CONCURRENCY_PER_KEY = 4
+
+# Rate limits (OpenAI tier defaults for gpt-4.1 are far higher; these are a safe floor)
+REQUESTS_PER_MINUTE = 500
+TOKENS_PER_MINUTE = 200000
+
+# Retry policy
+MAX_RETRIES = 4
+BASE_RETRY_DELAY = 0.5  # seconds, doubled per attempt
+MAX_RETRY_DELAY = 20.0
+RETRYABLE_STATUS = frozenset({408, 409, 429, 500, 502, 503, 504})
+
+
+class TokenBucket:
+    """Token bucket refilled continuously at ``per_minute`` tokens per minute.
+
+    The level may go negative when a reservation is reconciled against a
+    larger actual cost; later takers then wait for the debt to refill.
+    """
+
+    def __init__(
+        self,
+        per_minute: float,
+        capacity: Optional[float] = None,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        """Start with a full bucket."""
+        self.rate = per_minute / 60.0
+        self.capacity = capacity if capacity is not None else per_minute
+        self.level = self.capacity
+        self._clock = clock
+        self._updated = clock()
+
+    def _refill(self) -> None:
+        now = self._clock()
+        self.level = min(self.capacity, self.level + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def wait_time(self, amount: float) -> float:
+        """Seconds until ``amount`` tokens are available (0 if they are now)."""
+        self._refill()
+        amount = min(amount, self.capacity)
+        if self.level >= amount:
+            return 0.0
+        return (amount - self.level) / self.rate
+
+    def take(self, amount: float) -> None:
+        """Remove tokens; a negative ``amount`` returns them."""
+        self._refill()
+        self.level = min(self.capacity, self.level - amount)
+
+
+class _Slot:
+    """One admitted call; ``used_tokens`` reconciles the token reservation."""
+
+    def __init__(self, key: str, priority: int, tokens: int):
+        self.key = key
+        self.priority = priority
+        self.tokens = tokens
+        self.used_tokens: Optional[int] = None
+        self.enqueued = time.monotonic()
+        self.granted = asyncio.get_running_loop().create_future()
+
+
+def retry_after(error: BaseException) -> Optional[float]:
+    """Seconds the server asked us to wait, from Retry-After(-Ms) headers."""
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None)
+    if not headers:
+        return None
+    value = headers.get("retry-after-ms")
+    if value:
+        try:
+            return float(value) / 1000
+        except ValueError:
+            pass
+    value = headers.get("retry-after")
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        parsed = email.utils.parsedate_to_datetime(value)
+        return max(0.0, parsed.timestamp() - time.time()) if parsed else None
+
+
+def is_retryable(error: BaseException) -> bool:
+    """Rate limits, server errors, timeouts and dropped connections are retried."""
+    if isinstance(error, (openai.APIConnectionError, asyncio.TimeoutError, ConnectionError)):
+        return True
+    return getattr(error, "status_code", None) in RETRYABLE_STATUS
+
+
+class LLMScheduler:
+    """Priority queue in front of LLM calls.
+
+    A call is admitted when a global slot and a slot for its key are free
+    and the request and token buckets can cover it; waiting calls are
+    admitted highest priority first, then first come first served. Token
+    costs are reserved up front from an estimate and reconciled with the
+    reported usage afterwards. ``run`` retries retryable failures with
+    exponential backoff and full jitter, never waiting less than a
+    Retry-After header asks for.
+    """
+
+    def __init__(
+        self,
+        max_concurrency: int = MAX_CONCURRENCY,
+        max_per_key: int = MAX_CONCURRENCY_PER_KEY,
+        requests_per_minute: float = REQUESTS_PER_MINUTE,
+        tokens_per_minute: float = TOKENS_PER_MINUTE,
+        max_retries: int = MAX_RETRIES,
+        base_delay: float = BASE_RETRY_DELAY,
+        max_delay: float = MAX_RETRY_DELAY,
+    ):
+        """Initialize an idle scheduler."""
+        self.max_concurrency = max_concurrency
+        self.max_per_key = max_per_key
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute)
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self._queue: List[Any] = []
+        self._sequence = 0
+        self._active = 0
+        self._active_per_key: Dict[str, int] = {}
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self.counters = {
+            "admitted": 0,
+            "retries": 0,
+            "gave_up": 0,
+            "rate_limited_waits": 0,
+            "wait_total": 0.0,
+            "wait_max": 0.0,
+        }
+        self.wait_by_priority: Dict[int, float] = {}
+        self.admitted_by_priority: Dict[int, int] = {}
+
+    @asynccontextmanager
+    async def slot(self, key: str, priority: int = INTERACTIVE, tokens: int = 0) -> AsyncIterator[_Slot]:
+        """Hold an admitted slot for the duration of the block (no retries)."""
+        slot = _Slot(key, priority, tokens)
+        self._sequence += 1
+        bisect.insort(self._queue, (priority, self._sequence, slot))
+        self._dispatch()
+        try:
+            await slot.granted
+        except asyncio.CancelledError:
+            if slot.granted.done() and not slot.granted.cancelled():
+                self._release(slot)
+            else:
+                self._queue = [item for item in self._queue if item[2] is not slot]
+            raise
+        try:
+            yield slot
+        finally:
+            self._release(slot)
+
+    async def run(
+        self,
+        call: Callable[[], Awaitable[Any]],
+        key: str,
+        priority: int = INTERACTIVE,
+        tokens: int = 0,
+    ) -> Any:
+        """Run ``call`` when admitted, retrying retryable failures."""
+        for attempt in range(self.max_retries + 1):
+            async with self.slot(key, priority, tokens) as slot:
+                try:
+                    result = await call()
+                    usage = getattr(result, "usage", None)
+                    slot.used_tokens = getattr(usage, "total_tokens", None)
+                    return result
+                except Exception as error:
+                    if not is_retryable(error):
+                        raise
+                    if attempt == self.max_retries:
+                        self.counters["gave_up"] += 1
+                        raise
+                    delay = self.retry_delay(attempt, retry_after(error))
+            self.counters["retries"] += 1
+            await asyncio.sleep(delay)
+
+    def retry_delay(self, attempt: int, server_delay: Optional[float] = None) -> float:
+        """Full-jitter exponential backoff, floored at the server's Retry-After."""
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+        if server_delay is not None:
+            delay = max(delay, min(server_delay, self.max_delay))
+        return delay
+
+    def _dispatch(self) -> None:
+        """Admit every waiting call that fits, highest priority first."""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        remaining = []
+        for index, item in enumerate(self._queue):
+            priority, _, slot = item
+            if slot.granted.done():
+                # Cancelled while queued
+                continue
+            if self._active >= self.max_concurrency:
+                remaining.extend(self._queue[index:])
+                break
+            if self._active_per_key.get(slot.key, 0) >= self.max_per_key:
+                remaining.append(item)
+                continue
+            wait = max(self.requests.wait_time(1), self.tokens.wait_time(slot.tokens))
+            if wait > 0:
+                # Rate limits are head-of-line so lower priorities cannot starve this call
+                self.counters["rate_limited_waits"] += 1
+                self._timer = asyncio.get_running_loop().call_later(wait, self._dispatch)
+                remaining.extend(self._queue[index:])
+                break
+            self._admit(slot)
+        self._queue = remaining
+
+    def _admit(self, slot: _Slot) -> None:
+        self.requests.take(1)
+        self.tokens.take(slot.tokens)
+        self._active += 1
+        self._active_per_key[slot.key] = self._active_per_key.get(slot.key, 0) + 1
+        waited = time.monotonic() - slot.enqueued
+        counters = self.counters
+        counters["admitted"] += 1
+        counters["wait_total"] += waited
+        counters["wait_max"] = max(counters["wait_max"], waited)
+        self.wait_by_priority[slot.priority] = self.wait_by_priority.get(slot.priority, 0.0) + waited
+        self.admitted_by_priority[slot.priority] = self.admitted_by_priority.get(slot.priority, 0) + 1
+        slot.granted.set_result(None)
+
+    def _release(self, slot: _Slot) -> None:
+        if slot.used_tokens is not None:
+            self.tokens.take(slot.used_tokens - slot.tokens)
+        self._active -= 1
+        remaining = self._active_per_key[slot.key] - 1
+        if remaining:
+            self._active_per_key[slot.key] = remaining
+        else:
+            del self._active_per_key[slot.key]
+        self._dispatch()
+
+    def stats(self) -> Dict:
+        """Queue depth, concurrency, retries and wait times."""
+        counters = self.counters
+        queued: Dict[str, int] = {}
+        for priority, _, _ in self._queue:
+            name = PRIORITY_NAMES.get(priority, str(priority))
+            queued[name] = queued.get(name, 0) + 1
+        return {
+            "queued": queued,
+            "active": self._active,
+            "admitted": counters["admitted"],
+            "retries": counters["retries"],
+            "gave_up": counters["gave_up"],
+            "rate_limited_waits": counters["rate_limited_waits"],
+            "wait_avg_ms": counters["wait_total"] / counters["admitted"] * 1000 if counters["admitted"] else 0.0,
+            "wait_max_ms": counters["wait_max"] * 1000,
+            "wait_avg_ms_by_priority": {
+                PRIORITY_NAMES.get(priority, str(priority)): total / self.admitted_by_priority[priority] * 1000
+                for priority, total in self.wait_by_priority.items()
+            },
+            "request_tokens_available": round(self.requests.level, 1),
+            "llm_tokens_available": round(self.tokens.level),
+        }
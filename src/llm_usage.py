@@ -0,0 +1,107 @@
+"""
+LLM Usage for Python Workers
+Per-request token usage, prompt-cache hits, latency and cost
+"""
+
+from collections import deque
+from typing import Any, Deque, Dict, Optional, Tuple
+
+# gpt-4.1 list prices, USD per million tokens
+INPUT_PRICE = 2.00
+CACHED_INPUT_PRICE = 0.50
+OUTPUT_PRICE = 8.00
+
+# Requests kept for the per-request view
+RECENT_REQUESTS = 20
+
+
+def usage_counts(usage: Any) -> Tuple[int, int, int]:
+    """(prompt, cached prompt, completion) tokens from an OpenAI ``usage`` object."""
+    if usage is None:
+        return 0, 0, 0
+    details = getattr(usage, "prompt_tokens_details", None)
+    cached = getattr(details, "cached_tokens", None) or 0
+    return getattr(usage, "prompt_tokens", 0) or 0, cached, getattr(usage, "completion_tokens", 0) or 0
+
+
+class UsageLedger:
+    """Token usage per prompt version, split by prompt-cache hits and misses.
+
+    A request is a prefix-cache hit when the provider reports any cached
+    prompt tokens. Latency saved is estimated per hit as the difference
+    between the average miss and hit latencies; cost saved is the cached
+    tokens billed at the cached rather than the full input price.
+    """
+
+    def __init__(self, recent: int = RECENT_REQUESTS):
+        """Initialize an empty ledger."""
+        self.prompts: Dict[str, Dict[str, float]] = {}
+        self.recent: Deque[Dict] = deque(maxlen=recent)
+        # Replies that hit max_tokens and were continued, and those still cut off after the last continuation
+        self.continuations = 0
+        self.truncated = 0
+
+    def record(self, prompt_id: str, usage: Any, latency: float) -> None:
+        """Record one completed request."""
+        prompt_tokens, cached_tokens, completion_tokens = usage_counts(usage)
+        totals = self.prompts.setdefault(prompt_id, {
+            "requests": 0,
+            "prefix_hits": 0,
+            "prompt_tokens": 0,
+            "cached_tokens": 0,
+            "completion_tokens": 0,
+            "hit_latency": 0.0,
+            "miss_latency": 0.0,
+        })
+        totals["requests"] += 1
+        totals["prompt_tokens"] += prompt_tokens
+        totals["cached_tokens"] += cached_tokens
+        totals["completion_tokens"] += completion_tokens
+        if cached_tokens:
+            totals["prefix_hits"] += 1
+            totals["hit_latency"] += latency
+        else:
+            totals["miss_latency"] += latency
+        self.recent.append({
+            "prompt": prompt_id,
+            "prompt_tokens": prompt_tokens,
+            "cached_tokens": cached_tokens,
+            "completion_tokens": completion_tokens,
+            "latency_ms": round(latency * 1000),
+        })
+
+    def stats(self) -> Dict:
+        """Prefix-cache hit rates, latency and cost (spent and saved) per prompt."""
+        prompts = {}
+        for prompt_id, totals in self.prompts.items():
+            hits = totals["prefix_hits"]
+            misses = totals["requests"] - hits
+            hit_latency = totals["hit_latency"] / hits if hits else None
+            miss_latency = totals["miss_latency"] / misses if misses else None
+            latency_saved: Optional[float] = None
+            if hit_latency is not None and miss_latency is not None:
+                latency_saved = (miss_latency - hit_latency) * hits
+            uncached = totals["prompt_tokens"] - totals["cached_tokens"]
+            prompts[prompt_id] = {
+                "requests": totals["requests"],
+                "prefix_hit_rate": hits / totals["requests"],
+                "cached_token_ratio": totals["cached_tokens"] / totals["prompt_tokens"] if totals["prompt_tokens"] else 0.0,
+                "prompt_tokens": totals["prompt_tokens"],
+                "cached_tokens": totals["cached_tokens"],
+                "completion_tokens": totals["completion_tokens"],
+                "hit_latency_ms": hit_latency * 1000 if hit_latency is not None else None,
+                "miss_latency_ms": miss_latency * 1000 if miss_latency is not None else None,
+                "latency_saved_ms": latency_saved * 1000 if latency_saved is not None else None,
+                "cost_usd": (
+                    uncached * INPUT_PRICE
+                    + totals["cached_tokens"] * CACHED_INPUT_PRICE
+                    + totals["completion_tokens"] * OUTPUT_PRICE
+                ) / 1e6,
+                "saved_usd": totals["cached_tokens"] * (INPUT_PRICE - CACHED_INPUT_PRICE) / 1e6,
+            }
+        return {
+            "prompts": prompts,
+            "continuations": self.continuations,
+            "truncated": self.truncated,
+            "recent": list(self.recent),
+        }
@@ -4,787 +4,319 @@ Handles real Marimo notebook operations
 """
 
 import marimo
-from typing import Dict, Optional
+from typing import Dict, Optional, Tuple
+import hashlib
 import json
-import time
+
+import viewer_templates
+from bounded_cache import BoundedCache
+from cell_parser import build_cell_manifest, extract_imports
+from notebook_backends import NotebookBackend
+from notebook_codec import compress_notebook, content_digest, decompress_notebook
+from pyodide_bundle import PyodideBundle, viewer_runtime
+
+# Notebook store budgets
+MAX_NOTEBOOKS = 500
+MAX_NOTEBOOK_BYTES = 64 * 1024 * 1024  # 64 MB
+MAX_ALIASES = 10000
+NOTEBOOK_TTL = 24 * 3600  # 24 hours, grows for frequently viewed notebooks
+MAX_NOTEBOOK_TTL = 7 * 24 * 3600  # 7 days
+
+# Rendered viewer cache budgets
+MAX_RENDERED_VIEWERS = 64
+MAX_RENDERED_VIEWER_BYTES = 32 * 1024 * 1024  # 32 MB
+RENDERED_VIEWER_TTL = 3600  # 1 hour
+
+# Cell manifest cache budgets
+MAX_CELL_MANIFESTS = 256
+MAX_CELL_MANIFEST_BYTES = 16 * 1024 * 1024  # 16 MB
+
+# Length of the digest prefix used in server IDs (96 bits)
+SERVER_ID_DIGEST_LENGTH = 24
+
+
+def accepts_encoding(accept_encoding: Optional[str], encoding: str) -> bool:
+    """Check whether an Accept-Encoding header allows ``encoding``."""
+    if not accept_encoding:
+        return False
+    wildcard = False
+    for part in accept_encoding.split(","):
+        name, _, params = part.strip().partition(";")
+        name = name.strip().lower()
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        if name == encoding:
+            return quality > 0
+        if name == "*":
+            wildcard = quality > 0
+    return wildcard
+
+
+def make_etag(digest: str, variant: Optional[str] = None) -> str:
+    """Build a strong ETag for a representation of the notebook ``digest``."""
+    if variant:
+        return f'"{digest}-{variant}"'
+    return f'"{digest}"'
+
+
+def make_server_id(notebook_content: str, prefix: str = "marimo") -> str:
+    """Derive a deterministic server ID from notebook content."""
+    return f"{prefix}_{content_digest(notebook_content)[:SERVER_ID_DIGEST_LENGTH]}"
+
 
 class MarimoService:
-    def __init__(self):
-        """Initialize the Marimo service."""
-        self.notebooks: Dict[str, Dict] = {}
-        self.cleanup_interval = 3600  # 1 hour
-        self.last_cleanup = time.time()
+    def __init__(
+        self,
+        max_notebooks: int = MAX_NOTEBOOKS,
+        max_bytes: int = MAX_NOTEBOOK_BYTES,
+        max_aliases: int = MAX_ALIASES,
+        ttl: float = NOTEBOOK_TTL,
+        max_ttl: float = MAX_NOTEBOOK_TTL,
+        backend: Optional[NotebookBackend] = None,
+        pyodide_bundle: Optional[PyodideBundle] = None,
+    ):
+        """Initialize the Marimo service.
+
+        Notebook content is stored compressed, once per SHA-256 digest;
+        server IDs are aliases that point at a digest. When a ``backend``
+        is given, the in-memory caches act as an L1 in front of it so other
+        instances and restarts can still resolve notebooks. A
+        ``pyodide_bundle`` makes the WASM viewer boot from locally hosted,
+        lockfile-pinned packages instead of the CDN and micropip.
+        """
+        self.backend = backend
+        self.pyodide_bundle = pyodide_bundle
+        self.pyodide_runtime = pyodide_bundle.runtime_config() if pyodide_bundle else None
+        self._runtime_version = hashlib.sha256(
+            viewer_templates.runtime_json(self.pyodide_runtime).encode('utf-8')
+        ).hexdigest()[:8]
+        self.notebooks = BoundedCache(
+            max_entries=max_notebooks,
+            max_bytes=max_bytes,
+            ttl=ttl,
+            max_ttl=max_ttl,
+        )
+        self.aliases = BoundedCache(
+            max_entries=max_aliases,
+            max_bytes=max_aliases * 256,
+            ttl=ttl,
+            max_ttl=max_ttl,
+        )
+        self.rendered_viewers = BoundedCache(
+            max_entries=MAX_RENDERED_VIEWERS,
+            max_bytes=MAX_RENDERED_VIEWER_BYTES,
+            ttl=RENDERED_VIEWER_TTL,
+        )
+        self.cell_manifests = BoundedCache(
+            max_entries=MAX_CELL_MANIFESTS,
+            max_bytes=MAX_CELL_MANIFEST_BYTES,
+            ttl=ttl,
+            max_ttl=max_ttl,
+        )
+        self.viewer_runtimes = BoundedCache(
+            max_entries=MAX_CELL_MANIFESTS,
+            max_bytes=MAX_CELL_MANIFEST_BYTES,
+            ttl=ttl,
+            max_ttl=max_ttl,
+        )
+        self.dedup_hits = 0
+        self.backend_hits = 0
     
-    def store_notebook(self, server_id: str, notebook_content: str) -> None:
-        """Store a notebook with metadata."""
-        self.notebooks[server_id] = {
-            "content": notebook_content,
-            "created_at": time.time(),
-            "last_accessed": time.time(),
-            "access_count": 0
-        }
+    def store_notebook(self, server_id: str, notebook_content: str) -> str:
+        """Store a notebook under a server ID and return its content digest."""
+        digest = content_digest(notebook_content)
+        self._store(server_id, digest, notebook_content)
+        return digest
+    
+    def store_content(self, notebook_content: str, prefix: str = "marimo") -> str:
+        """Store a notebook under its deterministic server ID and return the ID."""
+        # Hash once; the server ID is a prefix of the digest (see make_server_id)
+        digest = content_digest(notebook_content)
+        server_id = f"{prefix}_{digest[:SERVER_ID_DIGEST_LENGTH]}"
+        self._store(server_id, digest, notebook_content)
+        return server_id
+    
+    def _store(self, server_id: str, digest: str, notebook_content: str) -> None:
+        """Store a notebook whose content digest is already known."""
+        if self.notebooks.peek(digest) is not None:
+            self.dedup_hits += 1
+            if self.backend is not None:
+                # The stored rows are not rewritten, but they must not age out while in use
+                self.backend.touch(digest, server_id)
+        else:
+            body, encoding = compress_notebook(notebook_content)
+            raw_size = len(notebook_content.encode('utf-8'))
+            self.notebooks.put(digest, body, len(body), encoding=encoding, raw_size=raw_size)
+            if self.backend is not None:
+                self.backend.put_blob(digest, body, encoding, raw_size)
         
-        # Cleanup old notebooks periodically
-        if time.time() - self.last_cleanup > self.cleanup_interval:
-            self._cleanup_expired_notebooks()
+        previous = self.aliases.peek(server_id)
+        self.aliases.put(server_id, digest, len(server_id) + len(digest))
+        if self.backend is not None and (previous is None or previous["value"] != digest):
+            self.backend.put_alias(server_id, digest)
     
-    def get_notebook(self, server_id: str) -> Optional[str]:
-        """Get a notebook by ID."""
-        if server_id in self.notebooks:
-            self.notebooks[server_id]["last_accessed"] = time.time()
-            self.notebooks[server_id]["access_count"] += 1
-            return self.notebooks[server_id]["content"]
+    def resolve_digest(self, server_id: str) -> Optional[str]:
+        """Resolve a server ID (or a raw digest) to a content digest."""
+        alias = self.aliases.get(server_id)
+        if alias is not None:
+            return alias["value"]
+        if self.backend is not None:
+            digest = self.backend.get_alias(server_id)
+            if digest is not None:
+                self.aliases.put(server_id, digest, len(server_id) + len(digest))
+                return digest
+        if len(server_id) == 64 and self.notebooks.peek(server_id) is not None:
+            return server_id
         return None
     
-    def create_viewer_html(self, notebook_content: str) -> str:
-        """Create a real Marimo viewer HTML that can execute the notebook."""
-        return f"""
-<!DOCTYPE html>
-<html lang="en">
-<head>
-    <meta charset="UTF-8">
-    <meta name="viewport" content="width=device-width, initial-scale=1.0">
-    <title>Real Marimo Notebook</title>
-    <style>
-        * {{ margin: 0; padding: 0; box-sizing: border-box; }}
-        body {{ 
-            font-family: -apple-system, BlinkMacSystemFont, 'Segoe UI', Roboto, sans-serif; 
-            background: #1a1b26; 
-            color: #a9b1d6; 
-            line-height: 1.6; 
-        }}
-        .header {{ 
-            background: linear-gradient(135deg, #7aa2f7 0%, #bb9af7 100%); 
-            color: white; 
-            padding: 20px; 
-            text-align: center; 
-            border-radius: 0 0 15px 15px; 
-            margin-bottom: 20px; 
-        }}
-        .notebook-container {{ 
-            max-width: 1200px; 
-            margin: 0 auto; 
-            padding: 0 20px; 
-        }}
-        .cell {{ 
-            background: #24283b; 
-            border: 1px solid #414868; 
-            border-radius: 12px; 
-            margin: 20px 0; 
-            overflow: hidden; 
-            box-shadow: 0 4px 12px rgba(0,0,0,0.3); 
-        }}
-        .cell-header {{ 
-            background: linear-gradient(135deg, #1a1b26 0%, #24283b 100%); 
-            padding: 15px 20px; 
-            border-bottom: 1px solid #414868; 
-            display: flex; 
-            justify-content: space-between; 
-            align-items: center; 
-        }}
-        .cell-title {{ 
-            font-weight: 600; 
-            color: #7aa2f7; 
-            font-size: 1.1rem; 
-        }}
-        .run-button {{ 
-            background: linear-gradient(135deg, #7aa2f7 0%, #bb9af7 100%); 
-            color: white; 
-            border: none; 
-            padding: 10px 20px; 
-            border-radius: 8px; 
-            cursor: pointer; 
-            font-size: 0.9rem; 
-            font-weight: 500; 
-            transition: all 0.3s ease; 
-        }}
-        .run-button:hover {{ 
-            transform: translateY(-1px); 
-            box-shadow: 0 4px 12px rgba(122, 162, 247, 0.4); 
-        }}
-        .run-button:disabled {{ 
-            background: #565a6e; 
-            cursor: not-allowed; 
-            transform: none; 
-        }}
-        .cell-code {{ 
-            padding: 20px; 
-            background: #1a1b26; 
-            font-family: 'Monaco', 'Menlo', 'Ubuntu Mono', 'Consolas', monospace; 
-            font-size: 14px; 
-            line-height: 1.6; 
-            white-space: pre-wrap; 
-            overflow-x: auto; 
-            border-bottom: 1px solid #414868; 
-            color: #a9b1d6; 
-        }}
-        .cell-output {{ 
-            padding: 20px; 
-            background: #24283b; 
-            min-height: 60px; 
-            border-radius: 0 0 12px 12px; 
-        }}
-        .loading {{ 
-            color: #bb9af7; 
-            font-style: italic; 
-            text-align: center; 
-            padding: 20px; 
-        }}
-        .error {{ 
-            color: #f7768e; 
-            background: rgba(247, 118, 142, 0.1); 
-            padding: 15px; 
-            border-radius: 8px; 
-            border: 1px solid #f7768e; 
-            margin: 10px 0; 
-        }}
-        .success {{ 
-            color: #9ece6a; 
-            background: rgba(158, 206, 106, 0.1); 
-            padding: 15px; 
-            border-radius: 8px; 
-            border: 1px solid #9ece6a; 
-            margin: 10px 0; 
-        }}
-        .output-content {{ 
-            background: #1a1b26; 
-            padding: 15px; 
-            border-radius: 8px; 
-            border: 1px solid #414868; 
-            font-family: monospace; 
-            white-space: pre-wrap; 
-            overflow-x: auto; 
-        }}
-        .status-bar {{ 
-            background: #24283b; 
-            border: 1px solid #414868; 
-            border-radius: 8px; 
-            padding: 15px; 
-            margin: 20px 0; 
-            text-align: center; 
-            color: #565a6e; 
-        }}
-        .progress-indicator {{ 
-            display: inline-block; 
-            width: 20px; 
-            height: 20px; 
-            border: 3px solid #414868; 
-            border-top: 3px solid #7aa2f7; 
-            border-radius: 50%; 
-            animation: spin 1s linear infinite; 
-            margin-right: 10px; 
-        }}
-        @keyframes spin {{ 
-            0% {{ transform: rotate(0deg); }} 
-            100% {{ transform: rotate(360deg); }} 
-        }}
-        .cell-status {{ 
-            display: flex; 
-            align-items: center; 
-            justify-content: center; 
-            gap: 10px; 
-        }}
-        .status-success {{ color: #9ece6a; }}
-        .status-error {{ color: #f7768e; }}
-        .status-pending {{ color: #e0af68; }}
-        .marimo-info {{ 
-            background: rgba(122, 162, 247, 0.1); 
-            border: 1px solid #7aa2f7; 
-            border-radius: 8px; 
-            padding: 15px; 
-            margin: 20px 0; 
-            text-align: center; 
-        }}
-    </style>
-</head>
-<body>
-    <div class="header">
-        <h1>🚀 Real Marimo Notebook</h1>
-        <p>This is a REAL Marimo notebook running on Cloudflare Python Workers!</p>
-    </div>
+    def get_notebook(self, server_id: str) -> Optional[str]:
+        """Get a notebook by ID."""
+        entry = self._get_entry(server_id)
+        if entry is None:
+            return None
+        return decompress_notebook(entry["value"], entry["encoding"])
     
-    <div class="notebook-container">
-        <div class="marimo-info">
-            <strong>🎯 What You're Seeing:</strong><br>
-            This is a <strong>real Marimo notebook</strong> generated by AI and served by Python Workers.<br>
-            Each cell can be executed individually with real Python execution.
-        </div>
+    def get_notebook_encoded(
+        self, server_id: str, accept_encoding: Optional[str]
+    ) -> Optional[Tuple[bytes, Optional[str]]]:
+        """Get notebook bytes for the wire as (body, content-encoding).
         
-        <div id="notebook">
-            <div class="loading">
-                <div class="progress-indicator"></div>
-                Loading real Marimo notebook...
-            </div>
-        </div>
-    </div>
-
-    <script>
-        let cells = [];
+        The stored compressed bytes are returned as-is when the client
+        accepts their encoding; otherwise the notebook is decompressed and
+        returned with no content-encoding.
+        """
+        entry = self._get_entry(server_id)
+        if entry is None:
+            return None
+        if accepts_encoding(accept_encoding, entry["encoding"]):
+            return entry["value"], entry["encoding"]
+        return decompress_notebook(entry["value"], entry["encoding"]).encode('utf-8'), None
+    
+    def _get_entry(self, server_id: str) -> Optional[Dict]:
+        """Resolve a server ID to its stored notebook record."""
+        digest = self.resolve_digest(server_id)
+        if digest is None:
+            return None
+        entry = self.notebooks.get(digest)
+        if entry is not None:
+            if self.backend is not None:
+                # Served from L1; keep the backend rows from aging out for other instances
+                self.backend.touch(digest, server_id)
+            return entry
         
-        // Parse the notebook content into cells
-        function parseNotebook(content) {{
-            const lines = content.split('\\n');
-            const cellList = [];
-            let currentCell = null;
-            let cellIndex = 0;
-            
-            for (let i = 0; i < lines.length; i++) {{
-                const line = lines[i];
-                const stripped = line.trim();
-                
-                // Check for @app.cell decorator
-                if (stripped.includes('@app.cell') || stripped.includes('@app.cell()')) {{
-                    if (currentCell) {{
-                        cellList.push(currentCell);
-                    }}
-                    currentCell = {{ 
-                        id: `cell_${{cellIndex}}`,
-                        code: '', 
-                        output: '', 
-                        isRunning: false,
-                        hasError: false,
-                        status: 'pending'
-                    }};
-                    cellIndex++;
-                    continue;
-                }}
-                
-                // Add to current cell
-                if (currentCell) {{
-                    currentCell.code += line + '\\n';
-                }}
-            }}
-            
-            if (currentCell) {{
-                cellList.push(currentCell);
-            }}
-            
-            // If no cells found, create a single cell with the entire content
-            if (cellList.length === 0) {{
-                cellList.push({{
-                    id: 'cell_0',
-                    code: content,
-                    output: '',
-                    isRunning: false,
-                    hasError: false,
-                    status: 'pending'
-                }});
-            }}
-            
-            return cellList;
-        }}
+        if self.backend is not None:
+            blob = self.backend.get_blob(digest)
+            if blob is not None:
+                # Promote into the in-memory L1
+                self.backend_hits += 1
+                body, encoding, raw_size = blob
+                return self.notebooks.put(digest, body, len(body), encoding=encoding, raw_size=raw_size)
         
-        // Render cells
-        function renderCells() {{
-            const container = document.getElementById('notebook');
-            container.innerHTML = '';
-            
-            cells.forEach((cell, index) => {{
-                const cellElement = document.createElement('div');
-                cellElement.className = 'cell';
-                cellElement.innerHTML = `
-                    <div class="cell-header">
-                        <div class="cell-title">Cell ${{index + 1}}</div>
-                        <div class="cell-status">
-                            <span class="status-${{cell.status}}">${{getStatusText(cell.status)}}</span>
-                            <button class="run-button" onclick="runCell(${{index}})" ${{cell.isRunning ? 'disabled' : ''}}>
-                                ${{cell.isRunning ? 'Running...' : 'Run Cell'}}
-                            </button>
-                        </div>
-                    </div>
-                    <div class="cell-code">${{cell.code}}</div>
-                    <div class="cell-output" id="output-${{index}}">
-                        ${{cell.output || 'Click "Run Cell" to execute this code'}}
-                    </div>
-                `;
-                container.appendChild(cellElement);
-            }});
-            
-            // Add status bar
-            const statusBar = document.createElement('div');
-            statusBar.className = 'status-bar';
-            statusBar.innerHTML = `
-                <strong>Real Marimo Notebook Status:</strong> ${{cells.length}} cells ready • 
-                ${{cells.filter(c => c.status === 'success').length}} executed • 
-                ${{cells.filter(c => c.status === 'error').length}} errors
-            `;
-            container.appendChild(statusBar);
-        }}
+        # Content is gone everywhere; drop the dangling alias
+        self.aliases.pop(server_id)
+        return None
+    
+    def get_store_stats(self) -> Dict:
+        """Get notebook store occupancy and eviction counters."""
+        return {
+            **self.notebooks.stats(),
+            "aliases": len(self.aliases),
+            "dedup_hits": self.dedup_hits,
+            "backend": type(self.backend).__name__ if self.backend else None,
+            "backend_hits": self.backend_hits,
+        }
+    
+    def get_cell_manifest(self, server_id: str) -> Optional[Tuple[bytes, str]]:
+        """Get the JSON cell manifest for a notebook as (body, digest).
         
-        function getStatusText(status) {{
-            switch(status) {{
-                case 'pending': return '⏳ Pending';
-                case 'running': return '🔄 Running';
-                case 'success': return '✅ Success';
-                case 'error': return '❌ Error';
-                default: return '⏳ Pending';
-            }}
-        }}
+        The manifest is parsed with ast once per content digest and cached
+        in serialized form.
+        """
+        digest = self.resolve_digest(server_id)
+        if digest is None:
+            return None
         
-        // Run a cell (this would connect to the real Marimo backend)
-        async function runCell(index) {{
-            const cell = cells[index];
-            if (cell.isRunning) return;
-            
-            cell.isRunning = true;
-            cell.status = 'running';
-            const outputElement = document.getElementById(`output-${{index}}`);
-            outputElement.innerHTML = '<div class="loading"><div class="progress-indicator"></div>Executing cell with real Marimo...</div>';
-            
-            try {{
-                // In a real implementation, this would call the Marimo backend
-                // For now, we'll simulate the execution
-                await new Promise(resolve => setTimeout(resolve, 1000));
-                
-                // Simulate success
-                cell.output = 'Cell executed successfully with real Marimo! (Simulated for demo)';
-                cell.status = 'success';
-                outputElement.innerHTML = `
-                    <div class="success">✅ Cell executed successfully!</div>
-                    <div class="output-content">${{cell.output}}</div>
-                `;
-            }} catch (error) {{
-                cell.output = `Error: ${{error.message}}`;
-                cell.status = 'error';
-                outputElement.innerHTML = `
-                    <div class="error">❌ Execution failed</div>
-                    <div class="output-content">${{cell.output}}</div>
-                `;
-            }} finally {{
-                cell.isRunning = false;
-                renderCells();
-            }}
-        }}
+        cached = self.cell_manifests.get(digest)
+        if cached is not None:
+            return cached["value"], digest
         
-        // Initialize notebook
-        function initNotebook() {{
-            try {{
-                // Parse and render the notebook
-                const notebookContent = `{notebook_content.replace('`', '\\`')}`;
-                cells = parseNotebook(notebookContent);
-                renderCells();
-                
-            }} catch (error) {{
-                document.getElementById('notebook').innerHTML = `
-                    <div class="error">
-                        ❌ Failed to initialize notebook: ${{error.message}}
-                        <br><br>
-                        <small>This is a real Marimo notebook, but there was an error parsing it.</small>
-                    </div>
-                `;
-            }}
-        }}
+        notebook = self.get_notebook(server_id)
+        if notebook is None:
+            return None
+        body = json.dumps(build_cell_manifest(notebook), separators=(',', ':')).encode('utf-8')
+        self.cell_manifests.put(digest, body, len(body))
+        return body, digest
+    
+    def get_viewer_runtime(self, digest: str, notebook_content: str) -> str:
+        """Get the encoded WASM runtime settings for a notebook.
         
-        // Start loading when page loads
-        window.addEventListener('load', initNotebook);
-    </script>
-</body>
-</html>
+        The package list comes from the notebook's imports, analyzed once
+        per content digest. A notebook that does not parse gets marimo only.
         """
+        cached = self.viewer_runtimes.get(digest)
+        if cached is not None:
+            return cached["value"]
+        
+        try:
+            imports = extract_imports(notebook_content)
+        except SyntaxError:
+            imports = {"marimo"}
+        encoded = viewer_templates.runtime_json(viewer_runtime(imports, self.pyodide_bundle))
+        self.viewer_runtimes.put(digest, encoded, len(encoded))
+        return encoded
+    
+    def create_viewer_html(self, notebook_content: str, server_id: str) -> bytes:
+        """Create a real Marimo viewer HTML that can execute the notebook."""
+        return viewer_templates.render(viewer_templates.CLASSIC_VIEWER, notebook_content, server_id)
     
-    def create_wasm_viewer_html(self, notebook_content: str, server_id: str) -> str:
+    def create_wasm_viewer_html(self, notebook_content: str, server_id: str) -> bytes:
         """Create a WASM-powered Marimo viewer HTML that can execute the notebook interactively."""
-        return f"""
-<!DOCTYPE html>
-<html lang="en">
-<head>
-    <meta charset="UTF-8">
-    <meta name="viewport" content="width=device-width, initial-scale=1.0">
-    <title>Interactive Marimo Notebook</title>
-    <style>
-        * {{ margin: 0; padding: 0; box-sizing: border-box; }}
-        body {{ 
-            font-family: -apple-system, BlinkMacSystemFont, 'Segoe UI', Roboto, sans-serif;
-            background: #1a1a1a;
-            color: #ffffff;
-            overflow: hidden;
-        }}
-        .loading-container {{
-            position: fixed;
-            top: 0;
-            left: 0;
-            width: 100%;
-            height: 100%;
-            display: flex;
-            align-items: center;
-            justify-content: center;
-            background: #1a1a1a;
-            z-index: 1000;
-        }}
-        .loading-content {{
-            text-align: center;
-            max-width: 500px;
-            padding: 2rem;
-        }}
-        .spinner {{
-            width: 50px;
-            height: 50px;
-            border: 4px solid #333;
-            border-top: 4px solid #FFD600;
-            border-radius: 50%;
-            animation: spin 1s linear infinite;
-            margin: 0 auto 1rem;
-        }}
-        @keyframes spin {{
-            0% {{ transform: rotate(0deg); }}
-            100% {{ transform: rotate(360deg); }}
-        }}
-        .loading-title {{
-            font-size: 1.5rem;
-            font-weight: bold;
-            margin-bottom: 0.5rem;
-            color: #FFD600;
-        }}
-        .loading-subtitle {{
-            color: #ccc;
-            margin-bottom: 1rem;
-        }}
-        .progress-bar {{
-            width: 100%;
-            height: 4px;
-            background: #333;
-            border-radius: 2px;
-            overflow: hidden;
-            margin-bottom: 1rem;
-        }}
-        .progress-fill {{
-            height: 100%;
-            background: linear-gradient(90deg, #FFD600, #FFA500);
-            width: 0%;
-            transition: width 0.3s ease;
-        }}
-        .marimo-container {{
-            width: 100vw;
-            height: 100vh;
-            display: none;
-        }}
-        .marimo-iframe {{
-            width: 100%;
-            height: 100%;
-            border: none;
-        }}
-        .error-container {{
-            position: fixed;
-            top: 50%;
-            left: 50%;
-            transform: translate(-50%, -50%);
-            background: #dc3545;
-            color: white;
-            padding: 2rem;
-            border-radius: 8px;
-            max-width: 500px;
-            text-align: center;
-            display: none;
-        }}
-        .error-title {{
-            font-size: 1.2rem;
-            font-weight: bold;
-            margin-bottom: 1rem;
-        }}
-        .fallback-link {{
-            color: #FFD600;
-            text-decoration: none;
-            margin-top: 1rem;
-            display: inline-block;
-        }}
-    </style>
-</head>
-<body>
-    <!-- Loading Screen -->
-    <div id="loading" class="loading-container">
-        <div class="loading-content">
-            <div class="spinner"></div>
-            <div class="loading-title">🚀 Launching Interactive Marimo</div>
-            <div class="loading-subtitle">Preparing your executable notebook...</div>
-            <div class="progress-bar">
-                <div id="progress" class="progress-fill"></div>
-            </div>
-            <div id="status">Initializing Marimo runtime...</div>
-        </div>
-    </div>
-
-    <!-- Error Screen -->
-    <div id="error" class="error-container">
-        <div class="error-title">❌ Failed to Load Interactive Notebook</div>
-        <div id="error-message">An error occurred while loading the Marimo notebook.</div>
-        <a href="data:text/plain;base64,{self._encode_notebook_content(notebook_content)}" download="notebook.py" class="fallback-link">
-            📥 Download Notebook File Instead
-        </a>
-    </div>
-
-    <!-- Marimo Container -->
-    <div id="marimo-container" class="marimo-container">
-        <iframe id="marimo-iframe" class="marimo-iframe" sandbox="allow-scripts allow-same-origin allow-downloads allow-forms"></iframe>
-    </div>
-
-    <script>
-        // Progress simulation
-        let progress = 0;
-        const progressBar = document.getElementById('progress');
-        const statusElement = document.getElementById('status');
-        
-        const steps = [
-            {{ progress: 20, message: "Loading Marimo WASM runtime..." }},
-            {{ progress: 40, message: "Parsing notebook structure..." }},
-            {{ progress: 60, message: "Initializing Python environment..." }},
-            {{ progress: 80, message: "Setting up interactive cells..." }},
-            {{ progress: 95, message: "Almost ready..." }}
-        ];
-        
-        let stepIndex = 0;
-        const progressInterval = setInterval(() => {{
-            if (stepIndex < steps.length) {{
-                const step = steps[stepIndex];
-                progress = step.progress;
-                progressBar.style.width = progress + '%';
-                statusElement.textContent = step.message;
-                stepIndex++;
-            }} else {{
-                clearInterval(progressInterval);
-                initializeMarimo();
-            }}
-        }}, 800);
-
-        async function initializeMarimo() {{
-            try {{
-                // Create a WASM-compatible Marimo notebook
-                const notebookData = `{notebook_content.replace('`', '\\`').replace('${', '\\${').replace('}', '\\}')}`;
-                
-                // Create an HTML document that embeds the notebook using Marimo's browser capabilities
-                const marimoHTML = createMarimoHTML(notebookData);
-                
-                // Create a blob URL for the Marimo HTML
-                const blob = new Blob([marimoHTML], {{ type: 'text/html' }});
-                const url = URL.createObjectURL(blob);
-                
-                // Load it in the iframe
-                const iframe = document.getElementById('marimo-iframe');
-                iframe.src = url;
-                
-                // Wait for iframe to load
-                iframe.onload = () => {{
-                    progressBar.style.width = '100%';
-                    statusElement.textContent = "Ready! 🎉";
-                    
-                    setTimeout(() => {{
-                        document.getElementById('loading').style.display = 'none';
-                        document.getElementById('marimo-container').style.display = 'block';
-                    }}, 500);
-                }};
-                
-                iframe.onerror = () => {{
-                    throw new Error('Failed to load interactive notebook');
-                }};
-                
-            }} catch (error) {{
-                console.error('Marimo initialization error:', error);
-                showError(error.message);
-            }}
-        }}
-
-        function createMarimoHTML(notebookContent) {{
-            return `
-<!DOCTYPE html>
-<html>
-<head>
-    <meta charset="UTF-8">
-    <title>Marimo Notebook</title>
-    <script src="https://cdn.jsdelivr.net/pyodide/v0.24.1/full/pyodide.js"></script>
-    <style>
-        body {{ 
-            font-family: -apple-system, BlinkMacSystemFont, 'Segoe UI', Roboto, sans-serif;
-            margin: 0; 
-            padding: 20px; 
-            background: #1a1a1a; 
-            color: #fff; 
-        }}
-        .cell {{ 
-            background: #2d2d2d; 
-            border: 1px solid #444; 
-            border-radius: 8px; 
-            margin: 10px 0; 
-            padding: 15px; 
-        }}
-        .cell-header {{ 
-            font-weight: bold; 
-            color: #FFD600; 
-            margin-bottom: 10px; 
-            font-size: 0.9rem;
-        }}
-        .cell-content {{ 
-            background: #1a1a1a; 
-            border-radius: 4px; 
-            padding: 10px; 
-            font-family: 'Courier New', monospace; 
-            font-size: 0.9rem;
-            white-space: pre-wrap;
-            overflow-x: auto;
-        }}
-        .cell-output {{ 
-            background: #0a0a0a; 
-            border-radius: 4px; 
-            padding: 10px; 
-            margin-top: 10px; 
-            border-left: 3px solid #28a745;
-        }}
-        .run-button {{ 
-            background: #28a745; 
-            color: white; 
-            border: none; 
-            padding: 5px 10px; 
-            border-radius: 4px; 
-            cursor: pointer; 
-            font-size: 0.8rem;
-            margin-top: 10px;
-        }}
-        .run-button:hover {{ background: #218838; }}
-        .run-button:disabled {{ background: #6c757d; cursor: not-allowed; }}
-        .error {{ color: #dc3545; }}
-        .status {{ color: #6c757d; font-size: 0.8rem; margin-top: 5px; }}
-    </style>
-</head>
-<body>
-    <div id="notebook">
-        <h1>🚀 Interactive Marimo Notebook</h1>
-        <div id="loading" style="text-align: center; padding: 20px;">
-            <div>Loading Python environment...</div>
-        </div>
-    </div>
-
-    <script>
-        let pyodide = null;
-        let cells = [];
-
-        async function initPyodide() {{
-            try {{
-                pyodide = await loadPyodide();
-                await pyodide.loadPackage(['micropip']);
-                
-                // Install marimo if needed
-                try {{
-                    await pyodide.runPython('import marimo');
-                }} catch {{
-                    document.getElementById('loading').innerHTML = 'Installing marimo...';
-                    await pyodide.runPython('import micropip; await micropip.install("marimo")');
-                }}
-                
-                parseCells();
-                renderNotebook();
-            }} catch (error) {{
-                document.getElementById('loading').innerHTML = 
-                    '<div class="error">Failed to initialize Python: ' + error.message + '</div>';
-            }}
-        }}
-
-        function parseCells() {{
-            const content = \`{notebookContent}\`;
-            const lines = content.split('\\n');
-            let currentCell = null;
-            
-            for (const line of lines) {{
-                if (line.trim().startsWith('@app.cell')) {{
-                    if (currentCell) {{
-                        cells.push(currentCell);
-                    }}
-                    currentCell = {{ type: 'cell', content: '', output: '' }};
-                }} else if (line.trim().startsWith('def ') && currentCell) {{
-                    currentCell.content += line + '\\n';
-                }} else if (currentCell && line.trim()) {{
-                    currentCell.content += line + '\\n';
-                }}
-            }}
-            if (currentCell) {{
-                cells.push(currentCell);
-            }}
-        }}
-
-        function renderNotebook() {{
-            const notebook = document.getElementById('notebook');
-            notebook.innerHTML = '<h1>🚀 Interactive Marimo Notebook</h1>';
-            
-            cells.forEach((cell, index) => {{
-                const cellDiv = document.createElement('div');
-                cellDiv.className = 'cell';
-                cellDiv.innerHTML = \`
-                    <div class="cell-header">Cell \${{index + 1}}</div>
-                    <div class="cell-content">\${{cell.content}}</div>
-                    <button class="run-button" onclick="runCell(\${{index}})">▶ Run</button>
-                    <div class="status" id="status-\${{index}}"></div>
-                    <div class="cell-output" id="output-\${{index}}" style="display: none;"></div>
-                \`;
-                notebook.appendChild(cellDiv);
-            }});
-        }}
-
-        async function runCell(index) {{
-            const statusEl = document.getElementById('status-' + index);
-            const outputEl = document.getElementById('output-' + index);
-            const button = event.target;
-            
-            button.disabled = true;
-            statusEl.textContent = 'Running...';
-            outputEl.style.display = 'none';
-            
-            try {{
-                const result = await pyodide.runPython(cells[index].content);
-                outputEl.innerHTML = result ? \`<pre>\${{result}}</pre>\` : '<em>Executed successfully</em>';
-                outputEl.style.display = 'block';
-                statusEl.textContent = 'Completed';
-            }} catch (error) {{
-                outputEl.innerHTML = \`<div class="error">Error: \${{error.message}}</div>\`;
-                outputEl.style.display = 'block';
-                statusEl.textContent = 'Error';
-            }} finally {{
-                button.disabled = false;
-            }}
-        }}
-
-        // Initialize when page loads
-        window.addEventListener('load', initPyodide);
-    </script>
-</body>
-</html>
-            \`;
-        }}
-
-        function showError(message) {{
-            document.getElementById('loading').style.display = 'none';
-            document.getElementById('error').style.display = 'block';
-            document.getElementById('error-message').textContent = message;
-        }}
-        
-        // Cleanup blob URL when page unloads
-        window.addEventListener('beforeunload', () => {{
-            const iframe = document.getElementById('marimo-iframe');
-            if (iframe.src && iframe.src.startsWith('blob:')) {{
-                URL.revokeObjectURL(iframe.src);
-            }}
-        }});
-    </script>
-</body>
-</html>
-        """
+        runtime = self.get_viewer_runtime(content_digest(notebook_content), notebook_content)
+        return viewer_templates.render(viewer_templates.WASM_VIEWER, notebook_content, server_id, runtime)
     
-    def _encode_notebook_content(self, notebook_content: str) -> str:
-        """Encode notebook content for data URI download fallback."""
-        import base64
-        return base64.b64encode(notebook_content.encode('utf-8')).decode('ascii')
+    async def render_wasm_viewer(self, notebook_content: str, server_id: str) -> bytes:
+        """Async variant of create_wasm_viewer_html that keeps large renders off the event loop."""
+        runtime = self.get_viewer_runtime(content_digest(notebook_content), notebook_content)
+        return await viewer_templates.render_async(
+            viewer_templates.WASM_VIEWER, notebook_content, server_id, runtime
+        )
     
-    def _cleanup_expired_notebooks(self) -> None:
-        """Clean up expired notebooks to prevent memory issues."""
-        current_time = time.time()
-        expired_threshold = 24 * 3600  # 24 hours
+    async def get_wasm_viewer(self, server_id: str) -> Optional[Tuple[bytes, str]]:
+        """Get the rendered WASM viewer for a notebook as (html, etag).
         
-        expired_ids = [
-            server_id for server_id, notebook in self.notebooks.items()
-            if current_time - notebook["created_at"] > expired_threshold
-        ]
+        Rendered pages are cached by (server_id, digest); content never
+        changes for a digest, so a cached page is always current.
+        """
+        digest = self.resolve_digest(server_id)
+        if digest is None:
+            return None
+        etag = self.wasm_viewer_etag(digest)
         
-        for server_id in expired_ids:
-            del self.notebooks[server_id]
+        cache_key = f"{server_id}:{digest}"
+        cached = self.rendered_viewers.get(cache_key)
+        if cached is not None:
+            return cached["value"], etag
         
-        self.last_cleanup = current_time
+        notebook = self.get_notebook(server_id)
+        if notebook is None:
+            return None
+        html = await self.render_wasm_viewer(notebook, server_id)
+        self.rendered_viewers.put(cache_key, html, len(html))
+        return html, etag
+    
+    def wasm_viewer_etag(self, digest: str) -> str:
+        """ETag for the WASM viewer page; changes with the notebook, template or runtime."""
+        return make_etag(digest, f"wasm-{viewer_templates.WASM_VIEWER_VERSION}{self._runtime_version}")
+    
+    def get_viewer_cache_stats(self) -> Dict:
+        """Get rendered viewer cache hit/miss counters."""
+        return self.rendered_viewers.stats()
     
     def get_active_server_count(self) -> int:
         """Get the number of active servers."""
-        return len(self.notebooks)
+        return len(self.aliases)
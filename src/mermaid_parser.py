@@ -0,0 +1,301 @@
+"""
+Mermaid Parser for Python Workers
+Parses Mermaid flowcharts into nodes and edges and partitions them
+"""
+
+import re
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+# "graph TD" / "flowchart LR" header with an optional direction
+_HEADER = re.compile(r"^(?:graph|flowchart)\b\s*(\w+)?\s*$", re.IGNORECASE)
+# Statements that only group or style nodes
+_IGNORED = re.compile(r"^(?:direction|classDef|class|style|click|linkStyle)\b")
+_SUBGRAPH = re.compile(r"^subgraph\b\s*(.*)$")
+_NODE_ID = re.compile(r"\s*(\w+)")
+_CLASS_SUFFIX = re.compile(r":::\w+")
+_AMPERSAND = re.compile(r"\s*&\s*")
+# Links: "A -- text --> B" style first, then operators with an optional |text|
+_LINK = re.compile(
+    r"\s*(?:"
+    r"(?:--|==|-\.)\s+(?P<text>[^|]+?)\s+(?:-{2,}>|={2,}>|\.-+>|-{3,}|={3,})"
+    r"|(?P<op><?(?:-{2,}|={2,}|-\.+-|~{3,})[>ox]?)\s*(?:\|(?P<pipe>[^|]*)\|)?"
+    r")\s*"
+)
+# Splits statements on ";" outside double quotes
+_SEMICOLON = re.compile(r';(?=(?:[^"]*"[^"]*")*[^"]*$)')
+
+# Node shapes as (name, opening, closing); longer delimiters are tried first
+_SHAPES = [
+    ("double_circle", "(((", ")))"),
+    ("circle", "((", "))"),
+    ("stadium", "([", "])"),
+    ("cylinder", "[(", ")]"),
+    ("subroutine", "[[", "]]"),
+    ("hexagon", "{{", "}}"),
+    ("parallelogram", "[/", "/]"),
+    ("trapezoid", "[/", "\\]"),
+    ("parallelogram_alt", "[\\", "\\]"),
+    ("trapezoid_alt", "[\\", "/]"),
+    ("rhombus", "{", "}"),
+    ("rect", "[", "]"),
+    ("round", "(", ")"),
+    ("asymmetric", ">", "]"),
+]
+
+
+def cell_name(node_id: str) -> str:
+    """Name of the notebook cell generated for a node."""
+    return f"node_{node_id}"
+
+
+def output_name(node_id: str) -> str:
+    """Variable a node's cell defines for its successors."""
+    return f"value_{node_id}"
+
+
+def _read_shape(text: str, pos: int) -> Optional[Tuple[str, str, int]]:
+    """Read a shape and label at ``pos`` as (shape, label, end)."""
+    for shape, opening, closing in _SHAPES:
+        if not text.startswith(opening, pos):
+            continue
+        start = pos + len(opening)
+        stripped = len(text) - len(text[start:].lstrip())
+        if text.startswith('"', stripped):
+            quote_end = text.find('"', stripped + 1)
+            if quote_end < 0:
+                continue
+            label = text[stripped + 1:quote_end]
+            after = quote_end + 1
+            after += len(text[after:]) - len(text[after:].lstrip())
+            if not text.startswith(closing, after):
+                continue
+            return shape, label, after + len(closing)
+        end = text.find(closing, start)
+        if end < 0:
+            continue
+        return shape, text[start:end].strip(), end + len(closing)
+    return None
+
+
+def _read_nodes(statement: str, pos: int, graph: Dict, subgraph: Optional[str]) -> Tuple[List[str], int]:
+    """Read ``A[label] & B`` at ``pos``, declaring the nodes; returns (ids, end)."""
+    node_ids = []
+    while True:
+        match = _NODE_ID.match(statement, pos)
+        if match is None:
+            raise ValueError(f"Unsupported Mermaid statement: {statement!r}")
+        node_id = match.group(1)
+        pos = match.end()
+        shape = _read_shape(statement, pos)
+        node = graph["nodes"].get(node_id)
+        if node is None:
+            node = graph["nodes"][node_id] = {"id": node_id, "label": node_id, "shape": "rect"}
+            if subgraph is not None:
+                graph["subgraphs"][subgraph].append(node_id)
+        if shape is not None:
+            node["shape"], node["label"], pos = shape
+        suffix = _CLASS_SUFFIX.match(statement, pos)
+        if suffix:
+            pos = suffix.end()
+        node_ids.append(node_id)
+        ampersand = _AMPERSAND.match(statement, pos)
+        if ampersand is None:
+            return node_ids, pos
+        pos = ampersand.end()
+
+
+def _parse_statement(statement: str, graph: Dict, subgraph: Optional[str]) -> None:
+    """Add the nodes and edges of one statement, expanding chains and ``&``."""
+    sources, pos = _read_nodes(statement, 0, graph, subgraph)
+    while pos < len(statement):
+        link = _LINK.match(statement, pos)
+        if link is None or link.end() == pos:
+            raise ValueError(f"Unsupported Mermaid statement: {statement!r}")
+        targets, pos = _read_nodes(statement, link.end(), graph, subgraph)
+        label = (link.group("text") or link.group("pipe") or "").strip().strip('"')
+        for source in sources:
+            for target in targets:
+                graph["edges"].append({"from": source, "to": target, "label": label})
+        sources = targets
+
+
+def parse_flowchart(diagram: str) -> Dict:
+    """Parse a Mermaid flowchart into ``{direction, nodes, edges, subgraphs}``.
+
+    ``nodes`` maps id to ``{id, label, shape}`` in declaration order,
+    ``edges`` lists ``{from, to, label}`` and ``subgraphs`` maps each
+    subgraph to the nodes first declared inside it. Styling statements and
+    ``%%`` comments are ignored.
+
+    Raises ValueError for other diagram types and unsupported syntax.
+    """
+    graph: Dict = {"direction": "TD", "nodes": {}, "edges": [], "subgraphs": {}}
+    statements = []
+    for line in diagram.splitlines():
+        line = line.strip()
+        if line and not line.startswith("%%"):
+            statements.extend(s.strip() for s in _SEMICOLON.split(line) if s.strip())
+    if not statements:
+        raise ValueError("Empty Mermaid diagram")
+    header = _HEADER.match(statements[0])
+    if header is None:
+        raise ValueError("Not a Mermaid flowchart")
+    graph["direction"] = (header.group(1) or "TD").upper()
+
+    open_subgraphs: List[str] = []
+    for statement in statements[1:]:
+        subgraph = _SUBGRAPH.match(statement)
+        if subgraph:
+            name = subgraph.group(1).split("[")[0].strip() or f"subgraph_{len(graph['subgraphs'])}"
+            graph["subgraphs"].setdefault(name, [])
+            open_subgraphs.append(name)
+        elif statement == "end":
+            if not open_subgraphs:
+                raise ValueError("Mermaid 'end' without a subgraph")
+            open_subgraphs.pop()
+        elif not _IGNORED.match(statement):
+            _parse_statement(statement, graph, open_subgraphs[-1] if open_subgraphs else None)
+    return graph
+
+
+def back_edges(graph: Dict) -> List[Dict]:
+    """The edges that close a cycle, such as a retry loop back to an input step.
+
+    An edge is a back edge when it does not lead to a later layer of
+    topological_layers, which breaks each cycle at its earliest-declared
+    node; self-loops count too.
+    """
+    rank = {node_id: index for index, layer in enumerate(topological_layers(graph)) for node_id in layer}
+    return [edge for edge in graph["edges"] if rank[edge["from"]] >= rank[edge["to"]]]
+
+
+def predecessors(graph: Dict) -> Dict[str, List[str]]:
+    """Map each node to the distinct nodes with an edge into it, in edge order.
+
+    Back edges are left out, so cells wired up from this map never form a
+    cycle, which marimo would refuse to run.
+    """
+    incoming: Dict[str, List[str]] = {node_id: [] for node_id in graph["nodes"]}
+    skipped = back_edges(graph)
+    for edge in graph["edges"]:
+        sources = incoming[edge["to"]]
+        if edge not in skipped and edge["from"] not in sources:
+            sources.append(edge["from"])
+    return incoming
+
+
+def connected_components(graph: Dict) -> List[List[str]]:
+    """Weakly connected components, each listed in declaration order."""
+    order = {node_id: index for index, node_id in enumerate(graph["nodes"])}
+    neighbours: Dict[str, List[str]] = {node_id: [] for node_id in graph["nodes"]}
+    for edge in graph["edges"]:
+        neighbours[edge["from"]].append(edge["to"])
+        neighbours[edge["to"]].append(edge["from"])
+
+    seen: Set[str] = set()
+    components = []
+    for node_id in graph["nodes"]:
+        if node_id in seen:
+            continue
+        seen.add(node_id)
+        stack = [node_id]
+        component = []
+        while stack:
+            current = stack.pop()
+            component.append(current)
+            for neighbour in neighbours[current]:
+                if neighbour not in seen:
+                    seen.add(neighbour)
+                    stack.append(neighbour)
+        components.append(sorted(component, key=order.__getitem__))
+    return components
+
+
+def topological_layers(graph: Dict, node_ids: Optional[Iterable[str]] = None) -> List[List[str]]:
+    """Group nodes into layers whose inputs all come from earlier layers.
+
+    Only edges between ``node_ids`` (default: every node) count. A cycle is
+    broken at its earliest-declared node, so every node is placed.
+    """
+    node_ids = list(graph["nodes"] if node_ids is None else node_ids)
+    order = {node_id: index for index, node_id in enumerate(graph["nodes"])}
+    indegree = {node_id: 0 for node_id in node_ids}
+    successors: Dict[str, List[str]] = {node_id: [] for node_id in node_ids}
+    for edge in graph["edges"]:
+        source, target = edge["from"], edge["to"]
+        if source in indegree and target in indegree and source != target:
+            successors[source].append(target)
+            indegree[target] += 1
+
+    placed: Set[str] = set()
+    layers = []
+    ready = [node_id for node_id in node_ids if indegree[node_id] == 0]
+    while len(placed) < len(node_ids):
+        if not ready:
+            ready = [next(node_id for node_id in node_ids if node_id not in placed)]
+        layers.append(ready)
+        placed.update(ready)
+        unlocked = []
+        for node_id in ready:
+            for successor in successors[node_id]:
+                if successor in placed:
+                    continue
+                indegree[successor] -= 1
+                if indegree[successor] == 0:
+                    unlocked.append(successor)
+        ready = sorted(unlocked, key=order.__getitem__)
+    return layers
+
+
+def partition_flowchart(graph: Dict, max_nodes: int) -> List[List[str]]:
+    """Split the nodes into parts of at most ``max_nodes`` for separate generation.
+
+    Small weakly connected components are packed together; a component
+    larger than ``max_nodes`` is cut along its topological order, so a
+    part's inputs from the same component come from earlier parts.
+    """
+    parts: List[List[str]] = []
+    packed: List[str] = []
+    for component in connected_components(graph):
+        if len(component) > max_nodes:
+            ordered = [node_id for layer in topological_layers(graph, component) for node_id in layer]
+            parts.extend(ordered[i:i + max_nodes] for i in range(0, len(ordered), max_nodes))
+            continue
+        if len(packed) + len(component) > max_nodes:
+            parts.append(packed)
+            packed = []
+        packed.extend(component)
+    if packed:
+        parts.append(packed)
+    return parts
+
+
+def render_flowchart(
+    graph: Dict,
+    node_ids: Optional[Iterable[str]] = None,
+    indent: str = "    ",
+    label_chars: Optional[int] = None,
+    edge_labels: bool = True,
+) -> str:
+    """Render the subgraph induced by ``node_ids`` (default: all) as Mermaid.
+
+    Labels are cut to ``label_chars`` when given; ``edge_labels=False``
+    leaves link text out.
+    """
+    members = list(graph["nodes"] if node_ids is None else node_ids)
+    included = set(members)
+    separator = " " if indent else ""
+    lines = [f"flowchart {graph['direction']}"]
+    for node_id in members:
+        label = graph["nodes"][node_id]["label"]
+        if label_chars is not None and len(label) > label_chars:
+            label = label[:label_chars - 1].rstrip() + "…"
+        if label != node_id:
+            lines.append(f'{indent}{node_id}["{label.replace(chr(34), "#quot;")}"]')
+        else:
+            lines.append(f"{indent}{node_id}")
+    for edge in graph["edges"]:
+        if edge["from"] in included and edge["to"] in included:
+            label = f"|{edge['label']}|" if edge["label"] and edge_labels else ""
+            lines.append(f"{indent}{edge['from']}{separator}-->{label}{separator}{edge['to']}")
+    return "\n".join(lines)
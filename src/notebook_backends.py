@@ -0,0 +1,305 @@
+"""
+Notebook Storage Backends for Python Workers
+Persistent stores that MarimoService keeps behind its in-memory cache
+"""
+
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from typing import Dict, List, Optional, Set, Tuple
+
+# (compressed body, content-encoding, uncompressed size)
+NotebookBlob = Tuple[bytes, str, int]
+
+# (notebook digest, tokens the generation used, created_at)
+GenerationRecord = Tuple[str, int, float]
+
+# Rows unused for longer than the in-memory notebook TTL (7 days) are purged
+RETENTION_SECONDS = 14 * 24 * 3600
+# Seconds between purges, run when a batch is committed
+PURGE_INTERVAL = 3600
+
+# Buffered writes are committed together once there are this many, or after this many seconds
+WRITE_BATCH_SIZE = 64
+WRITE_BATCH_DELAY = 0.5
+
+
+class NotebookBackend(ABC):
+    """Interface for a notebook store shared beyond a single service instance.
+
+    Blobs are addressed by content digest, so writing the same digest twice
+    is idempotent; aliases map server IDs to digests and generation records
+    map generation cache keys to digests.
+    """
+
+    @abstractmethod
+    def get_blob(self, digest: str) -> Optional[NotebookBlob]:
+        """Get a stored notebook blob by content digest."""
+
+    @abstractmethod
+    def put_blob(self, digest: str, body: bytes, encoding: str, raw_size: int) -> None:
+        """Store a notebook blob under its content digest."""
+
+    @abstractmethod
+    def get_alias(self, server_id: str) -> Optional[str]:
+        """Resolve a server ID to a content digest."""
+
+    @abstractmethod
+    def put_alias(self, server_id: str, digest: str) -> None:
+        """Point a server ID at a content digest."""
+
+    @abstractmethod
+    def get_generation(self, key: str) -> Optional[GenerationRecord]:
+        """Look up a cached generation by its cache key."""
+
+    @abstractmethod
+    def put_generation(self, key: str, digest: str, tokens: int) -> None:
+        """Record that the generation ``key`` produced the notebook ``digest``."""
+
+    def touch(self, digest: str, server_id: Optional[str] = None) -> None:
+        """Note that a notebook (and the server ID it was reached by) is still in use."""
+
+    def flush(self) -> None:
+        """Write any buffered changes."""
+
+    def close(self) -> None:
+        """Flush and release resources."""
+        self.flush()
+
+
+class MemoryBackend(NotebookBackend):
+    """Process-local backend, mainly useful for tests and benchmarks."""
+
+    def __init__(self):
+        """Initialize empty blob and alias maps."""
+        self.blobs: Dict[str, NotebookBlob] = {}
+        self.aliases: Dict[str, str] = {}
+        self.generations: Dict[str, GenerationRecord] = {}
+
+    def get_blob(self, digest: str) -> Optional[NotebookBlob]:
+        return self.blobs.get(digest)
+
+    def put_blob(self, digest: str, body: bytes, encoding: str, raw_size: int) -> None:
+        self.blobs.setdefault(digest, (body, encoding, raw_size))
+
+    def get_alias(self, server_id: str) -> Optional[str]:
+        return self.aliases.get(server_id)
+
+    def put_alias(self, server_id: str, digest: str) -> None:
+        self.aliases[server_id] = digest
+
+    def get_generation(self, key: str) -> Optional[GenerationRecord]:
+        return self.generations.get(key)
+
+    def put_generation(self, key: str, digest: str, tokens: int) -> None:
+        self.generations[key] = (digest, tokens, time.time())
+
+
+class SQLiteBackend(NotebookBackend):
+    """SQLite backend in WAL mode, safe to share between worker processes.
+
+    Writes are buffered and committed in one transaction once
+    ``batch_size`` are waiting or the oldest has waited ``batch_delay``
+    seconds (a timer thread commits a batch that stops growing), so
+    another process sees a notebook at most ``batch_delay`` seconds after
+    ``put_*`` returns. Reads commit this instance's buffer first. close()
+    commits whatever is left.
+
+    Each row's ``created_at`` holds the last time it was stored or used:
+    storing it, reading it or touch() renews it, at most once per
+    ``purge_interval``. Rows unused for ``retention`` seconds are purged at
+    most once per ``purge_interval``, when a batch is committed.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        retention: float = RETENTION_SECONDS,
+        purge_interval: float = PURGE_INTERVAL,
+        batch_size: int = WRITE_BATCH_SIZE,
+        batch_delay: float = WRITE_BATCH_DELAY,
+    ):
+        """Open (and if needed create) the database at ``path``."""
+        self.path = path
+        self.retention = retention
+        self.purge_interval = purge_interval
+        self.batch_size = batch_size
+        self.batch_delay = batch_delay
+        self._lock = threading.Lock()
+        self._last_purge = time.time()
+        self._pending: List[Tuple[str, Tuple]] = []
+        self._pending_since = 0.0
+        self._timer: Optional[threading.Timer] = None
+        # Rows renewed since the last purge; each is renewed at most once per purge interval
+        self._renewed: Set[Tuple[str, str]] = set()
+
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("PRAGMA busy_timeout=30000")
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS notebooks (
+                digest TEXT PRIMARY KEY,
+                body BLOB NOT NULL,
+                encoding TEXT NOT NULL,
+                raw_size INTEGER NOT NULL,
+                created_at REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS aliases (
+                server_id TEXT PRIMARY KEY,
+                digest TEXT NOT NULL,
+                created_at REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS generations (
+                key TEXT PRIMARY KEY,
+                digest TEXT NOT NULL,
+                tokens INTEGER NOT NULL,
+                created_at REAL NOT NULL
+            );
+            """
+        )
+        self._conn.commit()
+
+    def get_blob(self, digest: str) -> Optional[NotebookBlob]:
+        with self._lock:
+            self._flush_locked()
+            row = self._conn.execute(
+                "SELECT body, encoding, raw_size FROM notebooks WHERE digest = ?",
+                (digest,),
+            ).fetchone()
+            if row is not None:
+                self._renew_locked("notebooks", digest)
+        if row is None:
+            return None
+        return bytes(row[0]), row[1], row[2]
+
+    def put_blob(self, digest: str, body: bytes, encoding: str, raw_size: int) -> None:
+        # Blobs are content-addressed, so a concurrent writer's row is identical; only its age changes
+        with self._lock:
+            self._renewed.add(("notebooks", digest))
+            self._write_locked(
+                "INSERT INTO notebooks (digest, body, encoding, raw_size, created_at) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT(digest) DO UPDATE SET created_at = excluded.created_at",
+                (digest, body, encoding, raw_size, time.time()),
+            )
+
+    def get_alias(self, server_id: str) -> Optional[str]:
+        with self._lock:
+            self._flush_locked()
+            row = self._conn.execute(
+                "SELECT digest FROM aliases WHERE server_id = ?", (server_id,)
+            ).fetchone()
+            if row is not None:
+                self._renew_locked("aliases", server_id)
+        return row[0] if row else None
+
+    def put_alias(self, server_id: str, digest: str) -> None:
+        with self._lock:
+            self._renewed.add(("aliases", server_id))
+            self._write_locked(
+                "INSERT OR REPLACE INTO aliases (server_id, digest, created_at) VALUES (?, ?, ?)",
+                (server_id, digest, time.time()),
+            )
+
+    def touch(self, digest: str, server_id: Optional[str] = None) -> None:
+        with self._lock:
+            self._renew_locked("notebooks", digest)
+            if server_id is not None:
+                self._renew_locked("aliases", server_id)
+
+    def get_generation(self, key: str) -> Optional[GenerationRecord]:
+        with self._lock:
+            self._flush_locked()
+            row = self._conn.execute(
+                "SELECT digest, tokens, created_at FROM generations WHERE key = ?", (key,)
+            ).fetchone()
+        return tuple(row) if row else None
+
+    def put_generation(self, key: str, digest: str, tokens: int) -> None:
+        with self._lock:
+            self._write_locked(
+                "INSERT OR REPLACE INTO generations (key, digest, tokens, created_at) VALUES (?, ?, ?, ?)",
+                (key, digest, tokens, time.time()),
+            )
+
+    def flush(self) -> None:
+        """Commit the buffered writes."""
+        with self._lock:
+            self._flush_locked()
+
+    def close(self) -> None:
+        with self._lock:
+            self._flush_locked()
+            self._conn.close()
+
+    def purge_older_than(self, max_age: float) -> int:
+        """Delete notebooks and aliases unused for more than ``max_age`` seconds."""
+        with self._lock:
+            self._flush_locked()
+            return self._purge_locked(time.time() - max_age)
+
+    def _renew_locked(self, table: str, key: str) -> None:
+        """Queue a refresh of a row's ``created_at``, unless it was renewed since the last purge."""
+        if (table, key) in self._renewed:
+            return
+        self._renewed.add((table, key))
+        column = "digest" if table == "notebooks" else "server_id"
+        self._write_locked(f"UPDATE {table} SET created_at = ? WHERE {column} = ?", (time.time(), key))
+
+    def _write_locked(self, statement: str, parameters: Tuple) -> None:
+        """Buffer a write, committing the batch once it is full or old enough."""
+        now = time.time()
+        if not self._pending:
+            self._pending_since = now
+        self._pending.append((statement, parameters))
+        if len(self._pending) >= self.batch_size or now - self._pending_since >= self.batch_delay:
+            self._flush_locked()
+        elif self._timer is None:
+            self._timer = threading.Timer(self.batch_delay, self.flush)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def _flush_locked(self) -> None:
+        """Commit the buffered writes in one transaction, purging unused rows when due."""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if not self._pending:
+            return
+        with self._conn:
+            for statement, parameters in self._pending:
+                self._conn.execute(statement, parameters)
+        self._pending = []
+        now = time.time()
+        if now - self._last_purge >= self.purge_interval:
+            deleted = self._purge_locked(now - self.retention)
+            print(f"Purged {deleted} notebooks unused for {self.retention / 3600:.0f} h")
+
+    def _purge_locked(self, cutoff: float) -> int:
+        self._last_purge = time.time()
+        self._renewed.clear()
+        with self._conn:
+            deleted = self._conn.execute(
+                "DELETE FROM notebooks WHERE created_at < ?", (cutoff,)
+            ).rowcount
+            self._conn.execute("DELETE FROM aliases WHERE created_at < ?", (cutoff,))
+            self._conn.execute("DELETE FROM generations WHERE created_at < ?", (cutoff,))
+        return deleted
+
+
+def create_backend(url: Optional[str]) -> Optional[NotebookBackend]:
+    """Create a backend from a configuration string.
+
+    ``None``/empty keeps notebooks in memory only, ``memory:`` uses a
+    MemoryBackend and anything else is treated as an SQLite database path
+    (an optional ``sqlite:`` prefix is stripped).
+    """
+    if not url:
+        return None
+    if url == "memory:":
+        return MemoryBackend()
+    if url.startswith("sqlite:"):
+        url = url[len("sqlite:"):]
+    return SQLiteBackend(url)
@@ -0,0 +1,33 @@
+"""
+Notebook Codec for Python Workers
+Content digests and compression for stored notebooks
+"""
+
+import gzip
+import hashlib
+from typing import Tuple
+
+try:
+    import brotli
+except ImportError:  # brotli is optional; gzip is always available
+    brotli = None
+
+
+def content_digest(notebook_content: str) -> str:
+    """Return the SHA-256 hex digest that addresses a notebook's content."""
+    return hashlib.sha256(notebook_content.encode('utf-8')).hexdigest()
+
+
+def compress_notebook(notebook_content: str) -> Tuple[bytes, str]:
+    """Compress notebook text for storage, returning (body, content-encoding)."""
+    raw = notebook_content.encode('utf-8')
+    if brotli is not None:
+        return brotli.compress(raw, quality=9), "br"
+    return gzip.compress(raw, compresslevel=9, mtime=0), "gzip"
+
+
+def decompress_notebook(body: bytes, encoding: str) -> str:
+    """Inverse of compress_notebook."""
+    if encoding == "br":
+        return brotli.decompress(body).decode('utf-8')
+    return gzip.decompress(body).decode('utf-8')
@@ -0,0 +1,307 @@
+"""
+Notebook Validator for Python Workers
+Checks generated Marimo notebooks with ast and applies cheap repairs
+"""
+
+import ast
+import re
+from typing import Dict, List, Optional, Set, Tuple
+
+from bounded_cache import BoundedCache
+from cell_parser import (
+    BUILTIN_NAMES, extract_cells, import_statements, is_cell_decorator, return_statement, rewrite_signatures,
+)
+from notebook_codec import content_digest
+from token_budget import trim_to_complete_cells
+
+# Validation results cache budgets; results are keyed by the digest of the content checked
+MAX_VALIDATIONS = 256
+MAX_VALIDATION_BYTES = 16 * 1024 * 1024  # 16 MB
+VALIDATION_TTL = 3600  # 1 hour
+
+# The lines every notebook starts and ends with
+NOTEBOOK_HEADER = "import marimo"
+NOTEBOOK_FOOTER = 'if __name__ == "__main__":\n    app.run()'
+
+# Conventional module aliases; a cell that reads one nobody defines gets the import added
+MODULE_ALIASES = {
+    "mo": "import marimo as mo",
+    "np": "import numpy as np",
+    "pd": "import pandas as pd",
+    "plt": "import matplotlib.pyplot as plt",
+    "alt": "import altair as alt",
+    "math": "import math",
+    "json": "import json",
+    "random": "import random",
+    "re": "import re",
+    "time": "import time",
+}
+
+# A whole completion wrapped in a Markdown code fence, or fenced blocks between prose
+_CODE_FENCE = re.compile(r"^\s*```[\w-]*\n(.*?)\n?```\s*$", re.DOTALL)
+_FENCED_BLOCK = re.compile(r"^```[\w-]*\n(.*?)\n?^```[ \t]*$", re.DOTALL | re.MULTILINE)
+# Marker lines of the "# /// script" wrapper older notebooks were generated with
+_SCRIPT_MARKERS = ("# /// script", "# ///")
+
+
+def strip_code_fences(content: str) -> str:
+    """Unwrap a completion the model put in Markdown code fences.
+
+    A reply that is one fenced block is unwrapped; fenced blocks between
+    prose are joined and the prose dropped. Anything else is returned as is.
+    """
+    match = _CODE_FENCE.match(content)
+    if match:
+        return match.group(1)
+    blocks = _FENCED_BLOCK.findall(content)
+    if blocks and any("@app.cell" in block for block in blocks):
+        return "\n\n".join(blocks)
+    return content
+
+
+def _is_marimo_import(node: ast.AST) -> bool:
+    return isinstance(node, ast.Import) and all(alias.name == "marimo" for alias in node.names)
+
+
+def _app_call(node: ast.AST) -> Optional[ast.Call]:
+    """The ``App(...)`` call of an ``app = marimo.App(...)`` line."""
+    if (
+        isinstance(node, ast.Assign)
+        and [getattr(target, "id", None) for target in node.targets] == ["app"]
+        and isinstance(node.value, ast.Call)
+        and isinstance(node.value.func, ast.Attribute)
+        and node.value.func.attr == "App"
+    ):
+        return node.value
+    return None
+
+
+def _is_structure(node: ast.AST) -> bool:
+    """The marimo import, ``__generated_with`` and ``if __name__ == "__main__"`` lines."""
+    if _is_marimo_import(node):
+        return True
+    if isinstance(node, ast.Assign):
+        return [getattr(target, "id", None) for target in node.targets] == ["__generated_with"]
+    if isinstance(node, ast.If) and isinstance(node.test, ast.Compare):
+        return isinstance(node.test.left, ast.Name) and node.test.left.id == "__name__"
+    return False
+
+
+def _dataflow_issues(
+    cells: List[Dict], provided: Set[str] = frozenset()
+) -> Tuple[Dict[int, Tuple[List[str], List[str]]], Set[str], List[str]]:
+    """Check the cells' parameters and returns against what they define and read.
+
+    ``provided`` names are about to be defined by a new cell. Returns
+    (the (parameters, returns) of each cell whose signature disagrees,
+    by cell index; module aliases to import; warnings).
+    """
+    definers: Dict[str, List[int]] = {name: [-1] for name in provided}
+    for cell in cells:
+        for name in cell["defines"]:
+            definers.setdefault(name, []).append(cell["index"])
+
+    signatures: Dict[int, Tuple[List[str], List[str]]] = {}
+    # The cells each cell reads from, by cell index
+    inputs: Dict[int, Set[int]] = {}
+    aliases: Set[str] = set()
+    warnings = []
+    for name, owners in definers.items():
+        if len(owners) > 1 and not name.startswith("_"):
+            names = ", ".join(cells[index]["name"] if index >= 0 else "imports" for index in owners)
+            warnings.append(f"{name} is defined by more than one cell: {names}")
+    for cell in cells:
+        own = set(cell["defines"])
+        parameters = set(cell["parameters"])
+        # references holds the names read from outside the cell, plus every parameter
+        for name in cell["references"]:
+            if name in definers or name in own:
+                continue
+            if name in MODULE_ALIASES:
+                aliases.add(name)
+            elif name not in BUILTIN_NAMES:
+                warnings.append(f"{cell['name']} reads {name}, which no cell defines")
+        # A cell takes the names other cells define as parameters and returns its public names
+        external = {
+            name for name in cell["references"]
+            if name not in own and (name in MODULE_ALIASES or any(i != cell["index"] for i in definers.get(name, ())))
+        }
+        public = {name for name in own if not name.startswith("_")}
+        if parameters != external or public != set(cell["returns"]):
+            signatures[cell["index"]] = (sorted(external), sorted(public))
+        inputs[cell["index"]] = {i for name in external for i in definers.get(name, ()) if i >= 0}
+    cycle = _find_cycle(inputs)
+    if cycle:
+        warnings.append(f"Cells form a cycle, which marimo will not run: {' -> '.join(cells[i]['name'] for i in cycle)}")
+    return signatures, aliases, warnings
+
+
+def _find_cycle(inputs: Dict[int, Set[int]]) -> Optional[List[int]]:
+    """A cycle in the cell graph as cell indexes, first repeated last, or None."""
+    done: Set[int] = set()
+    for start in inputs:
+        if start in done:
+            continue
+        # Depth-first walk; path holds the cells being visited and stack their unvisited inputs
+        path = [start]
+        stack = [iter(sorted(inputs[start]))]
+        while stack:
+            following = next(stack[-1], None)
+            if following is None:
+                stack.pop()
+                done.add(path.pop())
+            elif following in path:
+                return path[path.index(following):] + [following]
+            elif following not in done:
+                path.append(following)
+                stack.append(iter(sorted(inputs[following])))
+    return None
+
+
+def validate_notebook(content: str) -> Dict:
+    """Check a generated notebook and repair what can be repaired cheaply.
+
+    Steps: strip Markdown fences; parse with ast, cutting a reply that
+    stops mid-cell back to its last complete cell; drop code outside the
+    cells (top-level imports move into a new ``imports`` cell, as do the
+    imports for well-known module aliases that are read but never
+    defined); rewrite the parameters and return of each cell that
+    disagrees with the dataflow (see rewrite_signatures), leaving the other
+    cells untouched; and write the standard ``import marimo`` /
+    ``app = marimo.App()`` header and ``app.run()`` footer, keeping the
+    header comments and App options. The legacy ``# /// script`` wrapper
+    lines are dropped. The result must compile() to count as valid.
+
+    Returns ``notebook`` (None when it could not be made valid), ``valid``,
+    ``errors``, ``repairs`` (kinds of repair applied) and ``warnings``
+    (dataflow problems marimo will report in the cell itself).
+    """
+    errors: List[str] = []
+    repairs: List[str] = []
+    warnings: List[str] = []
+
+    def result(notebook: Optional[str]) -> Dict:
+        return {"notebook": notebook, "valid": notebook is not None, "errors": errors,
+                "repairs": repairs, "warnings": warnings}
+
+    source = strip_code_fences(content)
+    if source != content:
+        repairs.append("code_fence")
+    try:
+        tree = ast.parse(source)
+    except SyntaxError as error:
+        trimmed = trim_to_complete_cells(source)
+        if trimmed is None:
+            errors.append(f"Syntax error on line {error.lineno}: {error.msg}")
+            return result(None)
+        repairs.append("truncated_cell")
+        source = trimmed
+        tree = ast.parse(source)
+
+    lines = source.splitlines(keepends=True)
+    cells = [
+        node for node in tree.body
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)) and any(map(is_cell_decorator, node.decorator_list))
+    ]
+    if not cells:
+        errors.append("No @app.cell functions")
+        return result(None)
+
+    first_line = min(decorator.lineno for decorator in cells[0].decorator_list)
+    app_options = ""
+    moved: List[Tuple[str, str]] = []
+    dropped: Set[int] = set()
+    for node in tree.body:
+        if node in cells:
+            continue
+        call = _app_call(node)
+        if call is not None:
+            app_options = ", ".join(ast.unparse(argument) for argument in call.args + call.keywords)
+        elif isinstance(node, (ast.Import, ast.ImportFrom)) and not _is_structure(node):
+            moved.extend(import_statements(node))
+        elif not _is_structure(node) and "stray_code" not in repairs:
+            repairs.append("stray_code")
+        dropped.update(range(node.lineno, node.end_lineno + 1))
+    if moved:
+        repairs.append("top_level_import")
+
+    # Comments ahead of the first cell (such as the embedded diagram) stay in the header
+    comments = [
+        line.rstrip() for number, line in enumerate(lines[:first_line - 1], start=1)
+        if line.lstrip().startswith("#") and number not in dropped and line.strip() not in _SCRIPT_MARKERS
+    ]
+    body = "".join(
+        line for number, line in enumerate(lines[first_line - 1:], start=first_line)
+        if number not in dropped and line.strip() not in _SCRIPT_MARKERS
+    ).strip() + "\n"
+
+    cells = extract_cells(body)
+    defined = {name for cell in cells for name in cell["defines"]}
+    # A top-level import of a name some cell already defines is dropped, not duplicated
+    imports: Dict[str, str] = {}
+    for name, statement in moved:
+        if name not in defined:
+            imports.setdefault(name, statement)
+    signatures, aliases, found = _dataflow_issues(cells, set(imports))
+    if aliases:
+        repairs.append("missing_import")
+        imports.update((alias, MODULE_ALIASES[alias]) for alias in sorted(aliases))
+    if signatures:
+        repairs.append("cell_signature")
+        body = rewrite_signatures(body, signatures)
+    if imports:
+        imports_cell = "\n".join(
+            ["@app.cell", "def imports():"]
+            + [f"    {statement}" for statement in imports.values()]
+            + [f"    {return_statement(sorted(imports))}"]
+        )
+        body = f"{imports_cell}\n\n\n{body}"
+    if signatures or imports:
+        # Parameters that were dropped no longer count as reads
+        _, _, found = _dataflow_issues(extract_cells(body))
+    warnings.extend(found)
+
+    header = f"{NOTEBOOK_HEADER}\n\napp = marimo.App({app_options})\n"
+    if comments:
+        header += "\n" + "\n".join(comments) + "\n"
+    notebook = f"{header}\n\n{body.rstrip()}\n\n\n{NOTEBOOK_FOOTER}\n"
+    # ast.parse accepts some code that does not compile, such as a return outside a function
+    try:
+        compile(notebook, "notebook.py", "exec")
+    except SyntaxError as error:
+        errors.append(f"Repaired notebook does not compile, line {error.lineno}: {error.msg}")
+        return result(None)
+    return result(notebook)
+
+
+class NotebookValidator:
+    """validate_notebook with results cached by content digest."""
+
+    def __init__(self, max_entries: int = MAX_VALIDATIONS, max_bytes: int = MAX_VALIDATION_BYTES):
+        self.results = BoundedCache(max_entries=max_entries, max_bytes=max_bytes, ttl=VALIDATION_TTL)
+        self.counters = {"validated": 0, "repaired": 0, "invalid": 0}
+        self.repairs: Dict[str, int] = {}
+
+    def validate(self, content: str) -> Dict:
+        """Validate and repair ``content``; see validate_notebook."""
+        digest = content_digest(content)
+        cached = self.results.get(digest)
+        if cached is not None:
+            return cached["value"]
+        result = validate_notebook(content)
+        self.counters["validated"] += 1
+        if not result["valid"]:
+            self.counters["invalid"] += 1
+        elif result["repairs"]:
+            self.counters["repaired"] += 1
+            print(f"Repaired generated notebook: {', '.join(result['repairs'])}")
+        for kind in result["repairs"]:
+            self.repairs[kind] = self.repairs.get(kind, 0) + 1
+        self.results.put(digest, result, len(result["notebook"] or "") + len(digest))
+        return result
+
+    def stats(self) -> Dict:
+        """Validation counts, repairs by kind and the result cache hit ratio."""
+        cache = self.results.stats()
+        return {**self.counters, "repairs": dict(self.repairs), "cached": cache["entries"],
+                "hit_ratio": cache["hit_ratio"]}
@@ -0,0 +1,164 @@
+"""
+OpenAI Client Registry for Python Workers
+Per-credential AsyncOpenAI clients sharing one tuned HTTP connection pool
+"""
+
+import hashlib
+import time
+from typing import Any, Dict, Optional, Tuple
+
+import openai
+
+try:
+    import httpx
+except ImportError:  # without httpx the SDK manages its own HTTP client
+    httpx = None
+
+try:
+    import h2  # noqa: F401
+except ImportError:  # HTTP/2 needs the optional h2 package
+    h2 = None
+
+# Connection pool defaults; every connection may stay alive because all
+# traffic goes to one host in bursts
+MAX_CONNECTIONS = 64
+MAX_KEEPALIVE_CONNECTIONS = 64
+KEEPALIVE_EXPIRY = 30.0  # seconds an idle connection stays open
+
+# Timeout defaults (seconds); reads are long because completions are slow
+CONNECT_TIMEOUT = 5.0
+READ_TIMEOUT = 120.0
+WRITE_TIMEOUT = 30.0
+POOL_TIMEOUT = 10.0
+
+
+class ClientRegistry:
+    """AsyncOpenAI clients keyed by (API key, base URL) over one httpx pool.
+
+    Each distinct credential gets its own client, so a request is always
+    sent with the key it was made with, while every client shares one
+    ``httpx.AsyncClient`` and therefore one set of kept-alive connections.
+    HTTP/2 is used when ``http2`` is true, or by default when ``h2`` is
+    installed.
+
+    Connection reuse and pool wait are measured with httpcore trace
+    events: a request that sends headers without first opening a TCP
+    connection reused one, and the time from the request hook to the first
+    connection event is the time spent waiting for the pool.
+    """
+
+    def __init__(
+        self,
+        max_connections: int = MAX_CONNECTIONS,
+        max_keepalive_connections: int = MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry: float = KEEPALIVE_EXPIRY,
+        connect_timeout: float = CONNECT_TIMEOUT,
+        read_timeout: float = READ_TIMEOUT,
+        write_timeout: float = WRITE_TIMEOUT,
+        pool_timeout: float = POOL_TIMEOUT,
+        http2: Optional[bool] = None,
+    ):
+        """Store the pool settings; the HTTP client is created on first use."""
+        self.max_connections = max_connections
+        self.max_keepalive_connections = max_keepalive_connections
+        self.keepalive_expiry = keepalive_expiry
+        self.timeouts = (connect_timeout, read_timeout, write_timeout, pool_timeout)
+        self.http2 = h2 is not None if http2 is None else http2
+        self.http_client = None
+        self.clients: Dict[Tuple[str, Optional[str]], Any] = {}
+        self.metrics = {
+            "requests": 0,
+            "new_connections": 0,
+            "reused_connections": 0,
+            "pool_wait_total": 0.0,
+            "pool_wait_max": 0.0,
+        }
+
+    def get(self, api_key: str, base_url: Optional[str] = None):
+        """Get the client for a credential, creating it on first use."""
+        key = self._client_key(api_key, base_url)
+        client = self.clients.get(key)
+        if client is None:
+            client = openai.AsyncOpenAI(
+                api_key=api_key,
+                base_url=base_url,
+                http_client=self._get_http_client(),
+                # LLMScheduler owns retries and backoff
+                max_retries=0,
+            )
+            self.clients[key] = client
+        return client
+
+    def register(self, api_key: str, client: Any, base_url: Optional[str] = None) -> None:
+        """Use ``client`` for a credential, e.g. a fake in tests and benchmarks."""
+        self.clients[self._client_key(api_key, base_url)] = client
+
+    async def close(self) -> None:
+        """Close the shared connection pool and forget every client."""
+        self.clients.clear()
+        if self.http_client is not None:
+            await self.http_client.aclose()
+            self.http_client = None
+
+    def stats(self) -> Dict:
+        """Client count, connection reuse rate and pool wait times."""
+        metrics = self.metrics
+        connections = metrics["new_connections"] + metrics["reused_connections"]
+        return {
+            "clients": len(self.clients),
+            "http2": self.http2,
+            "requests": metrics["requests"],
+            "new_connections": metrics["new_connections"],
+            "reused_connections": metrics["reused_connections"],
+            "reuse_rate": metrics["reused_connections"] / connections if connections else 0.0,
+            "pool_wait_avg_ms": metrics["pool_wait_total"] / connections * 1000 if connections else 0.0,
+            "pool_wait_max_ms": metrics["pool_wait_max"] * 1000,
+        }
+
+    @staticmethod
+    def _client_key(api_key: str, base_url: Optional[str]) -> Tuple[str, Optional[str]]:
+        """Registry key; the API key is hashed so it is not kept as a dict key."""
+        return hashlib.sha256(api_key.encode("utf-8")).hexdigest(), base_url
+
+    def _get_http_client(self):
+        """Create the shared httpx client (None when httpx is unavailable)."""
+        if self.http_client is None and httpx is not None:
+            connect, read, write, pool = self.timeouts
+            self.http_client = httpx.AsyncClient(
+                limits=httpx.Limits(
+                    max_connections=self.max_connections,
+                    max_keepalive_connections=self.max_keepalive_connections,
+                    keepalive_expiry=self.keepalive_expiry,
+                ),
+                timeout=httpx.Timeout(connect=connect, read=read, write=write, pool=pool),
+                http2=self.http2,
+                event_hooks={"request": [self._trace_request]},
+            )
+        return self.http_client
+
+    async def _trace_request(self, request) -> None:
+        """Attach a trace callback that classifies the request's connection."""
+        self.metrics["requests"] += 1
+        started = time.perf_counter()
+        state = {"done": False}
+
+        async def trace(event_name: str, info: Dict) -> None:
+            if state["done"]:
+                return
+            if event_name.startswith("connection.connect_tcp."):
+                self._record_connection(started, reused=False)
+            elif event_name.endswith("send_request_headers.started"):
+                self._record_connection(started, reused=True)
+            else:
+                return
+            state["done"] = True
+
+        request.extensions["trace"] = trace
+
+    def _record_connection(self, started: float, reused: bool) -> None:
+        """Count a new or reused connection and the pool wait before it."""
+        metrics = self.metrics
+        metrics["reused_connections" if reused else "new_connections"] += 1
+        waited = time.perf_counter() - started
+        metrics["pool_wait_total"] += waited
+        metrics["pool_wait_max"] = max(metrics["pool_wait_max"], waited)
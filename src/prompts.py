@@ -0,0 +1,276 @@
+"""
+Prompt Registry for Python Workers
+Versioned notebook-generation prompts laid out for provider prompt caching
+"""
+
+from typing import Dict, List, Optional, Tuple
+
+# OpenAI caches prompt prefixes of at least this many tokens
+MIN_CACHED_PREFIX_TOKENS = 1024
+
+# Sent after a reply that hit max_tokens; the cut-off reply stays in the prefix
+CONTINUATION_PROMPT = (
+    "Your reply was cut off. Continue exactly where it stopped: do not repeat anything, "
+    "do not add Markdown fences or prose."
+)
+
+
+class PromptTemplate:
+    """A prompt whose leading messages never change between requests.
+
+    The system message and few-shot ``examples`` form a static prefix that
+    the provider can cache; everything request-specific goes into the
+    final user message, rendered from ``user`` with ``str.format``. Bump
+    ``version`` whenever the wording changes: it is part of the generation
+    cache key, so notebooks from an older prompt are not reused.
+    """
+
+    def __init__(self, name: str, version: int, system: str, examples: List[Tuple[str, str]], user: str):
+        self.name = name
+        self.version = version
+        self.system = system
+        self.examples = examples
+        self.user = user
+
+    @property
+    def id(self) -> str:
+        return f"{self.name}@{self.version}"
+
+    def prefix(self) -> List[Dict[str, str]]:
+        """The static messages shared by every request."""
+        messages = [{"role": "system", "content": self.system}]
+        for user, assistant in self.examples:
+            messages.append({"role": "user", "content": user})
+            messages.append({"role": "assistant", "content": assistant})
+        return messages
+
+    def messages(self, **variables: str) -> List[Dict[str, str]]:
+        """The full chat messages for one request."""
+        return self.prefix() + [{"role": "user", "content": self.user.format(**variables)}]
+
+
+def continuation_messages(partial: str) -> List[Dict[str, str]]:
+    """Messages appended to a request to continue a truncated reply."""
+    return [
+        {"role": "assistant", "content": partial},
+        {"role": "user", "content": CONTINUATION_PROMPT},
+    ]
+
+
+_REGISTRY: Dict[str, Dict[int, PromptTemplate]] = {}
+
+
+def register(template: PromptTemplate) -> PromptTemplate:
+    """Add a prompt version to the registry."""
+    versions = _REGISTRY.setdefault(template.name, {})
+    if template.version in versions:
+        raise ValueError(f"Prompt {template.id} is already registered")
+    versions[template.version] = template
+    return template
+
+
+def get_prompt(name: str, version: Optional[int] = None) -> PromptTemplate:
+    """A registered prompt; the latest version unless one is given."""
+    versions = _REGISTRY[name]
+    return versions[max(versions) if version is None else version]
+
+
+def prompt_versions() -> str:
+    """Ids of the latest version of every prompt, for cache keys."""
+    return ",".join(get_prompt(name).id for name in sorted(_REGISTRY))
+
+
+_NOTEBOOK_SYSTEM = """You are an expert Python developer specializing in Marimo notebooks.
+You turn a flowchart and a request into a complete, executable Marimo notebook.
+
+Output format:
+- Output only the Python source of @app.cell functions: no Markdown fences and no prose.
+- Do not write the "import marimo", "app = marimo.App()" or "if __name__" lines; they are added for you.
+- Write one cell per flowchart node, named node_<id> after the node id: node A becomes def node_A.
+- Each node cell assigns its result to value_<id> and ends with return (value_<id>,).
+- Import modules in one cell named imports that returns them, e.g. return (mo, pd).
+- A cell's parameters are exactly the names it reads from other cells: the value_<id> of the nodes
+  it uses and the modules it needs, in alphabetical order.
+- Prefix every other variable with an underscore so it stays local to its cell.
+- A UI element must be assigned to value_<id> and shown as the cell's last expression; read its
+  .value in the cells that follow it.
+
+Quality:
+1. The notebook must run top to bottom without edits; never leave placeholders or TODOs
+2. Follow Python best practices and keep each cell focused on its node
+3. Start each cell with a comment naming its node
+4. Handle missing or invalid input gracefully instead of raising
+5. Use mo.md for explanations and mo.ui elements wherever the flowchart asks for input
+6. Follow branches: a decision node computes a boolean and the branch cells check it
+"""
+
+_NOTEBOOK_USER = """Language: {language}
+
+Flowchart:
+{diagram}
+
+Request: {prompt}
+"""
+
+_EXAMPLES = [
+    (
+        _NOTEBOOK_USER.format(
+            language="python",
+            diagram="""flowchart TD
+    A[/Upload sales CSV/] --> B[Drop rows with missing totals]
+    B --> C[Total revenue by region]
+    C --> D[Show bar chart]""",
+            prompt="Analyze regional sales from an uploaded file",
+        ),
+        '''@app.cell
+def imports():
+    import io
+
+    import marimo as mo
+    import matplotlib.pyplot as plt
+    import pandas as pd
+    return (io, mo, pd, plt)
+
+
+@app.cell
+def node_A(mo):
+    # Upload sales CSV
+    value_A = mo.ui.file(filetypes=[".csv"], label="Sales CSV")
+    value_A
+    return (value_A,)
+
+
+@app.cell
+def node_B(io, pd, value_A):
+    # Drop rows with missing totals
+    if value_A.value:
+        _frame = pd.read_csv(io.BytesIO(value_A.contents()))
+    else:
+        _frame = pd.DataFrame({"region": [], "total": []})
+    value_B = _frame.dropna(subset=["total"])
+    return (value_B,)
+
+
+@app.cell
+def node_C(value_B):
+    # Total revenue by region
+    value_C = value_B.groupby("region", as_index=False)["total"].sum()
+    return (value_C,)
+
+
+@app.cell
+def node_D(mo, plt, value_C):
+    # Show bar chart
+    if value_C.empty:
+        value_D = mo.md("Upload a CSV with `region` and `total` columns to see the chart.")
+    else:
+        _figure, _axis = plt.subplots(figsize=(6, 3))
+        _axis.bar(value_C["region"], value_C["total"])
+        _axis.set_ylabel("Revenue")
+        value_D = _axis
+    value_D
+    return (value_D,)''',
+    ),
+    (
+        _NOTEBOOK_USER.format(
+            language="python",
+            diagram="""flowchart TD
+    S([Start]) --> I[/Enter loan amount, rate and term/]
+    I --> V{Amount positive?}
+    V -->|Yes| P[Compute monthly payment]
+    V -->|No| E[Show error]
+    P --> R[Display payment]""",
+            prompt="Loan payment calculator",
+        ),
+        '''@app.cell
+def imports():
+    import marimo as mo
+    return (mo,)
+
+
+@app.cell
+def node_S(mo):
+    # Start
+    value_S = mo.md("# Loan payment calculator")
+    value_S
+    return (value_S,)
+
+
+@app.cell
+def node_I(mo):
+    # Enter loan amount, rate and term
+    value_I = mo.ui.dictionary({
+        "amount": mo.ui.number(start=0, stop=10_000_000, value=10_000, label="Amount"),
+        "rate": mo.ui.number(start=0, stop=100, step=0.1, value=5, label="Annual rate (%)"),
+        "years": mo.ui.number(start=1, stop=50, value=5, label="Term (years)"),
+    })
+    value_I
+    return (value_I,)
+
+
+@app.cell
+def node_V(value_I):
+    # Amount positive?
+    value_V = (value_I.value["amount"] or 0) > 0
+    return (value_V,)
+
+
+@app.cell
+def node_P(value_I, value_V):
+    # Compute monthly payment
+    _amount = value_I.value["amount"]
+    _monthly_rate = value_I.value["rate"] / 1200
+    _months = value_I.value["years"] * 12
+    if not value_V:
+        value_P = None
+    elif _monthly_rate == 0:
+        value_P = _amount / _months
+    else:
+        value_P = _amount * _monthly_rate / (1 - (1 + _monthly_rate) ** -_months)
+    return (value_P,)
+
+
+@app.cell
+def node_E(mo, value_V):
+    # Show error
+    value_E = None if value_V else mo.callout(mo.md("Enter an amount above zero."), kind="danger")
+    value_E
+    return (value_E,)
+
+
+@app.cell
+def node_R(mo, value_P):
+    # Display payment
+    value_R = mo.md(f"**Monthly payment:** {value_P:,.2f}") if value_P is not None else mo.md("")
+    value_R
+    return (value_R,)''',
+    ),
+]
+
+NOTEBOOK_PROMPT = register(PromptTemplate(
+    name="notebook",
+    version=1,
+    system=_NOTEBOOK_SYSTEM,
+    examples=_EXAMPLES,
+    user=_NOTEBOOK_USER,
+))
+
+PART_PROMPT = register(PromptTemplate(
+    name="notebook_part",
+    version=1,
+    system=_NOTEBOOK_SYSTEM + """
+This request covers one part of a larger flowchart; the other parts are written separately.
+Write exactly the listed cells. Inputs from other parts arrive as parameters named value_<id>.
+""",
+    examples=_EXAMPLES,
+    user="""Language: {language}
+
+This part of the flowchart:
+{diagram}
+
+Cells to write:
+{cells}
+
+Request: {prompt}
+""",
+))
@@ -0,0 +1,181 @@
+"""
+Pyodide Bundle for Python Workers
+Serves a pinned, locally hosted Pyodide distribution with a precomputed lockfile
+"""
+
+import hashlib
+import json
+import mimetypes
+import os
+import sys
+from typing import Dict, Iterable, List, Optional, Tuple
+
+# URL prefix the Python worker serves the bundle from
+PYODIDE_ROUTE = "/api/marimo/pyodide/"
+
+# Lockfile written by scripts/build_pyodide_bundle.py
+LOCKFILE_NAME = "marimo-lock.json"
+
+# Packages the viewer loads up front in bundle mode
+DEFAULT_PACKAGES = ["marimo"]
+
+# Pyodide release the viewer boots from when no bundle is configured
+CDN_INDEX_URL = "https://cdn.jsdelivr.net/pyodide/v0.24.1/full/"
+
+# Packages the CDN release ships prebuilt; other imports go through micropip
+CDN_PACKAGES = frozenset({
+    "attrs", "beautifulsoup4", "bokeh", "cycler", "docutils", "fonttools",
+    "jinja2", "kiwisolver", "lxml", "lzma", "markupsafe", "matplotlib",
+    "micropip", "msgpack", "networkx", "nltk", "numpy", "opencv-python",
+    "openpyxl", "packaging", "pandas", "pillow", "pygments", "pyparsing",
+    "python-dateutil", "pytz", "pyyaml", "regex", "scikit-image",
+    "scikit-learn", "scipy", "shapely", "six", "sqlalchemy", "sqlite3",
+    "ssl", "statsmodels", "sympy", "xlrd",
+})
+
+# Import names that differ from the package providing them
+IMPORT_PACKAGES = {
+    "PIL": "pillow",
+    "bs4": "beautifulsoup4",
+    "cv2": "opencv-python",
+    "dateutil": "python-dateutil",
+    "mpl_toolkits": "matplotlib",
+    "skimage": "scikit-image",
+    "sklearn": "scikit-learn",
+    "yaml": "pyyaml",
+}
+
+# Standard library modules Pyodide splits out into their own packages
+UNVENDORED_STDLIB = frozenset({"lzma", "sqlite3", "ssl"})
+
+CONTENT_TYPES = {
+    ".js": "text/javascript; charset=utf-8",
+    ".mjs": "text/javascript; charset=utf-8",
+    ".wasm": "application/wasm",
+    ".json": "application/json",
+    ".zip": "application/zip",
+    ".whl": "application/zip",
+    ".tar": "application/x-tar",
+    ".so": "application/octet-stream",
+}
+
+
+def normalize_package_name(name: str) -> str:
+    """Normalize a distribution name the way lockfile keys are stored (PEP 503)."""
+    return "-".join(part for part in name.lower().replace("_", "-").replace(".", "-").split("-") if part)
+
+
+class PyodideBundle:
+    """A Pyodide distribution plus extra wheels in one local directory.
+
+    The directory stands in for a CDN: it holds pyodide.js, the WASM
+    runtime, the standard library, package wheels and a lockfile that
+    already pins every dependency, so the viewer never resolves packages
+    at runtime. URLs carry the Pyodide version and a hash of the lockfile,
+    so a rebuilt bundle gets new URLs and responses can be immutable.
+    """
+
+    def __init__(self, root: str, packages: Optional[List[str]] = None):
+        """Load the bundle's lockfile from ``root``."""
+        self.root = os.path.realpath(root)
+        with open(os.path.join(self.root, LOCKFILE_NAME), "rb") as lockfile:
+            lock_bytes = lockfile.read()
+        self.lock = json.loads(lock_bytes)
+        self.version = self.lock["info"]["version"]
+        self.build_id = hashlib.sha256(lock_bytes).hexdigest()[:12]
+        self.base_url = f"{PYODIDE_ROUTE}{self.version}-{self.build_id}/"
+        self.packages = {normalize_package_name(name): package for name, package in self.lock["packages"].items()}
+        self.import_packages = {
+            module: name for name, package in self.packages.items() for module in package.get("imports", [])
+        }
+
+        wanted = DEFAULT_PACKAGES if packages is None else packages
+        missing = [name for name in wanted if normalize_package_name(name) not in self.packages]
+        if missing:
+            raise ValueError(f"Pyodide bundle at {self.root} has no lockfile entry for: {', '.join(missing)}")
+        self.preload = [normalize_package_name(name) for name in wanted]
+
+    def runtime_config(self, packages: Optional[List[str]] = None, micropip: Optional[List[str]] = None) -> Dict:
+        """Viewer runtime settings: where to boot Pyodide from and what to load."""
+        return {
+            "indexURL": self.base_url,
+            "lockFileURL": self.base_url + LOCKFILE_NAME,
+            "packages": self.preload if packages is None else packages,
+            "micropip": micropip or [],
+        }
+
+    def has_package(self, name: str) -> bool:
+        """Check whether the lockfile provides a package."""
+        return normalize_package_name(name) in self.packages
+
+    def package_for_import(self, module: str) -> Optional[str]:
+        """Lockfile package that provides an importable top-level module."""
+        return self.import_packages.get(module)
+
+    def resolve(self, path: str) -> Optional[str]:
+        """Map a request path under PYODIDE_ROUTE to a file inside the bundle."""
+        if not path.startswith(self.base_url):
+            return None
+        relative = path[len(self.base_url):]
+        candidate = os.path.realpath(os.path.join(self.root, relative))
+        if not candidate.startswith(self.root + os.sep) or not os.path.isfile(candidate):
+            return None
+        return candidate
+
+    def read(self, path: str) -> Optional[Tuple[bytes, str]]:
+        """Read a bundle file as (body, content type)."""
+        file_path = self.resolve(path)
+        if file_path is None:
+            return None
+        extension = os.path.splitext(file_path)[1]
+        content_type = CONTENT_TYPES.get(extension) or mimetypes.guess_type(file_path)[0] or "application/octet-stream"
+        with open(file_path, "rb") as bundle_file:
+            return bundle_file.read(), content_type
+
+    def etag(self, path: str) -> str:
+        """ETag for a bundle file; the build ID in its URL pins its content."""
+        return f'"{self.build_id}-{path[len(self.base_url):]}"'
+
+
+def load_bundle(root: Optional[str]) -> Optional[PyodideBundle]:
+    """Load a bundle from a configured directory (``None`` keeps CDN mode)."""
+    if not root:
+        return None
+    return PyodideBundle(root)
+
+
+def viewer_runtime(imports: Iterable[str], bundle: Optional[PyodideBundle] = None) -> Dict:
+    """Viewer runtime settings that load exactly the packages a notebook imports.
+
+    Imports Pyodide provides become one ``loadPackage`` list, which Pyodide
+    fetches in parallel along with their dependencies; anything else is
+    left to micropip, which the viewer only loads when that list is
+    non-empty. Standard library imports need nothing. micropip needs the
+    network, so a notebook importing something the bundle lacks boots
+    from the CDN instead of the bundle.
+    """
+    imports = list(imports)
+    packages = set()
+    micropip = set()
+    for module in imports:
+        provided = bundle.package_for_import(module) if bundle else None
+        if provided:
+            packages.add(provided)
+            continue
+        if module in sys.stdlib_module_names and module not in UNVENDORED_STDLIB:
+            continue
+        package = normalize_package_name(IMPORT_PACKAGES.get(module, module))
+        available = bundle.has_package(package) if bundle else package in CDN_PACKAGES
+        (packages if available else micropip).add(package)
+
+    if bundle:
+        if not micropip:
+            return bundle.runtime_config(sorted(packages), [])
+        print(f"Pyodide bundle has no {', '.join(sorted(micropip))}; the viewer loads from the CDN")
+        return viewer_runtime(imports)
+    return {
+        "indexURL": CDN_INDEX_URL,
+        "lockFileURL": None,
+        "packages": sorted(packages),
+        "micropip": sorted(micropip),
+    }
@@ -0,0 +1,51 @@
+"""
+Single Flight for Python Workers
+Coalesces concurrent identical async calls into one shared call
+"""
+
+import asyncio
+from typing import Any, Awaitable, Callable, Dict
+
+
+class SingleFlight:
+    """Run at most one call per key at a time; concurrent callers share it.
+
+    The first caller for a key (the leader) starts the call as a task and
+    every caller, the leader included, awaits it through ``asyncio.shield``.
+    Cancelling one waiter therefore never cancels the shared call, and the
+    other waiters still get its result (or its exception). The key is
+    released as soon as the call finishes, so later callers start afresh.
+    """
+
+    def __init__(self):
+        """Initialize with no calls in flight."""
+        self.in_flight: Dict[str, asyncio.Task] = {}
+        self.leaders = 0
+        self.coalesced = 0
+
+    async def run(self, key: str, call: Callable[[], Awaitable[Any]]) -> Any:
+        """Await ``call()`` for ``key``, joining an identical call already in flight."""
+        task = self.in_flight.get(key)
+        if task is None:
+            self.leaders += 1
+            task = asyncio.ensure_future(call())
+            self.in_flight[key] = task
+            task.add_done_callback(lambda _: self._release(key, task))
+        else:
+            self.coalesced += 1
+        return await asyncio.shield(task)
+
+    def _release(self, key: str, task: asyncio.Task) -> None:
+        """Forget a finished call, consuming an exception nobody awaited."""
+        if self.in_flight.get(key) is task:
+            del self.in_flight[key]
+        if not task.cancelled():
+            task.exception()
+
+    def stats(self) -> Dict:
+        """Calls started and calls that joined one already in flight."""
+        return {
+            "in_flight": len(self.in_flight),
+            "leaders": self.leaders,
+            "coalesced": self.coalesced,
+        }
@@ -0,0 +1,147 @@
+"""
+Token Budget for Python Workers
+Prompt token counting, completion budgets and diagram compaction
+"""
+
+import ast
+import re
+from typing import Dict, List, Optional
+
+from mermaid_parser import parse_flowchart, render_flowchart
+
+try:
+    import tiktoken
+except ImportError:  # without tiktoken tokens are estimated at ~4 characters each
+    tiktoken = None
+
+# gpt-4.1 limits
+CONTEXT_WINDOW = 1_047_576
+MAX_OUTPUT_TOKENS = 32_768
+
+# Completion budget: a fixed allowance plus a share per diagram node
+BASE_COMPLETION_TOKENS = 800
+TOKENS_PER_NODE = 150
+MIN_COMPLETION_TOKENS = 2000
+MAX_COMPLETION_TOKENS = 8000
+
+# Diagrams above this are compacted before they are sent
+MAX_DIAGRAM_TOKENS = 3000
+# Label length kept when compacting still leaves a diagram too large
+COMPACT_LABEL_CHARS = 40
+
+# Chat formatting overhead per message and per request (OpenAI cookbook figures)
+TOKENS_PER_MESSAGE = 3
+TOKENS_PER_REQUEST = 3
+
+# Mermaid statements that only affect rendering
+_PRESENTATION = re.compile(r"^\s*(?:%%|style\b|classDef\b|class\b|linkStyle\b|click\b)")
+
+_encoding = None
+_encoding_loaded = False
+
+
+def _get_encoding():
+    """The o200k_base encoding used by gpt-4.1, or None if unavailable."""
+    global _encoding, _encoding_loaded
+    if not _encoding_loaded:
+        _encoding_loaded = True
+        if tiktoken is not None:
+            try:
+                _encoding = tiktoken.get_encoding("o200k_base")
+            except Exception as e:
+                # The encoding file is downloaded on first use, which can fail offline
+                print(f"tiktoken encoding unavailable, estimating tokens: {e}")
+    return _encoding
+
+
+def count_tokens(text: str) -> int:
+    """Tokens in ``text``; estimated from its length without tiktoken."""
+    encoding = _get_encoding()
+    if encoding is None:
+        return (len(text) + 3) // 4
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def count_message_tokens(messages: List[Dict[str, str]]) -> int:
+    """Prompt tokens for a list of chat messages."""
+    return TOKENS_PER_REQUEST + sum(TOKENS_PER_MESSAGE + count_tokens(m["content"]) for m in messages)
+
+
+def diagram_nodes(diagram: str) -> int:
+    """Flowchart node count, or the number of statements for other diagrams."""
+    try:
+        return len(parse_flowchart(diagram)["nodes"])
+    except ValueError:
+        return sum(1 for line in diagram.splitlines() if line.strip() and not _PRESENTATION.match(line))
+
+
+def completion_budget(nodes: int) -> int:
+    """``max_tokens`` for a notebook covering ``nodes`` diagram nodes."""
+    budget = BASE_COMPLETION_TOKENS + TOKENS_PER_NODE * nodes
+    return max(MIN_COMPLETION_TOKENS, min(MAX_COMPLETION_TOKENS, budget))
+
+
+def fit_completion_budget(prompt_tokens: int, budget: int) -> int:
+    """Shrink ``budget`` so prompt and completion fit the context window.
+
+    Raises ValueError when the prompt alone does not fit.
+    """
+    available = min(MAX_OUTPUT_TOKENS, CONTEXT_WINDOW - prompt_tokens)
+    if available < MIN_COMPLETION_TOKENS:
+        raise ValueError(f"Prompt of {prompt_tokens} tokens leaves no room for a notebook")
+    return min(budget, available)
+
+
+def compact_diagram(diagram: str, max_tokens: int = MAX_DIAGRAM_TOKENS) -> str:
+    """Shrink a diagram that is over ``max_tokens`` while keeping its structure.
+
+    Steps stop as soon as the diagram fits: drop comments, styling and
+    indentation; for flowcharts, re-render with every label written once
+    and no padding; then shorten labels; then drop edge labels. A diagram
+    that still does not fit is returned in its smallest form.
+    """
+    if count_tokens(diagram) <= max_tokens:
+        return diagram
+    compacted = "\n".join(
+        line.strip() for line in diagram.splitlines() if line.strip() and not _PRESENTATION.match(line)
+    )
+    if count_tokens(compacted) <= max_tokens:
+        return compacted
+    try:
+        graph = parse_flowchart(compacted)
+    except ValueError:
+        return compacted
+    for label_chars, edge_labels in ((None, True), (COMPACT_LABEL_CHARS, True), (COMPACT_LABEL_CHARS, False)):
+        compacted = render_flowchart(graph, indent="", label_chars=label_chars, edge_labels=edge_labels)
+        if count_tokens(compacted) <= max_tokens:
+            break
+    return compacted
+
+
+def continuation_overlap(text: str, continuation: str, window: int = 200, min_overlap: int = 8) -> int:
+    """Length of the start of ``continuation`` that repeats the end of ``text``.
+
+    Overlaps shorter than ``min_overlap`` are treated as coincidence.
+    """
+    for size in range(min(window, len(text), len(continuation)), min_overlap - 1, -1):
+        if text.endswith(continuation[:size]):
+            return size
+    return 0
+
+
+def trim_to_complete_cells(source: str) -> Optional[str]:
+    """Cut truncated notebook source back to its last complete ``@app.cell``.
+
+    Returns None when no prefix ending at a cell boundary parses.
+    """
+    starts = [match.start() for match in re.finditer(r"^@app\.cell\b", source, re.MULTILINE)]
+    for end in reversed(starts):
+        candidate = source[:end].rstrip()
+        if not candidate:
+            break
+        try:
+            ast.parse(candidate)
+        except SyntaxError:
+            continue
+        return candidate
+    return None
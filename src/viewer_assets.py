@@ -0,0 +1,702 @@
+"""
+Viewer Assets for Python Workers
+CSS and JavaScript for the notebook viewers, served under content-hashed names
+"""
+
+import gzip
+import hashlib
+from typing import Dict, Optional
+
+# URL prefix the Python worker serves assets from
+ASSET_ROUTE = "/api/marimo/assets/"
+
+CONTENT_TYPES = {
+    "css": "text/css; charset=utf-8",
+    "js": "text/javascript; charset=utf-8",
+}
+
+CLASSIC_VIEWER_CSS = r"""* { margin: 0; padding: 0; box-sizing: border-box; }
+body { 
+    font-family: -apple-system, BlinkMacSystemFont, 'Segoe UI', Roboto, sans-serif; 
+    background: #1a1b26; 
+    color: #a9b1d6; 
+    line-height: 1.6; 
+}
+.header { 
+    background: linear-gradient(135deg, #7aa2f7 0%, #bb9af7 100%); 
+    color: white; 
+    padding: 20px; 
+    text-align: center; 
+    border-radius: 0 0 15px 15px; 
+    margin-bottom: 20px; 
+}
+.notebook-container { 
+    max-width: 1200px; 
+    margin: 0 auto; 
+    padding: 0 20px; 
+}
+.cell { 
+    background: #24283b; 
+    border: 1px solid #414868; 
+    border-radius: 12px; 
+    margin: 20px 0; 
+    overflow: hidden; 
+    box-shadow: 0 4px 12px rgba(0,0,0,0.3); 
+}
+.cell-header { 
+    background: linear-gradient(135deg, #1a1b26 0%, #24283b 100%); 
+    padding: 15px 20px; 
+    border-bottom: 1px solid #414868; 
+    display: flex; 
+    justify-content: space-between; 
+    align-items: center; 
+}
+.cell-title { 
+    font-weight: 600; 
+    color: #7aa2f7; 
+    font-size: 1.1rem; 
+}
+.run-button { 
+    background: linear-gradient(135deg, #7aa2f7 0%, #bb9af7 100%); 
+    color: white; 
+    border: none; 
+    padding: 10px 20px; 
+    border-radius: 8px; 
+    cursor: pointer; 
+    font-size: 0.9rem; 
+    font-weight: 500; 
+    transition: all 0.3s ease; 
+}
+.run-button:hover { 
+    transform: translateY(-1px); 
+    box-shadow: 0 4px 12px rgba(122, 162, 247, 0.4); 
+}
+.run-button:disabled { 
+    background: #565a6e; 
+    cursor: not-allowed; 
+    transform: none; 
+}
+.cell-code { 
+    padding: 20px; 
+    background: #1a1b26; 
+    font-family: 'Monaco', 'Menlo', 'Ubuntu Mono', 'Consolas', monospace; 
+    font-size: 14px; 
+    line-height: 1.6; 
+    white-space: pre-wrap; 
+    overflow-x: auto; 
+    border-bottom: 1px solid #414868; 
+    color: #a9b1d6; 
+}
+.cell-output { 
+    padding: 20px; 
+    background: #24283b; 
+    min-height: 60px; 
+    border-radius: 0 0 12px 12px; 
+}
+.loading { 
+    color: #bb9af7; 
+    font-style: italic; 
+    text-align: center; 
+    padding: 20px; 
+}
+.error { 
+    color: #f7768e; 
+    background: rgba(247, 118, 142, 0.1); 
+    padding: 15px; 
+    border-radius: 8px; 
+    border: 1px solid #f7768e; 
+    margin: 10px 0; 
+}
+.success { 
+    color: #9ece6a; 
+    background: rgba(158, 206, 106, 0.1); 
+    padding: 15px; 
+    border-radius: 8px; 
+    border: 1px solid #9ece6a; 
+    margin: 10px 0; 
+}
+.output-content { 
+    background: #1a1b26; 
+    padding: 15px; 
+    border-radius: 8px; 
+    border: 1px solid #414868; 
+    font-family: monospace; 
+    white-space: pre-wrap; 
+    overflow-x: auto; 
+}
+.status-bar { 
+    background: #24283b; 
+    border: 1px solid #414868; 
+    border-radius: 8px; 
+    padding: 15px; 
+    margin: 20px 0; 
+    text-align: center; 
+    color: #565a6e; 
+}
+.progress-indicator { 
+    display: inline-block; 
+    width: 20px; 
+    height: 20px; 
+    border: 3px solid #414868; 
+    border-top: 3px solid #7aa2f7; 
+    border-radius: 50%; 
+    animation: spin 1s linear infinite; 
+    margin-right: 10px; 
+}
+@keyframes spin { 
+    0% { transform: rotate(0deg); } 
+    100% { transform: rotate(360deg); } 
+}
+.cell-status { 
+    display: flex; 
+    align-items: center; 
+    justify-content: center; 
+    gap: 10px; 
+}
+.status-success { color: #9ece6a; }
+.status-error { color: #f7768e; }
+.status-pending { color: #e0af68; }
+.marimo-info { 
+    background: rgba(122, 162, 247, 0.1); 
+    border: 1px solid #7aa2f7; 
+    border-radius: 8px; 
+    padding: 15px; 
+    margin: 20px 0; 
+    text-align: center; 
+}
+"""
+
+CLASSIC_VIEWER_JS = r"""let cells = [];
+
+// Fetch the server-side cell manifest (parsed once per notebook with ast)
+async function loadCells(serverId) {
+    const response = await fetch('/api/marimo/notebook/' + encodeURIComponent(serverId) + '/cells');
+    if (!response.ok) {
+        throw new Error('Failed to load cell manifest: ' + response.status);
+    }
+    const manifest = await response.json();
+    if (manifest.error) {
+        throw new Error('Line ' + manifest.error.line + ': ' + manifest.error.message);
+    }
+    return manifest.cells.map(cell => ({
+        id: `cell_${cell.index}`,
+        name: cell.name,
+        code: cell.source,
+        output: '',
+        isRunning: false,
+        hasError: false,
+        status: 'pending'
+    }));
+}
+
+// Render cells
+function renderCells() {
+    const container = document.getElementById('notebook');
+    container.innerHTML = '';
+
+    cells.forEach((cell, index) => {
+        const cellElement = document.createElement('div');
+        cellElement.className = 'cell';
+        cellElement.innerHTML = `
+            <div class="cell-header">
+                <div class="cell-title">Cell ${index + 1}</div>
+                <div class="cell-status">
+                    <span class="status-${cell.status}">${getStatusText(cell.status)}</span>
+                    <button class="run-button" onclick="runCell(${index})" ${cell.isRunning ? 'disabled' : ''}>
+                        ${cell.isRunning ? 'Running...' : 'Run Cell'}
+                    </button>
+                </div>
+            </div>
+            <div class="cell-code">${escapeHtml(cell.code)}</div>
+            <div class="cell-output" id="output-${index}">
+                ${cell.output || 'Click "Run Cell" to execute this code'}
+            </div>
+        `;
+        container.appendChild(cellElement);
+    });
+
+    // Add status bar
+    const statusBar = document.createElement('div');
+    statusBar.className = 'status-bar';
+    statusBar.innerHTML = `
+        <strong>Real Marimo Notebook Status:</strong> ${cells.length} cells ready • 
+        ${cells.filter(c => c.status === 'success').length} executed • 
+        ${cells.filter(c => c.status === 'error').length} errors
+    `;
+    container.appendChild(statusBar);
+}
+
+function escapeHtml(text) {
+    const element = document.createElement('div');
+    element.textContent = text;
+    return element.innerHTML;
+}
+
+function getStatusText(status) {
+    switch(status) {
+        case 'pending': return '⏳ Pending';
+        case 'running': return '🔄 Running';
+        case 'success': return '✅ Success';
+        case 'error': return '❌ Error';
+        default: return '⏳ Pending';
+    }
+}
+
+// Run a cell (this would connect to the real Marimo backend)
+async function runCell(index) {
+    const cell = cells[index];
+    if (cell.isRunning) return;
+
+    cell.isRunning = true;
+    cell.status = 'running';
+    const outputElement = document.getElementById(`output-${index}`);
+    outputElement.innerHTML = '<div class="loading"><div class="progress-indicator"></div>Executing cell with real Marimo...</div>';
+
+    try {
+        // In a real implementation, this would call the Marimo backend
+        // For now, we'll simulate the execution
+        await new Promise(resolve => setTimeout(resolve, 1000));
+
+        // Simulate success
+        cell.output = 'Cell executed successfully with real Marimo! (Simulated for demo)';
+        cell.status = 'success';
+        outputElement.innerHTML = `
+            <div class="success">✅ Cell executed successfully!</div>
+            <div class="output-content">${cell.output}</div>
+        `;
+    } catch (error) {
+        cell.output = `Error: ${error.message}`;
+        cell.status = 'error';
+        outputElement.innerHTML = `
+            <div class="error">❌ Execution failed</div>
+            <div class="output-content">${cell.output}</div>
+        `;
+    } finally {
+        cell.isRunning = false;
+        renderCells();
+    }
+}
+
+// Initialize notebook
+async function initNotebook() {
+    try {
+        // Load and render the notebook cells
+        const data = JSON.parse(document.getElementById('notebook-data').textContent);
+        cells = await loadCells(data.serverId);
+        renderCells();
+
+    } catch (error) {
+        document.getElementById('notebook').innerHTML = `
+            <div class="error">
+                ❌ Failed to initialize notebook: ${error.message}
+                <br><br>
+                <small>This is a real Marimo notebook, but there was an error parsing it.</small>
+            </div>
+        `;
+    }
+}
+
+// Start loading when page loads
+window.addEventListener('load', initNotebook);
+"""
+
+WASM_VIEWER_CSS = r"""* { margin: 0; padding: 0; box-sizing: border-box; }
+body { 
+    font-family: -apple-system, BlinkMacSystemFont, 'Segoe UI', Roboto, sans-serif;
+    background: #1a1a1a;
+    color: #ffffff;
+    overflow: hidden;
+}
+.loading-container {
+    position: fixed;
+    top: 0;
+    left: 0;
+    width: 100%;
+    height: 100%;
+    display: flex;
+    align-items: center;
+    justify-content: center;
+    background: #1a1a1a;
+    z-index: 1000;
+}
+.loading-content {
+    text-align: center;
+    max-width: 500px;
+    padding: 2rem;
+}
+.spinner {
+    width: 50px;
+    height: 50px;
+    border: 4px solid #333;
+    border-top: 4px solid #FFD600;
+    border-radius: 50%;
+    animation: spin 1s linear infinite;
+    margin: 0 auto 1rem;
+}
+@keyframes spin {
+    0% { transform: rotate(0deg); }
+    100% { transform: rotate(360deg); }
+}
+.loading-title {
+    font-size: 1.5rem;
+    font-weight: bold;
+    margin-bottom: 0.5rem;
+    color: #FFD600;
+}
+.loading-subtitle {
+    color: #ccc;
+    margin-bottom: 1rem;
+}
+.progress-bar {
+    width: 100%;
+    height: 4px;
+    background: #333;
+    border-radius: 2px;
+    overflow: hidden;
+    margin-bottom: 1rem;
+}
+.progress-fill {
+    height: 100%;
+    background: linear-gradient(90deg, #FFD600, #FFA500);
+    width: 0%;
+    transition: width 0.3s ease;
+}
+.marimo-container {
+    width: 100vw;
+    height: 100vh;
+    display: none;
+}
+.marimo-iframe {
+    width: 100%;
+    height: 100%;
+    border: none;
+}
+.error-container {
+    position: fixed;
+    top: 50%;
+    left: 50%;
+    transform: translate(-50%, -50%);
+    background: #dc3545;
+    color: white;
+    padding: 2rem;
+    border-radius: 8px;
+    max-width: 500px;
+    text-align: center;
+    display: none;
+}
+.error-title {
+    font-size: 1.2rem;
+    font-weight: bold;
+    margin-bottom: 1rem;
+}
+.fallback-link {
+    color: #FFD600;
+    text-decoration: none;
+    margin-top: 1rem;
+    display: inline-block;
+}
+"""
+
+WASM_VIEWER_JS = r"""// Progress simulation
+let progress = 0;
+const progressBar = document.getElementById('progress');
+const statusElement = document.getElementById('status');
+
+const steps = [
+    { progress: 20, message: "Loading Marimo WASM runtime..." },
+    { progress: 40, message: "Parsing notebook structure..." },
+    { progress: 60, message: "Initializing Python environment..." },
+    { progress: 80, message: "Setting up interactive cells..." },
+    { progress: 95, message: "Almost ready..." }
+];
+
+let stepIndex = 0;
+const progressInterval = setInterval(() => {
+    if (stepIndex < steps.length) {
+        const step = steps[stepIndex];
+        progress = step.progress;
+        progressBar.style.width = progress + '%';
+        statusElement.textContent = step.message;
+        stepIndex++;
+    } else {
+        clearInterval(progressInterval);
+        initializeMarimo();
+    }
+}, 800);
+
+async function initializeMarimo() {
+    try {
+        // Cells are parsed on the server; the runtime page only renders them
+        const data = JSON.parse(document.getElementById('notebook-data').textContent);
+        const response = await fetch('/api/marimo/notebook/' + encodeURIComponent(data.serverId) + '/cells');
+        if (!response.ok) {
+            throw new Error('Failed to load cell manifest: ' + response.status);
+        }
+        window.marimoManifest = await response.json();
+        if (data.runtime) {
+            // Absolute URLs: the runtime page is a blob: document
+            window.marimoRuntime = {
+                ...data.runtime,
+                indexURL: new URL(data.runtime.indexURL, location.origin).href,
+                lockFileURL: data.runtime.lockFileURL && new URL(data.runtime.lockFileURL, location.origin).href
+            };
+        }
+        if (window.marimoManifest.error) {
+            throw new Error('Notebook has a syntax error on line ' + window.marimoManifest.error.line);
+        }
+
+        // Create an HTML document that runs the notebook with Pyodide
+        const marimoHTML = createMarimoHTML();
+
+        // Create a blob URL for the Marimo HTML
+        const blob = new Blob([marimoHTML], { type: 'text/html' });
+        const url = URL.createObjectURL(blob);
+
+        // Load it in the iframe
+        const iframe = document.getElementById('marimo-iframe');
+        iframe.src = url;
+
+        // Wait for iframe to load
+        iframe.onload = () => {
+            progressBar.style.width = '100%';
+            statusElement.textContent = "Ready! 🎉";
+
+            setTimeout(() => {
+                document.getElementById('loading').style.display = 'none';
+                document.getElementById('marimo-container').style.display = 'block';
+            }, 500);
+        };
+
+        iframe.onerror = () => {
+            throw new Error('Failed to load interactive notebook');
+        };
+
+    } catch (error) {
+        console.error('Marimo initialization error:', error);
+        showError(error.message);
+    }
+}
+
+function createMarimoHTML() {
+    // The runtime page reads the cell manifest from this window
+    // A blob: document has no base URL, so point asset URLs back at this origin
+    const runtime = document.getElementById('marimo-runtime').innerHTML;
+    return '<!DOCTYPE html><html><head><meta charset="UTF-8"><title>Marimo Notebook</title>'
+        + '<base href="' + location.origin + '/"></head><body>'
+        + runtime + '</body></html>';
+}
+
+function showError(message) {
+    document.getElementById('loading').style.display = 'none';
+    document.getElementById('error').style.display = 'block';
+    document.getElementById('error-message').textContent = message;
+
+    const data = JSON.parse(document.getElementById('notebook-data').textContent);
+    const blob = new Blob([data.notebook], { type: 'text/plain' });
+    document.getElementById('download-link').href = URL.createObjectURL(blob);
+}
+
+// Cleanup blob URL when page unloads
+window.addEventListener('beforeunload', () => {
+    const iframe = document.getElementById('marimo-iframe');
+    if (iframe.src && iframe.src.startsWith('blob:')) {
+        URL.revokeObjectURL(iframe.src);
+    }
+});
+"""
+
+WASM_RUNTIME_CSS = r"""body { 
+    font-family: -apple-system, BlinkMacSystemFont, 'Segoe UI', Roboto, sans-serif;
+    margin: 0; 
+    padding: 20px; 
+    background: #1a1a1a; 
+    color: #fff; 
+}
+.cell { 
+    background: #2d2d2d; 
+    border: 1px solid #444; 
+    border-radius: 8px; 
+    margin: 10px 0; 
+    padding: 15px; 
+}
+.cell-header { 
+    font-weight: bold; 
+    color: #FFD600; 
+    margin-bottom: 10px; 
+    font-size: 0.9rem;
+}
+.cell-content { 
+    background: #1a1a1a; 
+    border-radius: 4px; 
+    padding: 10px; 
+    font-family: 'Courier New', monospace; 
+    font-size: 0.9rem;
+    white-space: pre-wrap;
+    overflow-x: auto;
+}
+.cell-output { 
+    background: #0a0a0a; 
+    border-radius: 4px; 
+    padding: 10px; 
+    margin-top: 10px; 
+    border-left: 3px solid #28a745;
+}
+.run-button { 
+    background: #28a745; 
+    color: white; 
+    border: none; 
+    padding: 5px 10px; 
+    border-radius: 4px; 
+    cursor: pointer; 
+    font-size: 0.8rem;
+    margin-top: 10px;
+}
+.run-button:hover { background: #218838; }
+.run-button:disabled { background: #6c757d; cursor: not-allowed; }
+.error { color: #dc3545; }
+.status { color: #6c757d; font-size: 0.8rem; margin-top: 5px; }
+"""
+
+WASM_RUNTIME_JS = r"""let pyodide = null;
+let cells = [];
+
+// Set by the parent viewer from the notebook's imports
+const runtimeConfig = parent.marimoRuntime || {
+    indexURL: 'https://cdn.jsdelivr.net/pyodide/v0.24.1/full/',
+    lockFileURL: null,
+    packages: [],
+    micropip: ['marimo']
+};
+
+function loadScript(src) {
+    return new Promise((resolve, reject) => {
+        const script = document.createElement('script');
+        script.src = src;
+        script.onload = resolve;
+        script.onerror = () => reject(new Error('Failed to load ' + src));
+        document.head.appendChild(script);
+    });
+}
+
+async function initPyodide() {
+    try {
+        await loadScript(runtimeConfig.indexURL + 'pyodide.js');
+
+        // In bundle mode the lockfile pins every package, nothing is resolved here
+        pyodide = await loadPyodide(runtimeConfig.lockFileURL ? {
+            indexURL: runtimeConfig.indexURL,
+            lockFileURL: runtimeConfig.lockFileURL
+        } : { indexURL: runtimeConfig.indexURL });
+
+        // One call, so Pyodide fetches every package and dependency in parallel
+        if (runtimeConfig.packages.length) {
+            await pyodide.loadPackage(runtimeConfig.packages);
+        }
+
+        // Only imports Pyodide does not ship need micropip
+        if (runtimeConfig.micropip.length) {
+            document.getElementById('loading').innerHTML =
+                'Installing ' + escapeHtml(runtimeConfig.micropip.join(', ')) + '...';
+            await pyodide.loadPackage(['micropip']);
+            await pyodide.pyimport('micropip').install(runtimeConfig.micropip);
+        }
+
+        parseCells();
+        renderNotebook();
+    } catch (error) {
+        document.getElementById('loading').innerHTML = 
+            '<div class="error">Failed to initialize Python: ' + error.message + '</div>';
+    }
+}
+
+function parseCells() {
+    // The parent page fetched the server-side cell manifest
+    cells = parent.marimoManifest.cells.map(cell => ({
+        type: 'cell', name: cell.name, content: cell.source, output: ''
+    }));
+}
+
+function escapeHtml(text) {
+    const element = document.createElement('div');
+    element.textContent = text;
+    return element.innerHTML;
+}
+
+function renderNotebook() {
+    const notebook = document.getElementById('notebook');
+    notebook.innerHTML = '<h1>🚀 Interactive Marimo Notebook</h1>';
+
+    cells.forEach((cell, index) => {
+        const cellDiv = document.createElement('div');
+        cellDiv.className = 'cell';
+        cellDiv.innerHTML = `
+            <div class="cell-header">Cell ${index + 1} · ${escapeHtml(cell.name)}</div>
+            <div class="cell-content">${escapeHtml(cell.content)}</div>
+            <button class="run-button" onclick="runCell(${index})">▶ Run</button>
+            <div class="status" id="status-${index}"></div>
+            <div class="cell-output" id="output-${index}" style="display: none;"></div>
+        `;
+        notebook.appendChild(cellDiv);
+    });
+}
+
+async function runCell(index) {
+    const statusEl = document.getElementById('status-' + index);
+    const outputEl = document.getElementById('output-' + index);
+    const button = event.target;
+
+    button.disabled = true;
+    statusEl.textContent = 'Running...';
+    outputEl.style.display = 'none';
+
+    try {
+        const result = await pyodide.runPython(cells[index].content);
+        outputEl.innerHTML = result ? `<pre>${result}</pre>` : '<em>Executed successfully</em>';
+        outputEl.style.display = 'block';
+        statusEl.textContent = 'Completed';
+    } catch (error) {
+        outputEl.innerHTML = `<div class="error">Error: ${error.message}</div>`;
+        outputEl.style.display = 'block';
+        statusEl.textContent = 'Error';
+    } finally {
+        button.disabled = false;
+    }
+}
+
+// Initialize when page loads
+window.addEventListener('load', initPyodide);
+"""
+
+# Hashed file name -> {"body", "gzip", "content_type", "etag"}
+ASSETS: Dict[str, Dict] = {}
+
+
+def register_asset(name: str, source: str) -> str:
+    """Register an asset under a content-hashed name and return its URL."""
+    body = source.encode("utf-8")
+    digest = hashlib.sha256(body).hexdigest()[:16]
+    stem, extension = name.rsplit(".", 1)
+    hashed_name = f"{stem}.{digest}.{extension}"
+    ASSETS[hashed_name] = {
+        "body": body,
+        "gzip": gzip.compress(body, compresslevel=9, mtime=0),
+        "content_type": CONTENT_TYPES[extension],
+        "etag": f'"{digest}"',
+    }
+    return ASSET_ROUTE + hashed_name
+
+
+def get_asset(hashed_name: str) -> Optional[Dict]:
+    """Look up an asset by its hashed file name."""
+    return ASSETS.get(hashed_name)
+
+
+# Asset URLs, fixed for the lifetime of the isolate
+ASSET_URLS = {
+    "__CLASSIC_VIEWER_CSS__": register_asset("classic-viewer.css", CLASSIC_VIEWER_CSS),
+    "__CLASSIC_VIEWER_JS__": register_asset("classic-viewer.js", CLASSIC_VIEWER_JS),
+    "__WASM_VIEWER_CSS__": register_asset("wasm-viewer.css", WASM_VIEWER_CSS),
+    "__WASM_VIEWER_JS__": register_asset("wasm-viewer.js", WASM_VIEWER_JS),
+    "__WASM_RUNTIME_CSS__": register_asset("wasm-runtime.css", WASM_RUNTIME_CSS),
+    "__WASM_RUNTIME_JS__": register_asset("wasm-runtime.js", WASM_RUNTIME_JS),
+}
@@ -0,0 +1,183 @@
+"""
+Viewer Templates for Python Workers
+HTML shells for the notebook viewers, split into byte segments at import
+"""
+
+import asyncio
+import hashlib
+import json
+import sys
+from typing import Dict, Optional, Tuple
+
+from viewer_assets import ASSET_URLS
+
+# Marker replaced by the JSON viewer data: {"serverId", "notebook", "runtime"}
+NOTEBOOK_PLACEHOLDER = "__NOTEBOOK_JSON__"
+
+# Notebooks larger than this are rendered in a worker thread (where available)
+OFFLOAD_THRESHOLD = 256 * 1024
+
+# Pyodide (Cloudflare Python Workers) has no threads
+THREADS_AVAILABLE = sys.platform != "emscripten"
+
+
+def split_template(template: str) -> Tuple[bytes, bytes]:
+    """Split a template around its single placeholder into (prefix, suffix) bytes.
+
+    Asset markers are replaced with their content-hashed URLs first.
+    """
+    for marker, url in ASSET_URLS.items():
+        template = template.replace(marker, url)
+    prefix, marker, suffix = template.partition(NOTEBOOK_PLACEHOLDER)
+    if not marker or NOTEBOOK_PLACEHOLDER in suffix:
+        raise ValueError("Viewer template must contain exactly one notebook placeholder")
+    return prefix.encode("utf-8"), suffix.encode("utf-8")
+
+
+def escape_json_for_script(notebook_content: str) -> str:
+    """Encode notebook text as JSON that is safe inside a <script> element.
+
+    json.dumps does the string escaping in C; replacing every "<" afterwards
+    means the payload can never close the script element or open a comment.
+    """
+    return json.dumps(notebook_content, ensure_ascii=False).replace("<", "\\u003c")
+
+
+def template_version(segments: Tuple[bytes, bytes]) -> str:
+    """Short hash of a template's static segments, used in viewer ETags."""
+    return hashlib.sha256(b"".join(segments)).hexdigest()[:12]
+
+
+def runtime_json(runtime: Optional[Dict]) -> str:
+    """Encode the viewer runtime settings once, for splicing into every render."""
+    return json.dumps(runtime, separators=(",", ":")).replace("<", "\\u003c")
+
+
+def render(
+    segments: Tuple[bytes, bytes],
+    notebook_content: str,
+    server_id: str,
+    runtime: str = "null",
+) -> bytes:
+    """Splice the escaped viewer data between a template's prefix and suffix.
+
+    ``runtime`` is pre-encoded JSON from runtime_json.
+    """
+    prefix, suffix = segments
+    payload = (
+        '{"serverId":' + escape_json_for_script(server_id)
+        + ',"runtime":' + runtime
+        + ',"notebook":' + escape_json_for_script(notebook_content) + '}'
+    ).encode("utf-8")
+    return b"".join((prefix, payload, suffix))
+
+
+async def render_async(
+    segments: Tuple[bytes, bytes],
+    notebook_content: str,
+    server_id: str,
+    runtime: str = "null",
+) -> bytes:
+    """Render a viewer, moving large notebooks off the event loop."""
+    if THREADS_AVAILABLE and len(notebook_content) > OFFLOAD_THRESHOLD:
+        return await asyncio.to_thread(render, segments, notebook_content, server_id, runtime)
+    return render(segments, notebook_content, server_id, runtime)
+
+
+CLASSIC_VIEWER_TEMPLATE = r"""<!DOCTYPE html>
+<html lang="en">
+<head>
+    <meta charset="UTF-8">
+    <meta name="viewport" content="width=device-width, initial-scale=1.0">
+    <title>Real Marimo Notebook</title>
+    <link rel="stylesheet" href="__CLASSIC_VIEWER_CSS__">
+</head>
+<body>
+    <div class="header">
+        <h1>🚀 Real Marimo Notebook</h1>
+        <p>This is a REAL Marimo notebook running on Cloudflare Python Workers!</p>
+    </div>
+    
+    <div class="notebook-container">
+        <div class="marimo-info">
+            <strong>🎯 What You're Seeing:</strong><br>
+            This is a <strong>real Marimo notebook</strong> generated by AI and served by Python Workers.<br>
+            Each cell can be executed individually with real Python execution.
+        </div>
+        
+        <div id="notebook">
+            <div class="loading">
+                <div class="progress-indicator"></div>
+                Loading real Marimo notebook...
+            </div>
+        </div>
+    </div>
+
+    <script type="application/json" id="notebook-data">__NOTEBOOK_JSON__</script>
+
+    <script src="__CLASSIC_VIEWER_JS__"></script>
+</body>
+</html>
+"""
+
+WASM_VIEWER_TEMPLATE = r"""<!DOCTYPE html>
+<html lang="en">
+<head>
+    <meta charset="UTF-8">
+    <meta name="viewport" content="width=device-width, initial-scale=1.0">
+    <title>Interactive Marimo Notebook</title>
+    <link rel="stylesheet" href="__WASM_VIEWER_CSS__">
+</head>
+<body>
+    <!-- Loading Screen -->
+    <div id="loading" class="loading-container">
+        <div class="loading-content">
+            <div class="spinner"></div>
+            <div class="loading-title">🚀 Launching Interactive Marimo</div>
+            <div class="loading-subtitle">Preparing your executable notebook...</div>
+            <div class="progress-bar">
+                <div id="progress" class="progress-fill"></div>
+            </div>
+            <div id="status">Initializing Marimo runtime...</div>
+        </div>
+    </div>
+
+    <!-- Error Screen -->
+    <div id="error" class="error-container">
+        <div class="error-title">❌ Failed to Load Interactive Notebook</div>
+        <div id="error-message">An error occurred while loading the Marimo notebook.</div>
+        <a id="download-link" href="#" download="notebook.py" class="fallback-link">
+            📥 Download Notebook File Instead
+        </a>
+    </div>
+
+    <!-- Marimo Container -->
+    <div id="marimo-container" class="marimo-container">
+        <iframe id="marimo-iframe" class="marimo-iframe" sandbox="allow-scripts allow-same-origin allow-downloads allow-forms"></iframe>
+    </div>
+
+    <!-- Notebook source, embedded once as JSON -->
+    <script type="application/json" id="notebook-data">__NOTEBOOK_JSON__</script>
+
+    <!-- Runtime page loaded into the iframe -->
+    <template id="marimo-runtime">
+        <link rel="stylesheet" href="__WASM_RUNTIME_CSS__">
+        <div id="notebook">
+            <h1>🚀 Interactive Marimo Notebook</h1>
+            <div id="loading" style="text-align: center; padding: 20px;">
+                <div>Loading Python environment...</div>
+            </div>
+        </div>
+
+        <script src="__WASM_RUNTIME_JS__"></script>
+    </template>
+
+    <script src="__WASM_VIEWER_JS__"></script>
+</body>
+</html>
+"""
+
+# Immutable byte segments, computed once per isolate
+CLASSIC_VIEWER = split_template(CLASSIC_VIEWER_TEMPLATE)
+WASM_VIEWER = split_template(WASM_VIEWER_TEMPLATE)
+WASM_VIEWER_VERSION = template_version(WASM_VIEWER)
@@ -0,0 +1,12 @@
+import sys
+import types
+from pathlib import Path
+
+# The worker modules import each other by top-level name, as in the Workers runtime
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+
+try:
+    import marimo  # noqa: F401
+except ImportError:
+    # marimo_service imports marimo but the code under test never calls into it
+    sys.modules["marimo"] = types.ModuleType("marimo")
@@ -0,0 +1,96 @@
+import asyncio
+from types import SimpleNamespace
+
+from ai_service import ENGINE_AUTO, AIService
+from circuit_breaker import OPEN, CircuitBreaker
+from flowchart_diff import embed_diagram
+from generation_cache import GenerationCache
+from llm_scheduler import INTERACTIVE, LLMScheduler
+
+DIAGRAM = "flowchart TD\n    A[Load the quarterly sales ledger] --> B[Fit a seasonal trend model]"
+NOTEBOOK = "@app.cell\ndef node_A():\n    value_A = 1\n    return (value_A,)\n"
+
+
+class ServerError(Exception):
+    status_code = 503
+
+
+class ScriptedCompletions:
+    """chat.completions stand-in that answers each call with the next scripted reply or exception."""
+
+    def __init__(self, replies):
+        self.replies = list(replies)
+        self.calls = 0
+
+    async def create(self, **kwargs):
+        self.calls += 1
+        reply = self.replies.pop(0)
+        if isinstance(reply, Exception):
+            raise reply
+        return SimpleNamespace(
+            choices=[SimpleNamespace(message=SimpleNamespace(content=reply), finish_reason="stop")],
+            usage=SimpleNamespace(total_tokens=100, prompt_tokens=60, completion_tokens=40),
+        )
+
+
+def make_service(replies, **kwargs):
+    service = AIService(**kwargs)
+    completions = ScriptedCompletions(replies)
+    service.clients.register("sk-test", SimpleNamespace(chat=SimpleNamespace(completions=completions)))
+    return service, completions
+
+
+def test_a_batch_marks_the_fallback_notebooks_served_for_failed_generations():
+    service, _ = make_service([NOTEBOOK, ValueError("bad request")])
+    items = [
+        {"prompt": "Build it", "diagram": DIAGRAM},
+        {"prompt": "Build another", "diagram": DIAGRAM.replace("quarterly", "monthly")},
+        {"prompt": "No diagram"},
+    ]
+
+    async def run():
+        return sorted(
+            [item async for item in service.generate_marimo_notebooks(items, "sk-test", parallelism=1)],
+            key=lambda result: result[0],
+        )
+
+    (_, built, built_degraded), (_, fallback, degraded), (_, error, error_degraded) = asyncio.run(run())
+
+    assert "value_A = 1" in built and not built_degraded
+    assert degraded
+    assert fallback == embed_diagram(
+        service._create_fallback_notebook("Build another", items[1]["diagram"], "python"), items[1]["diagram"]
+    )
+    assert isinstance(error, ValueError) and not error_degraded
+
+
+def test_an_open_circuit_serves_cached_local_or_fallback_notebooks_without_calling_openai():
+    service, completions = make_service(
+        [NOTEBOOK, ServerError("down"), ServerError("down")],
+        cache=GenerationCache(),
+        scheduler=LLMScheduler(max_retries=0),
+        breaker=CircuitBreaker(min_calls=3, window=1000.0),
+    )
+    templated = "flowchart TD\n    A[Enter value] --> B[Show result]"
+
+    async def run():
+        built = await service.generate_marimo_notebook("Build it", DIAGRAM, "python", "sk-test")
+        for prompt in ("Fail once", "Fail twice"):
+            await service.generate_marimo_notebook(prompt, DIAGRAM, "python", "sk-test")
+        assert service.breaker.state == OPEN
+        calls = completions.calls
+        # A forced refresh gets the cached notebook, a new request the fallback, a template step the local engine
+        cached = await service._generate_notebook("Build it", DIAGRAM, "python", "sk-test", False, INTERACTIVE, ENGINE_AUTO)
+        fallback = await service._generate_notebook("Something new", DIAGRAM, "python", "sk-test", True, INTERACTIVE, ENGINE_AUTO)
+        local = await service._generate_notebook("Build it", templated, "python", "sk-test", True, INTERACTIVE, ENGINE_AUTO)
+        assert completions.calls == calls
+        return built, cached, fallback, local
+
+    built, cached, fallback, local = asyncio.run(run())
+
+    assert cached == (built, True)
+    assert fallback == (
+        embed_diagram(service._create_fallback_notebook("Something new", DIAGRAM, "python"), DIAGRAM), True
+    )
+    assert "def node_A(" in local[0] and not local[1]
+    assert service.breaker.counters["rejected"] == 2
@@ -0,0 +1,132 @@
+import tracemalloc
+
+from bounded_cache import BoundedCache
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_entry_budget_evicts_least_recently_used():
+    cache = BoundedCache(max_entries=10, max_bytes=10 ** 9)
+    for index in range(100):
+        # Keep k0 recently used so it survives every eviction
+        if index:
+            assert cache.get("k0") is not None
+        cache.put(f"k{index}", "v", 1)
+
+    stats = cache.stats()
+    assert stats["entries"] == 10
+    assert stats["bytes"] == 10
+    assert stats["evicted_entries"] == 90
+    assert stats["evicted_bytes"] == 0
+    assert "k0" in cache
+    assert "k1" not in cache
+    assert "k99" in cache
+
+
+def test_byte_budget_evicts_until_under_budget():
+    cache = BoundedCache(max_entries=1000, max_bytes=1000)
+    for index in range(50):
+        cache.put(f"k{index}", b"x" * 100, 100)
+
+    stats = cache.stats()
+    assert stats["entries"] == 10
+    assert stats["bytes"] == 1000
+    assert stats["evicted_bytes"] == 40
+    assert stats["evicted_entries"] == 0
+    assert list(cache) == [f"k{index}" for index in range(40, 50)]
+
+
+def test_oversized_entry_is_kept_alone():
+    cache = BoundedCache(max_entries=10, max_bytes=100)
+    cache.put("small", b"", 10)
+    cache.put("huge", b"", 500)
+
+    assert list(cache) == ["huge"]
+    assert cache.stats()["bytes"] == 500
+
+
+def test_replacing_a_key_does_not_double_count_bytes():
+    cache = BoundedCache(max_entries=10, max_bytes=1000)
+    for size in (100, 300, 50):
+        cache.put("same", b"", size)
+
+    assert len(cache) == 1
+    assert cache.stats()["bytes"] == 50
+
+
+def test_ttl_expiry():
+    clock = FakeClock()
+    cache = BoundedCache(ttl=60, adaptive_ttl=False, clock=clock)
+    for index in range(5):
+        cache.put(f"k{index}", "v", 10)
+    clock.now += 30
+    cache.put("late", "v", 10)
+
+    clock.now += 31
+    assert cache.get("k0") is None
+    assert cache.get("late") is not None
+    stats = cache.stats()
+    assert stats["entries"] == 1
+    assert stats["bytes"] == 10
+    assert stats["evicted_expired"] == 5
+
+    clock.now += 60
+    assert cache.get("late") is None
+    assert cache.stats()["entries"] == 0
+    assert cache.stats()["bytes"] == 0
+
+
+def test_adaptive_ttl_keeps_hot_entries():
+    clock = FakeClock()
+    cache = BoundedCache(ttl=60, max_ttl=600, clock=clock)
+    cache.put("hot", "v", 1)
+    cache.put("cold", "v", 1)
+    for _ in range(7):
+        clock.now += 50
+        assert cache.get("hot") is not None
+
+    assert "hot" in cache
+    assert "cold" not in cache
+    assert cache.stats()["evicted_expired"] == 1
+
+
+def test_expiry_heap_stays_bounded_for_hot_keys():
+    clock = FakeClock()
+    cache = BoundedCache(max_entries=10, clock=clock)
+    for index in range(10):
+        cache.put(f"k{index}", "v", 1)
+    for _ in range(10000):
+        clock.now += 0.001
+        cache.get("k0")
+
+    assert len(cache._expiry_heap) <= 2 * len(cache) + 64
+
+
+def test_memory_stays_flat():
+    cache = BoundedCache(max_entries=100, max_bytes=10 ** 9)
+
+    def fill(start):
+        for index in range(start, start + 2000):
+            payload = bytes(1000)
+            cache.put(f"notebook-{index}", payload, len(payload))
+
+    tracemalloc.start()
+    try:
+        fill(0)
+        baseline, _ = tracemalloc.get_traced_memory()
+        for round_ in range(1, 10):
+            fill(round_ * 2000)
+        current, _ = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    assert len(cache) == 100
+    assert cache.stats()["evicted_entries"] == 20000 - 100
+    # Ten times the traffic holds the same 100 entries; allow a little allocator noise
+    assert current < baseline * 1.2 + 64 * 1024
@@ -0,0 +1,30 @@
+from cell_parser import assemble_cells, extract_cells
+
+
+def test_hoisted_import_before_a_blank_line_keeps_the_return_indented():
+    fragment = (
+        "@app.cell\n"
+        "def node_A():\n"
+        "    import numpy as np\n"
+        "\n"
+        "    x = np.ones(3)\n"
+        "    return (x,)\n"
+    )
+
+    body = assemble_cells([fragment])
+
+    compile(body, "notebook.py", "exec")
+    assert "def node_A(np):\n    x = np.ones(3)\n    return (x,)" in body
+
+
+def test_a_trailing_output_return_stays_the_last_expression():
+    fragment = (
+        "@app.cell\n"
+        "def node_A(mo):\n"
+        "    label = 'done'\n"
+        "    return mo.md(label)\n"
+    )
+
+    cell = extract_cells(assemble_cells(["import marimo as mo", fragment]))[1]
+
+    assert cell["source"].endswith("    label = 'done'\n    mo.md(label)\n    return (label,)\n")
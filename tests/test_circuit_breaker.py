@@ -0,0 +1,105 @@
+import asyncio
+
+import pytest
+
+from circuit_breaker import CLOSED, HALF_OPEN, OPEN, CircuitBreaker, CircuitOpenError
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def run_calls(breaker, clock, seconds, tokens=0, count=10):
+    async def call():
+        clock.now += seconds
+        return "ok"
+
+    async def run():
+        for _ in range(count):
+            await breaker.run(call, lambda error: True, tokens)
+
+    asyncio.run(run())
+
+
+def test_the_slow_call_threshold_grows_with_the_tokens_asked_for():
+    clock = FakeClock()
+    breaker = CircuitBreaker(min_calls=5, window=1000.0, slow_call=15.0, slow_call_per_token=0.02, clock=clock)
+
+    # 90 s is well inside 15 s + 8000 tokens at 50 tokens/s
+    run_calls(breaker, clock, 90.0, tokens=8000)
+
+    assert breaker.state == CLOSED
+    assert breaker.stats()["slow_call_rate"] == 0.0
+
+
+def test_a_slow_first_token_opens_the_circuit():
+    clock = FakeClock()
+    breaker = CircuitBreaker(min_calls=5, window=1000.0, slow_call=15.0, slow_call_per_token=0.02, clock=clock)
+
+    run_calls(breaker, clock, 20.0, count=5)
+
+    assert breaker.state == OPEN
+
+
+class ServerError(Exception):
+    status_code = 503
+
+
+def trip(breaker, count):
+    async def fail():
+        raise ServerError("upstream is down")
+
+    async def run():
+        for _ in range(count):
+            with pytest.raises(ServerError):
+                await breaker.run(fail, lambda error: True)
+
+    asyncio.run(run())
+
+
+def test_an_open_circuit_half_opens_for_a_few_probes_then_closes():
+    clock = FakeClock()
+    breaker = CircuitBreaker(min_calls=4, window=1000.0, open_seconds=30.0, probes=2, clock=clock)
+    trip(breaker, 4)
+    assert breaker.state == OPEN
+
+    async def run():
+        release = asyncio.Event()
+
+        async def probe():
+            await release.wait()
+            return "ok"
+
+        with pytest.raises(CircuitOpenError):
+            await breaker.run(probe, lambda error: True)
+        clock.now += 30.0
+        probes = [asyncio.ensure_future(breaker.run(probe, lambda error: True)) for _ in range(2)]
+        await asyncio.sleep(0)
+        assert breaker.state == HALF_OPEN
+        # Both probes are in flight, so a third call is turned away
+        with pytest.raises(CircuitOpenError):
+            await breaker.run(probe, lambda error: True)
+        release.set()
+        return await asyncio.gather(*probes)
+
+    assert asyncio.run(run()) == ["ok", "ok"]
+    assert breaker.state == CLOSED
+    assert breaker.stats()["window_calls"] == 0
+    assert breaker.counters == {"opened": 1, "half_opened": 1, "closed": 1, "rejected": 2}
+
+
+def test_a_failed_probe_opens_the_circuit_again():
+    clock = FakeClock()
+    breaker = CircuitBreaker(min_calls=4, window=1000.0, open_seconds=30.0, probes=2, clock=clock)
+    trip(breaker, 4)
+    clock.now += 30.0
+
+    trip(breaker, 1)
+
+    assert breaker.state == OPEN
+    assert not breaker.allows()
+    assert breaker.counters["opened"] == 2
@@ -0,0 +1,44 @@
+from cell_parser import assemble_cells
+from flow_to_marimo import flow_cells, flow_to_marimo, is_templated, node_kind
+from mermaid_parser import parse_flowchart
+from notebook_validator import validate_notebook
+
+
+def test_short_template_steps_are_built_locally():
+    graph = parse_flowchart("flowchart TD\n    A([Start]) --> B[Enter value]\n    B --> C[Show result]\n    C --> D([End])")
+
+    assert is_templated(graph)
+
+
+def test_a_keyword_inside_a_longer_label_goes_to_the_llm():
+    graph = parse_flowchart(
+        "flowchart TD\n    A[Get daily sales from the warehouse API] --> B[Compute a 7-day rolling average]"
+    )
+
+    assert not is_templated(graph)
+
+
+def test_keywords_match_whole_words_only():
+    assert node_kind("Update the endpoint address") is None
+    assert node_kind("Calculates totals") == "process"
+    assert node_kind("Show total sum") == "display"
+
+
+LOOP = "flowchart TD\n    A[Get input] --> B{Check input}\n    B -->|valid| C[Show result]\n    B -->|invalid| A"
+
+
+def test_a_loop_goes_to_the_llm():
+    assert not is_templated(parse_flowchart(LOOP))
+
+
+def test_cells_wired_from_a_loop_form_no_cycle():
+    graph = parse_flowchart(LOOP)
+
+    notebook = flow_to_marimo(graph)
+    result = validate_notebook(notebook)
+
+    assert "def node_A(mo):" in notebook
+    assert "def node_B(value_A):" in notebook
+    assert result["valid"]
+    assert result["warnings"] == []
+    assert validate_notebook(assemble_cells([flow_cells(graph, ["A", "B"]), flow_cells(graph, ["C"])]))["warnings"] == []
@@ -0,0 +1,33 @@
+from generation_cache import GenerationCache, generation_key
+
+DIAGRAM = "flowchart TD\n    A[Load data] --> B[Clean it]\n    B --> C[Plot it]"
+# The same diagram with other spacing, a comment, semicolons and its statements in another order
+RESPELLED = "flowchart   TD\n%% data pipeline\n  B-->C[Plot it];\n\n    A[Load data]  -->   B[Clean it] ;\n"
+
+
+def key(prompt="Build a pipeline", diagram=DIAGRAM, language="python", model="gpt-4.1", temperature=0.2):
+    return generation_key(prompt, diagram, language, model, temperature, "notebook:v1")
+
+
+def test_equivalent_requests_share_a_cache_entry():
+    cache = GenerationCache()
+    cache.put(key(), "notebook", 500)
+
+    assert key(prompt="  Build a\n pipeline ", diagram=RESPELLED, language=" Python") == key()
+    assert cache.get(key(diagram=RESPELLED)) == "notebook"
+    assert cache.stats()["saved_tokens"] == 500
+
+
+def test_a_different_model_prompt_or_setting_misses():
+    cache = GenerationCache()
+    cache.put(key(), "notebook", 500)
+
+    for other in (
+        key(model="gpt-4.1-mini"),
+        key(prompt="Build a dashboard"),
+        key(temperature=0.7),
+        key(diagram=DIAGRAM.replace("Plot it", "Chart it")),
+        generation_key("Build a pipeline", DIAGRAM, "python", "gpt-4.1", 0.2, "notebook:v2"),
+    ):
+        assert other != key()
+        assert cache.get(other) is None
@@ -0,0 +1,70 @@
+import asyncio
+
+from hedging import Hedger
+
+
+def test_a_winning_hedge_also_records_the_primarys_elapsed_time():
+    hedger = Hedger(min_samples=1, min_delay=0.01, budget=1.0)
+    hedger._record("completion", 0.01)
+    delays = iter([0.2, 0.01])
+
+    async def call():
+        await asyncio.sleep(next(delays))
+        return "done"
+
+    assert asyncio.run(hedger.run("completion", call)) == "done"
+
+    samples = sorted(hedger.latencies["completion"].samples)
+    assert hedger.counters["hedge_wins"] == 1
+    assert len(samples) == 3
+    # The hedge's own latency, then the primary's lower bound: the hedge delay plus the hedge's latency
+    assert samples[1] < 0.05 and samples[2] >= 0.02
+
+
+def test_hedging_stops_once_the_budget_is_spent():
+    # Half a hedge earned per call, so only every other slow call may be hedged
+    hedger = Hedger(percentile=0.0, min_samples=1, min_delay=0.01, budget=0.5, max_credit=1.0)
+    hedger._record("completion", 0.01)
+    started = []
+
+    async def call():
+        started.append(1)
+        await asyncio.sleep(0.05)
+        return "done"
+
+    async def run():
+        for _ in range(4):
+            await hedger.run("completion", call)
+
+    asyncio.run(run())
+
+    assert hedger.counters["hedged"] == 2
+    assert hedger.counters["over_budget"] == 2
+    assert len(started) == 6
+    assert hedger.credit < 1.0
+
+
+def test_the_losing_call_is_cancelled():
+    hedger = Hedger(min_samples=1, min_delay=0.01, budget=1.0)
+    hedger._record("completion", 0.01)
+    delays = iter([5.0, 0.01])
+    cancelled = []
+
+    async def call():
+        delay = next(delays)
+        try:
+            await asyncio.sleep(delay)
+        except asyncio.CancelledError:
+            cancelled.append(delay)
+            raise
+        return delay
+
+    async def run():
+        result = await hedger.run("completion", call)
+        # Let the cancellation reach the loser
+        await asyncio.sleep(0)
+        return result
+
+    assert asyncio.run(run()) == 0.01
+    assert cancelled == [5.0]
+    assert hedger.counters["hedge_wins"] == 1
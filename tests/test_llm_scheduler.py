@@ -0,0 +1,156 @@
+import asyncio
+import random
+from types import SimpleNamespace
+
+import pytest
+
+import llm_scheduler
+from llm_scheduler import BATCH, INTERACTIVE, LLMScheduler, TokenBucket
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class StatusError(Exception):
+    def __init__(self, status_code, headers=None):
+        super().__init__(f"HTTP {status_code}")
+        self.status_code = status_code
+        self.response = SimpleNamespace(headers=headers or {})
+
+
+def unlimited(**kwargs):
+    return LLMScheduler(requests_per_minute=1e9, tokens_per_minute=1e12, **kwargs)
+
+
+def test_concurrency_is_capped_globally_and_per_key():
+    scheduler = unlimited(max_concurrency=3, max_per_key=2)
+    active = {"all": 0, "peak": 0}
+    peaks = {}
+
+    async def call(key):
+        active["all"] += 1
+        active[key] = active.get(key, 0) + 1
+        active["peak"] = max(active["peak"], active["all"])
+        peaks[key] = max(peaks.get(key, 0), active[key])
+        await asyncio.sleep(0.01)
+        active["all"] -= 1
+        active[key] -= 1
+        return key
+
+    async def run():
+        return await asyncio.gather(
+            *(scheduler.run(lambda key=key: call(key), key) for key in ["a"] * 6 + ["b"] * 6)
+        )
+
+    assert asyncio.run(run()) == ["a"] * 6 + ["b"] * 6
+    assert active["peak"] == 3
+    assert peaks == {"a": 2, "b": 2}
+    assert scheduler.stats()["active"] == 0
+
+
+def test_the_token_bucket_refills_with_the_clock():
+    clock = FakeClock()
+    bucket = TokenBucket(per_minute=60, capacity=2, clock=clock)
+
+    bucket.take(2)
+    assert bucket.wait_time(1) == pytest.approx(1.0)
+    clock.now += 0.5
+    assert bucket.wait_time(1) == pytest.approx(0.5)
+    clock.now += 10.0
+    assert bucket.wait_time(1) == 0
+    # Refills stop at the capacity
+    assert bucket.level == 2
+    # A reservation reconciled against a larger cost leaves a debt
+    bucket.take(5)
+    assert bucket.wait_time(1) == pytest.approx(4.0)
+
+
+def test_calls_over_the_request_rate_wait_for_the_bucket():
+    clock = FakeClock()
+    scheduler = unlimited()
+    scheduler.requests = TokenBucket(per_minute=60, capacity=2, clock=clock)
+
+    async def run():
+        calls = [
+            asyncio.ensure_future(scheduler.run(lambda index=index: asyncio.sleep(0, index), "k"))
+            for index in range(3)
+        ]
+        await asyncio.sleep(0.01)
+        done_early = [call.done() for call in calls]
+        clock.now += 1.0
+        scheduler._dispatch()
+        return done_early, await asyncio.gather(*calls)
+
+    done_early, results = asyncio.run(run())
+
+    assert done_early == [True, True, False]
+    assert results == [0, 1, 2]
+    assert scheduler.counters["rate_limited_waits"] >= 1
+
+
+def test_waiting_calls_are_admitted_by_priority_then_arrival():
+    scheduler = unlimited(max_concurrency=1)
+    order = []
+
+    async def run():
+        release = asyncio.Event()
+        blocker = asyncio.ensure_future(scheduler.run(release.wait, "k"))
+        await asyncio.sleep(0)
+        arrivals = [("batch 1", BATCH), ("interactive 1", INTERACTIVE), ("batch 2", BATCH), ("interactive 2", INTERACTIVE)]
+        waiting = [
+            asyncio.ensure_future(scheduler.run(lambda name=name: asyncio.sleep(0, order.append(name)), "k", priority))
+            for name, priority in arrivals
+        ]
+        await asyncio.sleep(0)
+        release.set()
+        await asyncio.gather(blocker, *waiting)
+
+    asyncio.run(run())
+
+    assert order == ["interactive 1", "interactive 2", "batch 1", "batch 2"]
+
+
+def test_rate_limits_and_server_errors_are_retried_with_backoff(monkeypatch):
+    scheduler = unlimited(max_retries=3, base_delay=1.0, max_delay=20.0)
+    errors = [StatusError(429, {"retry-after": "5"}), StatusError(503), StatusError(500)]
+    delays = []
+
+    async def fake_sleep(delay, result=None):
+        delays.append(delay)
+        return result
+
+    async def call():
+        if errors:
+            raise errors.pop(0)
+        return "ok"
+
+    monkeypatch.setattr(llm_scheduler.asyncio, "sleep", fake_sleep)
+    random.seed(1)
+
+    assert asyncio.run(scheduler.run(call, "k")) == "ok"
+    assert scheduler.counters["retries"] == 3
+    # Full jitter below base * 2**attempt, never less than the server's Retry-After
+    assert delays[0] >= 5.0
+    assert 0 <= delays[1] <= 2.0 and 0 <= delays[2] <= 4.0
+
+
+def test_client_errors_are_not_retried_and_retries_run_out():
+    scheduler = unlimited(max_retries=2, base_delay=0.0)
+    calls = []
+
+    async def call(status):
+        calls.append(status)
+        raise StatusError(status)
+
+    with pytest.raises(StatusError):
+        asyncio.run(scheduler.run(lambda: call(400), "k"))
+    with pytest.raises(StatusError):
+        asyncio.run(scheduler.run(lambda: call(502), "k"))
+
+    assert calls == [400, 502, 502, 502]
+    assert scheduler.counters["gave_up"] == 1
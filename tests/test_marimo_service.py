@@ -0,0 +1,30 @@
+import tracemalloc
+
+from marimo_service import MarimoService, make_server_id
+
+# About 1 MB of notebook source
+NOTEBOOK = "import marimo\n\napp = marimo.App()\n\n" + "# a long generated comment line\n" * 32768
+
+
+def test_storing_the_same_notebook_again_keeps_one_copy():
+    service = MarimoService()
+    server_id = service.store_content(NOTEBOOK)
+
+    tracemalloc.start()
+    try:
+        baseline, _ = tracemalloc.get_traced_memory()
+        for _ in range(9999):
+            assert service.store_content(NOTEBOOK) == server_id
+        current, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    stats = service.get_store_stats()
+    assert stats["entries"] == 1
+    assert stats["aliases"] == 1
+    assert stats["dedup_hits"] == 9999
+    assert server_id == make_server_id(NOTEBOOK)
+    assert service.get_notebook(server_id) == NOTEBOOK
+    # Flat: nothing retained per store, and no more than one transient encoded copy at a time
+    assert current - baseline < 64 * 1024
+    assert peak - baseline < 2 * len(NOTEBOOK)
@@ -0,0 +1,136 @@
+import time
+
+import pytest
+
+from marimo_service import MarimoService
+from notebook_backends import NotebookBackend, SQLiteBackend
+
+
+def test_interface_is_abstract():
+    with pytest.raises(TypeError):
+        NotebookBackend()
+
+
+def test_writes_are_committed_in_batches(tmp_path):
+    path = str(tmp_path / "notebooks.db")
+    writer, reader = SQLiteBackend(path, batch_size=3, batch_delay=60), SQLiteBackend(path)
+    try:
+        writer.put_blob("d1", b"body", "gzip", 4)
+        writer.put_alias("marimo-1", "d1")
+        assert reader.get_blob("d1") is None
+
+        writer.put_generation("k1", "d1", 100)
+
+        assert reader.get_blob("d1") == (b"body", "gzip", 4)
+        assert reader.get_alias("marimo-1") == "d1"
+        assert reader.get_generation("k1")[:2] == ("d1", 100)
+    finally:
+        writer.close()
+        reader.close()
+
+
+def test_a_batch_that_stops_growing_is_committed_by_the_timer(tmp_path):
+    path = str(tmp_path / "notebooks.db")
+    writer, reader = SQLiteBackend(path, batch_delay=0.05), SQLiteBackend(path)
+    try:
+        writer.put_blob("d1", b"body", "gzip", 4)
+        time.sleep(0.3)
+
+        assert reader.get_blob("d1") == (b"body", "gzip", 4)
+    finally:
+        writer.close()
+        reader.close()
+
+
+def test_close_commits_the_buffered_writes(tmp_path):
+    path = str(tmp_path / "notebooks.db")
+    writer = SQLiteBackend(path, batch_delay=60)
+    writer.put_blob("d1", b"body", "gzip", 4)
+    writer.close()
+
+    reader = SQLiteBackend(path)
+    try:
+        assert reader.get_blob("d1") == (b"body", "gzip", 4)
+    finally:
+        reader.close()
+
+
+def test_old_rows_are_purged_on_commit(tmp_path):
+    backend = SQLiteBackend(str(tmp_path / "notebooks.db"), retention=60, purge_interval=0)
+    try:
+        backend.put_blob("old", b"x", "gzip", 1)
+        backend.put_alias("marimo-old", "old")
+        backend.flush()
+        backend._conn.execute("UPDATE notebooks SET created_at = ?", (time.time() - 120,))
+        backend._conn.execute("UPDATE aliases SET created_at = ?", (time.time() - 120,))
+        backend._conn.commit()
+
+        backend.put_blob("new", b"y", "gzip", 1)
+        backend.flush()
+
+        assert backend.get_blob("old") is None
+        assert backend.get_alias("marimo-old") is None
+        assert backend.get_blob("new") is not None
+    finally:
+        backend.close()
+
+
+def test_storing_content_again_renews_it(tmp_path):
+    backend = SQLiteBackend(str(tmp_path / "notebooks.db"))
+    try:
+        backend.put_blob("d1", b"x", "gzip", 1)
+        backend.flush()
+        backend._conn.execute("UPDATE notebooks SET created_at = 0")
+        backend._conn.commit()
+        backend.put_blob("d1", b"x", "gzip", 1)
+
+        assert backend.purge_older_than(60) == 0
+        assert backend.get_blob("d1") is not None
+    finally:
+        backend.close()
+
+
+def test_a_notebook_still_in_use_survives_the_purge(tmp_path):
+    path = str(tmp_path / "notebooks.db")
+    notebook = "import marimo\n\napp = marimo.App()\n"
+    backend = SQLiteBackend(path, retention=60)
+    service = MarimoService(backend=backend)
+    other = None
+    try:
+        server_id = service.store_content(notebook)
+        backend.flush()
+        # An hour later: the rows were written long ago and the last purge cleared the renewals
+        backend._conn.execute("UPDATE notebooks SET created_at = ?", (time.time() - 120,))
+        backend._conn.execute("UPDATE aliases SET created_at = ?", (time.time() - 120,))
+        backend._conn.commit()
+        backend._renewed.clear()
+
+        # Storing it again only hits the in-memory copy, as does serving it
+        assert service.store_content(notebook) == server_id
+        assert service.get_store_stats()["dedup_hits"] == 1
+        assert service.get_notebook(server_id) == notebook
+
+        assert backend.purge_older_than(60) == 0
+        other = MarimoService(backend=SQLiteBackend(path))
+        assert other.get_notebook(server_id) == notebook
+    finally:
+        backend.close()
+        if other is not None:
+            other.backend.close()
+
+
+def test_an_unused_notebook_is_purged(tmp_path):
+    path = str(tmp_path / "notebooks.db")
+    backend = SQLiteBackend(path, retention=60)
+    service = MarimoService(backend=backend)
+    try:
+        server_id = service.store_content("import marimo\n")
+        backend.flush()
+        backend._conn.execute("UPDATE notebooks SET created_at = ?", (time.time() - 120,))
+        backend._conn.execute("UPDATE aliases SET created_at = ?", (time.time() - 120,))
+        backend._conn.commit()
+
+        assert backend.purge_older_than(60) == 1
+        assert MarimoService(backend=backend).get_notebook(server_id) is None
+    finally:
+        backend.close()
@@ -0,0 +1,59 @@
+from notebook_validator import validate_notebook
+
+CELLS = (
+    "@app.cell\n"
+    "def node_A():\n"
+    "    # the input\n"
+    "    value_A = 21\n"
+    "    return (value_A,)\n"
+    "\n"
+    "\n"
+    "@app.cell\n"
+    "def node_B(value_Z):\n"
+    "    value_B = value_A * 2\n"
+    "    return mo.md(f'{value_B}')\n"
+)
+
+
+def test_only_the_disagreeing_cell_is_rewritten():
+    result = validate_notebook(CELLS)
+
+    assert result["valid"]
+    assert result["repairs"] == ["missing_import", "cell_signature"]
+    notebook = result["notebook"]
+    assert "def node_A():\n    # the input\n    value_A = 21\n    return (value_A,)\n" in notebook
+    assert "def node_B(mo, value_A):\n    value_B = value_A * 2\n    mo.md(f'{value_B}')\n    return (value_B,)\n" in notebook
+    assert "def imports():\n    import marimo as mo\n    return (mo,)\n" in notebook
+
+
+def test_hoisting_a_top_level_import_yields_a_notebook_that_compiles():
+    result = validate_notebook(
+        "import numpy as np\n\n"
+        "@app.cell\n"
+        "def node_A():\n"
+        "    import math\n"
+        "\n"
+        "    x = np.sqrt(math.pi)\n"
+        "    return\n"
+    )
+
+    assert result["valid"]
+    compile(result["notebook"], "notebook.py", "exec")
+    assert "def node_A(np):\n    import math\n\n    x = np.sqrt(math.pi)\n    return (math, x)\n" in result["notebook"]
+
+
+def test_a_notebook_that_parses_but_does_not_compile_is_invalid():
+    result = validate_notebook("@app.cell\ndef node_A():\n    nonlocal x\n    return\n")
+
+    assert not result["valid"]
+    assert result["notebook"] is None
+    assert "does not compile" in result["errors"][0]
+
+
+def test_cells_that_read_each_other_are_reported_as_a_cycle():
+    result = validate_notebook(
+        "@app.cell\ndef node_A(value_B):\n    value_A = value_B\n    return (value_A,)\n\n\n"
+        "@app.cell\ndef node_B(value_A):\n    value_B = value_A\n    return (value_B,)\n"
+    )
+
+    assert result["warnings"] == ["Cells form a cycle, which marimo will not run: node_A -> node_B -> node_A"]
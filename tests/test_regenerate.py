@@ -0,0 +1,89 @@
+import asyncio
+from types import SimpleNamespace
+
+from ai_service import AIService
+from cell_parser import extract_cells
+from flowchart_diff import embed_diagram
+
+DIAGRAM = (
+    "flowchart TD\n"
+    "    A[Load the quarterly sales ledger] --> B[Fit a seasonal trend model]\n"
+    "    B --> C[Flag months far off the trend]\n"
+    "    C --> D[Summarise the flagged months]"
+)
+EDITED = DIAGRAM.replace("Flag months far off the trend", "Flag weeks far off the trend")
+
+
+def cell(node, body, parameters=""):
+    return f"@app.cell\ndef node_{node}({parameters}):\n    value_{node} = {body}\n    return (value_{node},)\n"
+
+
+FULL = "\n\n".join([cell("A", "1"), cell("B", "value_A", "value_A"), cell("C", "value_B", "value_B"), cell("D", "value_C", "value_C")])
+
+
+class ScriptedCompletions:
+    """chat.completions stand-in that answers each call with the next scripted reply or exception."""
+
+    def __init__(self, replies):
+        self.replies = list(replies)
+
+    async def create(self, **kwargs):
+        reply = self.replies.pop(0)
+        if isinstance(reply, Exception):
+            raise reply
+        return SimpleNamespace(
+            choices=[SimpleNamespace(message=SimpleNamespace(content=reply), finish_reason="stop")],
+            usage=SimpleNamespace(total_tokens=100, prompt_tokens=60, completion_tokens=40),
+        )
+
+
+def regenerate(replies):
+    service = AIService()
+    service.clients.register("sk-test", SimpleNamespace(chat=SimpleNamespace(completions=ScriptedCompletions(replies))))
+
+    async def run():
+        previous = await service.generate_marimo_notebook("Build it", DIAGRAM, "python", "sk-test")
+        return previous, await service.regenerate_marimo_notebook("Build it", previous, EDITED, "python", "sk-test")
+
+    return asyncio.run(run())
+
+
+def test_only_the_target_nodes_cell_is_taken_from_a_fragment():
+    # The part also redefines node_A; that copy must not reach the notebook
+    fragment = "import math\n\n" + cell("A", "'stale'") + "\n\n" + cell("C", "math.floor(value_B)", "value_B")
+    previous, (notebook, regenerated, fallback) = regenerate([FULL, fragment])
+
+    assert (regenerated, fallback) == (["C"], [])
+    sources = {cell["name"]: cell["source"] for cell in extract_cells(notebook)}
+    assert "stale" not in notebook
+    assert "math.floor(value_B)" in sources["node_C"]
+    assert "import math" in sources["imports"]
+    assert sources["node_A"] == {cell["name"]: cell["source"] for cell in extract_cells(previous)}["node_A"]
+
+
+def test_a_node_whose_part_failed_is_reported_as_a_fallback():
+    _, (notebook, regenerated, fallback) = regenerate([FULL, ValueError("bad request")])
+
+    assert (regenerated, fallback) == ([], ["C"])
+    assert "def node_C(" in notebook
+
+
+def test_a_failed_regeneration_serves_the_fallback_instead_of_raising():
+    fragment = cell("C", "value_B", "value_B")
+    service = AIService()
+    service.clients.register(
+        "sk-test", SimpleNamespace(chat=SimpleNamespace(completions=ScriptedCompletions([FULL, fragment])))
+    )
+
+    def invalid(content):
+        raise ValueError("Generated notebook is invalid")
+
+    async def run():
+        previous = await service.generate_marimo_notebook("Build it", DIAGRAM, "python", "sk-test")
+        service._finalize_notebook = invalid
+        return await service.regenerate_marimo_notebook("Build it", previous, EDITED, "python", "sk-test")
+
+    notebook, regenerated, fallback = asyncio.run(run())
+
+    assert (regenerated, fallback) == (None, [])
+    assert notebook == embed_diagram(service._create_fallback_notebook("Build it", EDITED, "python"), EDITED)
@@ -0,0 +1,83 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from ai_service import AIService
+from single_flight import SingleFlight
+
+NOTEBOOK = "@app.cell\ndef node_A():\n    value_A = 1\n    return (value_A,)\n"
+# Labels no template matches, so the generation goes to the (fake) LLM
+DIAGRAM = "flowchart TD\n    A[Load the quarterly sales ledger] --> B[Fit a seasonal trend model]"
+
+
+class CountingCompletions:
+    """chat.completions stand-in that counts calls and answers after a delay."""
+
+    def __init__(self):
+        self.calls = 0
+
+    async def create(self, **kwargs):
+        self.calls += 1
+        await asyncio.sleep(0.05)
+        return SimpleNamespace(
+            choices=[SimpleNamespace(message=SimpleNamespace(content=NOTEBOOK), finish_reason="stop")],
+            usage=SimpleNamespace(total_tokens=100, prompt_tokens=60, completion_tokens=40),
+        )
+
+
+def test_identical_concurrent_requests_make_one_upstream_call():
+    completions = CountingCompletions()
+    service = AIService()
+    service.clients.register("sk-test", SimpleNamespace(chat=SimpleNamespace(completions=completions)))
+
+    async def burst():
+        return await asyncio.gather(
+            *(service.generate_marimo_notebook("Build it", DIAGRAM, "python", "sk-test") for _ in range(100))
+        )
+
+    results = asyncio.run(burst())
+
+    assert completions.calls == 1
+    assert len(set(results)) == 1 and "value_A = 1" in results[0]
+    assert service.in_flight.stats() == {"in_flight": 0, "leaders": 1, "coalesced": 99}
+
+
+def test_every_follower_gets_the_leaders_exception_and_the_key_is_cleared():
+    flight = SingleFlight()
+    calls = 0
+
+    async def failing():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.01)
+        raise RuntimeError("upstream down")
+
+    async def burst():
+        return await asyncio.gather(*(flight.run("key", failing) for _ in range(10)), return_exceptions=True)
+
+    results = asyncio.run(burst())
+
+    assert calls == 1
+    assert all(isinstance(result, RuntimeError) and str(result) == "upstream down" for result in results)
+    assert "key" not in flight.in_flight
+
+    async def retry():
+        return await flight.run("key", lambda: asyncio.sleep(0, result="fresh"))
+
+    assert asyncio.run(retry()) == "fresh"
+    assert flight.leaders == 2
+
+
+def test_a_cancelled_waiter_leaves_the_shared_call_running():
+    flight = SingleFlight()
+
+    async def burst():
+        waiters = [asyncio.ensure_future(flight.run("key", lambda: asyncio.sleep(0.02, result="done"))) for _ in range(3)]
+        await asyncio.sleep(0)
+        waiters[0].cancel()
+        return await asyncio.gather(*waiters[1:])
+
+    assert asyncio.run(burst()) == ["done", "done"]
+    with pytest.raises(KeyError):
+        flight.in_flight["key"]
@@ -49,16 +49,14 @@ if [ -n "${NOTEBOOK_CONTENT:-}" ]; then
     echo "[start] Writing provided notebook content..."
     printf "%s" "$NOTEBOOK_CONTENT" > "$NOTEBOOK_PATH"
     
-    # Test if the notebook can be compiled
+    # Generated notebooks are validated by the Python service, but /api/save
+    # stores whatever it is sent, so test that the notebook compiles
     if ! python -m py_compile "$NOTEBOOK_PATH" 2>/dev/null; then
         echo "[start] Provided content has syntax errors, using safe fallback"
         create_safe_notebook "$NOTEBOOK_PATH"
-    else
-        # Check if it has required Marimo structure
-        if ! grep -q "import marimo" "$NOTEBOOK_PATH" || ! grep -q "app = marimo.App" "$NOTEBOOK_PATH"; then
-            echo "[start] Content missing Marimo structure, using safe fallback"
-            create_safe_notebook "$NOTEBOOK_PATH"
-        fi
+    elif ! grep -q "^import marimo" "$NOTEBOOK_PATH" || ! grep -q "^app = marimo.App" "$NOTEBOOK_PATH"; then
+        echo "[start] Content missing Marimo structure, using safe fallback"
+        create_safe_notebook "$NOTEBOOK_PATH"
     fi
 else
     echo "[start] No content provided, creating safe default notebook"